@@ -1,12 +1,22 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, g
 from flask_cors import CORS
+import os
 import json
 import random
 import requests
 from openrouter_client import OpenRouterClient
+from tracing import init_tracing, outgoing_headers
+from metrics import init_metrics
+from profiling import init_profiling
+from profile_store import (
+    create_profile_store_from_env, profile_to_json, preference_key, new_user_id, is_valid_user_id, PROFILE_COOKIE
+)
 
 app = Flask(__name__)
 CORS(app)
+init_tracing(app, "app")
+init_metrics(app, "app")
+init_profiling(app, "app")
 
 # URL микросервисов
 OKKONATOR_SERVICE_URL = "http://localhost:5001"
@@ -22,25 +32,29 @@ except Exception as e:
     print(f"Ошибка инициализации OpenRouter клиента: {e}")
     openrouter_client = None
 
-# Глобальные переменные для состояния пользователя
-user_profile = {
-    'mood_joy_sadness': 0.5,  # 0 = грусть, 1 = радость
-    'mood_calm_energy': 0.5,  # 0 = спокойствие, 1 = энергия
-    'alone_company': 'alone',  # 'alone' или 'company'
-    'duration': 'short',  # 'short' или 'full'
-    'preferences': {
-        'liked_movies': [],
-        'disliked_movies': [],
-        'liked_genres': [],
-        'disliked_genres': [],
-        'liked_actors': [],
-        'disliked_actors': []
-    },
-    'okkonator_answers': [],
-    'okkonator_theta': {},  # Профиль Окконатора
-    'chat_history': [],
-    'identified_movies': []
-}
+# Профили пользователей по cookie сессии (общие для воркеров шлюза, см. profile_store.py)
+profile_store = create_profile_store_from_env()
+
+@app.before_request
+def identify_user():
+    """Идентификатор профиля из cookie; новым посетителям выдается новый"""
+    user_id = request.cookies.get(PROFILE_COOKIE)
+    g.new_user = not is_valid_user_id(user_id)
+    g.user_id = new_user_id() if g.new_user else user_id
+
+@app.after_request
+def remember_user(response):
+    if g.get("new_user"):
+        response.set_cookie(PROFILE_COOKIE, g.user_id, max_age=profile_store.ttl_seconds, httponly=True, samesite="Lax")
+    return response
+
+def current_profile():
+    """Профиль текущего посетителя (только чтение)"""
+    return profile_store.get(g.user_id)
+
+def update_current_profile(mutate):
+    """Атомарное изменение профиля текущего посетителя"""
+    return profile_store.update(g.user_id, mutate)
 
 # История подборок пользователя
 selection_history = [
@@ -154,9 +168,6 @@ movies_data = [
     }
 ]
 
-# Глобальная переменная для отслеживания текущего индекса фильма
-current_movie_index = 0
-
 # Главный хаб
 @app.route('/')
 def hub():
@@ -196,7 +207,8 @@ def get_okkonator_results():
         data = request.get_json()
         theta = data.get('theta', {})
         
-        response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/recommendations", 
+        response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/recommendations",
+                               headers=outgoing_headers(),
                                json={'theta': theta, 'top_k': 6})
         
         if response.status_code == 200:
@@ -214,7 +226,8 @@ def get_swipe_results():
         data = request.get_json()
         session_id = data.get('session_id')
         
-        response = requests.post(f"{SWIPE_SERVICE_URL}/api/swipe/recommendations", 
+        response = requests.post(f"{SWIPE_SERVICE_URL}/api/swipe/recommendations",
+                               headers=outgoing_headers(),
                                json={'session_id': session_id, 'top_k': 6})
         
         if response.status_code == 200:
@@ -245,7 +258,7 @@ def get_movies():
 @app.route('/api/current-movie')
 def get_current_movie():
     """Получить текущий фильм для показа"""
-    global current_movie_index
+    current_movie_index = current_profile()['current_movie_index']
     if current_movie_index < len(movies_data):
         return jsonify(movies_data[current_movie_index])
     else:
@@ -254,13 +267,19 @@ def get_current_movie():
 @app.route('/api/swipe', methods=['POST'])
 def swipe_movie():
     """Обработать свайп фильма"""
-    global current_movie_index
     data = request.get_json()
     action = data.get('action')  # 'like' или 'dislike'
     
-    if current_movie_index < len(movies_data):
-        movie = movies_data[current_movie_index]
-        current_movie_index += 1
+    served = []
+    
+    def advance(profile):
+        if profile['current_movie_index'] < len(movies_data):
+            served.append(movies_data[profile['current_movie_index']])
+            profile['current_movie_index'] += 1
+    
+    current_movie_index = update_current_profile(advance)['current_movie_index']
+    if served:
+        movie = served[0]
         
         # Здесь можно добавить логику сохранения предпочтений
         print(f"Пользователь {action} фильм: {movie['title']}")
@@ -277,59 +296,57 @@ def swipe_movie():
 @app.route('/api/reset')
 def reset_movies():
     """Сбросить индекс фильмов"""
-    global current_movie_index
-    current_movie_index = 0
+    update_current_profile(lambda profile: profile.update(current_movie_index=0))
     return jsonify({"success": True, "message": "Индекс сброшен"})
 
 # API для настроек профиля
 @app.route('/api/profile/update', methods=['POST'])
 def update_profile():
     """Обновить настройки профиля"""
-    global user_profile
     data = request.get_json()
     
-    if 'mood_joy_sadness' in data:
-        user_profile['mood_joy_sadness'] = float(data['mood_joy_sadness'])
-    if 'mood_calm_energy' in data:
-        user_profile['mood_calm_energy'] = float(data['mood_calm_energy'])
-    if 'alone_company' in data:
-        user_profile['alone_company'] = data['alone_company']
-    if 'duration' in data:
-        user_profile['duration'] = data['duration']
+    def apply(user_profile):
+        if 'mood_joy_sadness' in data:
+            user_profile['mood_joy_sadness'] = float(data['mood_joy_sadness'])
+        if 'mood_calm_energy' in data:
+            user_profile['mood_calm_energy'] = float(data['mood_calm_energy'])
+        if 'alone_company' in data:
+            user_profile['alone_company'] = data['alone_company']
+        if 'duration' in data:
+            user_profile['duration'] = data['duration']
     
-    return jsonify({"success": True, "profile": user_profile})
+    user_profile = update_current_profile(apply)
+    return jsonify({"success": True, "profile": profile_to_json(user_profile)})
 
 @app.route('/api/profile')
 def get_profile():
     """Получить текущий профиль"""
-    return jsonify(user_profile)
+    return jsonify(profile_to_json(current_profile()))
 
 # API для свайпов
 @app.route('/api/swipe/action', methods=['POST'])
 def swipe_action():
     """Обработать действие свайпа"""
-    global user_profile
     data = request.get_json()
     action = data.get('action')  # 'like', 'dislike', 'superlike'
     content = data.get('content')
     content_type = data.get('type', 'movies')
     
     if action == 'like' or action == 'superlike':
-        if content_type == 'movies':
-            user_profile['preferences']['liked_movies'].append(content['id'])
-        elif content_type == 'genres':
-            user_profile['preferences']['liked_genres'].append(content)
-        elif content_type == 'actors':
-            user_profile['preferences']['liked_actors'].append(content)
+        prefix = 'liked'
     elif action == 'dislike':
-        if content_type == 'movies':
-            user_profile['preferences']['disliked_movies'].append(content['id'])
-        elif content_type == 'genres':
-            user_profile['preferences']['disliked_genres'].append(content)
-        elif content_type == 'actors':
-            user_profile['preferences']['disliked_actors'].append(content)
+        prefix = 'disliked'
+    else:
+        prefix = None
     
-    return jsonify({"success": True, "profile": user_profile})
+    def apply(user_profile):
+        if prefix is None or content_type not in ('movies', 'genres', 'actors'):
+            return
+        key = content['id'] if content_type == 'movies' else preference_key(content)
+        user_profile['preferences'][f'{prefix}_{content_type}'].add(key)
+    
+    user_profile = update_current_profile(apply)
+    return jsonify({"success": True, "profile": profile_to_json(user_profile)})
 
 # API для Окконатора - прокси к микросервису
 @app.route('/api/okkonator/question', methods=['POST'])
@@ -343,7 +360,8 @@ def get_okkonator_question():
         
         print(f"Запрос вопроса: theta={theta}, asked_ids={asked_ids}")
         
-        response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/next-question", 
+        response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/next-question",
+                               headers=outgoing_headers(),
                                json={"theta": theta, "asked_ids": asked_ids})
         
         print(f"Ответ микросервиса: {response.status_code}")
@@ -391,6 +409,7 @@ def submit_okkonator_answer():
         
         # Отправляем в микросервис
         response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/answer",
+                               headers=outgoing_headers(),
                                json={
                                    "theta": theta,
                                    "answer_value": answer_value,
@@ -431,6 +450,7 @@ def get_okkonator_recommendations():
         print(f"Запрос рекомендаций: theta={theta}, top_k={top_k}")
         
         response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/recommendations",
+                               headers=outgoing_headers(),
                                json={"theta": theta, "top_k": top_k})
         
         if response.status_code == 200:
@@ -443,6 +463,28 @@ def get_okkonator_recommendations():
     except Exception as e:
         return jsonify({"error": f"Ошибка: {str(e)}"}), 500
 
+@app.route('/api/okkonator/group-recommendations', methods=['POST'])
+def get_okkonator_group_recommendations():
+    """Получить групповые рекомендации от Окконатора"""
+    try:
+        data = request.get_json()
+        
+        response = requests.post(f"{OKKONATOR_SERVICE_URL}/api/okkonator/group-recommendations",
+                               headers=outgoing_headers(),
+                               json={"members": data.get('members', []), "top_k": data.get('top_k', 6)})
+        
+        if response.status_code == 200:
+            return jsonify(response.json())
+        elif response.status_code == 400:
+            return jsonify(response.json()), 400
+        else:
+            return jsonify({"error": "Ошибка получения групповых рекомендаций"}), 500
+            
+    except requests.exceptions.ConnectionError:
+        return jsonify({"error": "Микросервис Окконатора не запущен"}), 500
+    except Exception as e:
+        return jsonify({"error": f"Ошибка: {str(e)}"}), 500
+
 # API для чата
 @app.route('/api/chat/message', methods=['POST'])
 def chat_message():
@@ -463,6 +505,7 @@ def chat_message():
         try:
             response = requests.post(
                 f"{SIMPLE_CHAT_SERVICE_URL}/api/chat/message",
+                headers=outgoing_headers(),
                 json={
                     'user_id': user_id,
                     'message': message,
@@ -479,11 +522,11 @@ def chat_message():
                     ai_response = service_data.get('response', '')
                     
                     # Сохраняем в историю чата
-                    user_profile['chat_history'].append({
+                    update_current_profile(lambda user_profile: user_profile['chat_history'].append({
                         'user': message,
                         'assistant': ai_response,
                         'timestamp': 'now'
-                    })
+                    }))
                     
                     # Простые рекомендации на основе ответа
                     recommendations = []
@@ -526,11 +569,11 @@ def chat_message():
             
             response_text = random.choice(responses)
             
-            user_profile['chat_history'].append({
+            update_current_profile(lambda user_profile: user_profile['chat_history'].append({
                 'user': message,
                 'assistant': response_text,
                 'timestamp': 'now'
-            })
+            }))
             
             # Простая логика рекомендаций на основе сообщения
             recommendations = []
@@ -577,6 +620,7 @@ def get_chat_history(user_id):
     try:
         response = requests.get(
             f"{MOVIE_RECOMMENDATION_SERVICE_URL}/api/movie-recommendation/history/{user_id}",
+            headers=outgoing_headers(),
             timeout=10
         )
         
@@ -590,7 +634,7 @@ def get_chat_history(user_id):
             
     except requests.exceptions.RequestException:
         # Fallback к локальной истории
-        history = user_profile.get('chat_history', [])
+        history = current_profile()['chat_history']
         return jsonify({
             "success": True,
             "user_id": user_id,
@@ -604,6 +648,7 @@ def clear_chat_history(user_id):
     try:
         response = requests.post(
             f"{MOVIE_RECOMMENDATION_SERVICE_URL}/api/movie-recommendation/clear-history/{user_id}",
+            headers=outgoing_headers(),
             timeout=10
         )
         
@@ -617,7 +662,7 @@ def clear_chat_history(user_id):
             
     except requests.exceptions.RequestException:
         # Fallback - очищаем локальную историю
-        user_profile['chat_history'] = []
+        update_current_profile(lambda user_profile: user_profile.update(chat_history=[]))
         return jsonify({
             "success": True,
             "message": f"История диалога для пользователя {user_id} очищена"
@@ -630,6 +675,7 @@ def get_available_models():
     try:
         response = requests.get(
             f"{MOVIE_RECOMMENDATION_SERVICE_URL}/api/movie-recommendation/models",
+            headers=outgoing_headers(),
             timeout=10
         )
         
@@ -661,6 +707,7 @@ def chat_service_health():
     try:
         response = requests.get(
             f"{MOVIE_RECOMMENDATION_SERVICE_URL}/health",
+            headers=outgoing_headers(),
             timeout=5
         )
         
@@ -726,12 +773,12 @@ def chat_stars():
     responses = character_responses.get(character, ["Отличный выбор! Рекомендую посмотреть что-то интересное."])
     response = random.choice(responses)
     
-    user_profile['chat_history'].append({
+    update_current_profile(lambda user_profile: user_profile['chat_history'].append({
         'user': message,
         'assistant': response,
         'character': character,
         'timestamp': 'now'
-    })
+    }))
     
     # Персонализированные рекомендации на основе звезды
     recommendations = []
@@ -829,13 +876,16 @@ def get_results():
     """Получить рекомендации на основе профиля"""
     # Простая логика рекомендаций
     recommendations = []
+    user_profile = current_profile()
+    liked_movies = user_profile['preferences']['liked_movies']  # множества: проверка за O(1)
+    disliked_movies = user_profile['preferences']['disliked_movies']
     
     # Фильтруем по предпочтениям
     for movie in movies_data:
         score = 0
-        if movie['id'] in user_profile['preferences']['liked_movies']:
+        if movie['id'] in liked_movies:
             score += 100
-        if movie['id'] in user_profile['preferences']['disliked_movies']:
+        if movie['id'] in disliked_movies:
             score -= 100
         
         # Учитываем настроение
@@ -858,7 +908,7 @@ def get_results():
     
     return jsonify({
         "recommendations": recommendations[:10],
-        "profile": user_profile
+        "profile": profile_to_json(user_profile)
     })
 
 # API для истории подборок
@@ -871,7 +921,8 @@ def get_selection_history():
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    debug = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+    app.run(debug=debug, use_reloader=False, host='0.0.0.0', port=5000)
 
 
 
@@ -9,6 +9,9 @@ import pickle
 import json
 from collections import Counter
 import re
+import os
+
+from sparse_embeddings import normalize_rows, save_embeddings, save_vectorizer
 
 def analyze_imdb_data(csv_path="../data/IMBD.csv"):
     """Анализирует данные IMDB и извлекает все параметры"""
@@ -153,31 +156,33 @@ def create_embeddings(df, model_kind, model):
     if model_kind == "st":
         embeddings = model.encode(texts, normalize_embeddings=True)
     else:
-        embeddings = model.fit_transform(texts).astype(np.float32)
-        A = embeddings.toarray()
-        norms = np.linalg.norm(A, axis=1, keepdims=True) + 1e-9
-        embeddings = A / norms
+        # CSR без densify: плотная матрица каталог x словарь занимала бы гигабайты
+        embeddings = normalize_rows(model.fit_transform(texts))
     
     print(f"Создано эмбеддингов размерности: {embeddings.shape}")
     return embeddings
 
-def save_vector_db(df, embeddings, metadata, output_dir="../data"):
+def save_vector_db(df, embeddings, metadata, output_dir="../data", vectorizer=None):
     """Сохраняет векторную базу данных"""
-    import os
     os.makedirs(output_dir, exist_ok=True)
     
     print(f"\n=== СОХРАНЕНИЕ ВЕКТОРНОЙ БД ===")
     
     # Сохраняем данные
     df.to_pickle(f"{output_dir}/movies_df.pkl")
-    np.save(f"{output_dir}/embeddings.npy", embeddings)
+    embeddings_file = save_embeddings(output_dir, "embeddings", embeddings)
     
     with open(f"{output_dir}/metadata.json", "w", encoding="utf-8") as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
     
     print(f"Сохранено в директории: {output_dir}")
     print(f"  - movies_df.pkl: {len(df)} фильмов")
-    print(f"  - embeddings.npy: {embeddings.shape}")
+    print(f"  - {os.path.basename(embeddings_file)}: {embeddings.shape}")
+    
+    # Обученный TF-IDF: сервис кодирует запросы в том же пространстве без повторного обучения
+    if vectorizer is not None:
+        save_vectorizer(f"{output_dir}/movies_tfidf.npz", vectorizer)
+        print(f"  - movies_tfidf.npz: словарь TF-IDF ({len(vectorizer.vocabulary_)} терминов)")
     print(f"  - metadata.json: метаданные")
 
 def main():
@@ -203,7 +208,7 @@ def main():
     embeddings = create_embeddings(df, model_kind, model)
     
     # Сохранение
-    save_vector_db(df, embeddings, metadata)
+    save_vector_db(df, embeddings, metadata, vectorizer=model if model_kind == "tfidf" else None)
     
     print("\n=== ГОТОВО ===")
     print("Векторная база данных создана и готова к использованию!")
@@ -14,6 +14,9 @@ from typing import List, Dict, Any, Tuple
 from datetime import datetime
 import logging
 
+from sparse_embeddings import normalize_rows, save_embeddings, save_vectorizer
+from title_features import title_flags
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -125,6 +128,9 @@ def create_metadata(row: pd.Series, index: int) -> Dict[str, Any]:
     else:
         metadata["actors"] = []
     
+    # Флаги для бонусов ранжирования и объяснений (разбор строк один раз)
+    metadata["flags"] = title_flags(metadata)
+    
     return metadata
 
 def create_embeddings(df: pd.DataFrame, model_kind: str, model) -> np.ndarray:
@@ -141,10 +147,8 @@ def create_embeddings(df: pd.DataFrame, model_kind: str, model) -> np.ndarray:
     if model_kind == "st":
         embeddings = model.encode(texts, normalize_embeddings=True, show_progress_bar=True)
     else:
-        embeddings = model.fit_transform(texts).astype(np.float32)
-        A = embeddings.toarray()
-        norms = np.linalg.norm(A, axis=1, keepdims=True) + 1e-9
-        embeddings = A / norms
+        # CSR без densify: плотная матрица каталог x словарь занимала бы гигабайты
+        embeddings = normalize_rows(model.fit_transform(texts))
     
     logger.info(f"Создано эмбеддингов размерности: {embeddings.shape}")
     return embeddings
@@ -211,7 +215,7 @@ def analyze_okko_data(df: pd.DataFrame) -> Dict[str, Any]:
     return metadata
 
 def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str, Any], 
-                  output_dir: str = "../data") -> None:
+                  output_dir: str = "../data", vectorizer=None) -> None:
     """Сохраняет векторную базу данных"""
     os.makedirs(output_dir, exist_ok=True)
     
@@ -225,7 +229,7 @@ def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str,
     
     # Сохраняем данные
     df.to_pickle(f"{output_dir}/okko_movies_df.pkl")
-    np.save(f"{output_dir}/okko_embeddings.npy", embeddings)
+    embeddings_file = save_embeddings(output_dir, "okko_embeddings", embeddings)
     
     # Сохраняем общие метаданные
     with open(f"{output_dir}/okko_metadata.json", "w", encoding="utf-8") as f:
@@ -237,7 +241,12 @@ def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str,
     
     logger.info(f"Сохранено в директории: {output_dir}")
     logger.info(f"  - okko_movies_df.pkl: {len(df)} фильмов")
-    logger.info(f"  - okko_embeddings.npy: эмбеддинги {embeddings.shape}")
+    logger.info(f"  - {os.path.basename(embeddings_file)}: эмбеддинги {embeddings.shape}")
+    
+    # Обученный TF-IDF: сервис кодирует запросы в том же пространстве без повторного обучения
+    if vectorizer is not None:
+        save_vectorizer(f"{output_dir}/okko_tfidf.npz", vectorizer)
+        logger.info(f"  - okko_tfidf.npz: словарь TF-IDF ({len(vectorizer.vocabulary_)} терминов)")
     logger.info(f"  - okko_metadata.json: общие метаданные")
     logger.info(f"  - okko_records_metadata.json: метаданные записей")
 
@@ -282,7 +291,7 @@ def main():
         embeddings = create_embeddings(df, model_kind, model)
         
         # Сохранение
-        save_vector_db(df, embeddings, metadata)
+        save_vector_db(df, embeddings, metadata, vectorizer=model if model_kind == "tfidf" else None)
         
         logger.info("=== ГОТОВО ===")
         logger.info("Векторная база данных Okko создана и готова к использованию!")
@@ -4,9 +4,29 @@ import pandas as pd
 import json
 import os
 
+try:
+    from back.sparse_embeddings import (
+        embeddings_path, is_sparse, load_sparse, normalize_rows, save_sparse, load_vectorizer, vectorizer_path
+    )
+except ImportError:
+    from sparse_embeddings import (
+        embeddings_path, is_sparse, load_sparse, normalize_rows, save_sparse, load_vectorizer, vectorizer_path
+    )
+
+# Трассировка этапов запроса (tracing.py в корне проекта; вне сервисов замеров нет)
+try:
+    from tracing import span
+except ImportError:
+    from contextlib import nullcontext
+
+    def span(name, **attributes):
+        return nullcontext()
+
 ETA = 0.3
 QUESTIONS_MAX = 15
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# torch - sentence-transformers, onnx - ONNX Runtime (back/onnx_encoder.py)
+ENCODER_BACKEND = os.getenv("OKKO_ENCODER_BACKEND", "torch").lower()
 
 # Расширенные оси для всех параметров IMDB
 AXES = [
@@ -77,7 +97,11 @@ def load_vector_db(data_dir="../data"):
     """Загружает предварительно созданную векторную базу данных"""
     try:
         df = pd.read_pickle(f"{data_dir}/movies_df.pkl")
-        embeddings = np.load(f"{data_dir}/embeddings.npy")
+        path = embeddings_path(data_dir, "embeddings")
+        if path is None:
+            raise FileNotFoundError(f"{data_dir}/embeddings.npy")
+        # mmap: страницы подгружаются по мере обращения, старт не ждет чтения всего файла
+        embeddings = load_sparse(path) if path.endswith(".npz") else np.load(path, mmap_mode="r")
         
         with open(f"{data_dir}/metadata.json", "r", encoding="utf-8") as f:
             metadata = json.load(f)
@@ -88,6 +112,44 @@ def load_vector_db(data_dir="../data"):
         print("Векторная БД не найдена. Запустите analyze_and_build_db.py сначала.")
         return None, None, None
 
+def load_embeddings_snapshot(data_dir, source_path, prefix="fallback"):
+    """
+    Загружает снимок (df + эмбеддинги), построенный из CSV при прошлом запуске
+    
+    Снимок считается устаревшим, если CSV изменен позже него.
+    Returns:
+        (df, embeddings) или (None, None)
+    """
+    df_path = f"{data_dir}/{prefix}_movies_df.pkl"
+    emb_path = embeddings_path(data_dir, f"{prefix}_embeddings")
+    if not (os.path.exists(df_path) and emb_path):
+        return None, None
+    if os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(emb_path):
+        print(f"Снимок эмбеддингов старше {source_path}, пересоздаем")
+        return None, None
+    df = pd.read_pickle(df_path)
+    embeddings = load_sparse(emb_path) if emb_path.endswith(".npz") else np.load(emb_path, mmap_mode="r")
+    print(f"Загружен снимок эмбеддингов: {len(df)} фильмов")
+    return df, embeddings
+
+def save_embeddings_snapshot(data_dir, df, embeddings, prefix="fallback"):
+    """Сохраняет df и эмбеддинги, чтобы следующий запуск не кодировал каталог заново"""
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        df.to_pickle(f"{data_dir}/{prefix}_movies_df.pkl")
+        # Сначала во временный файл: прерванная запись не оставит битый снимок
+        if is_sparse(embeddings):
+            tmp_path = f"{data_dir}/{prefix}_embeddings.tmp.npz"
+            save_sparse(tmp_path, embeddings)
+            os.replace(tmp_path, f"{data_dir}/{prefix}_embeddings.npz")
+        else:
+            tmp_path = f"{data_dir}/{prefix}_embeddings.tmp.npy"
+            np.save(tmp_path, np.asarray(embeddings, dtype=np.float32))
+            os.replace(tmp_path, f"{data_dir}/{prefix}_embeddings.npy")
+        print(f"Снимок эмбеддингов сохранен в {data_dir}")
+    except OSError as e:
+        print(f"Не удалось сохранить снимок эмбеддингов: {e}")
+
 def load_movies_fallback(path="../data/IMBD.csv"):
     """Загружает фильмы напрямую из CSV (fallback)"""
     df = pd.read_csv(path)
@@ -122,13 +184,30 @@ def load_movies_fallback(path="../data/IMBD.csv"):
     
     return df
 
-def try_load_model():
-    # Пытаемся sentence-transformers; если не вышло — TF-IDF
+def try_load_model(data_dir=None):
+    # ONNX Runtime (если выбран), затем sentence-transformers; если не вышло — TF-IDF.
+    # data_dir - векторная БД: ее обученный TF-IDF кодирует запросы в пространстве каталога
+    vectorizer = None
+    if data_dir is not None and vectorizer_path(data_dir, "movies"):
+        vectorizer = load_vectorizer(vectorizer_path(data_dir, "movies"))
+        store_embeddings = embeddings_path(data_dir, "embeddings")
+        if store_embeddings and store_embeddings.endswith(".npz"):
+            return ("tfidf", vectorizer)
+    if ENCODER_BACKEND == "onnx":
+        try:
+            from back.onnx_encoder import load_onnx_encoder
+        except ImportError:
+            from onnx_encoder import load_onnx_encoder
+        encoder = load_onnx_encoder(MODEL_NAME)
+        if encoder is not None:
+            return ("onnx", encoder)
     try:
         from sentence_transformers import SentenceTransformer
         model = SentenceTransformer(MODEL_NAME)
         return ("st", model)
     except Exception as e:
+        if vectorizer is not None:
+            return ("tfidf", vectorizer)
         from sklearn.feature_extraction.text import TfidfVectorizer
         vec = TfidfVectorizer(max_features=5000)
         return ("tfidf", vec)
@@ -137,26 +216,25 @@ def build_item_embeddings(df, model_kind, model):
     texts = (df["title"].fillna("") + " " +
              df["description"].fillna("") + " " +
              df["genre"].fillna(""))
-    if model_kind == "st":
+    if model_kind in ("st", "onnx"):
         X = model.encode(texts.tolist(), normalize_embeddings=True)
         return X
     else:
-        X = model.fit_transform(texts.tolist()).astype(np.float32)
-        A = X.toarray()
-        norms = np.linalg.norm(A, axis=1, keepdims=True) + 1e-9
-        return A / norms
+        # CSR без densify: плотная матрица каталог x словарь не помещается в память
+        return normalize_rows(model.fit_transform(texts.tolist()))
 
 def embed_text(text, model_kind, model):
-    if model_kind == "st":
-        v = model.encode([text], normalize_embeddings=True)[0]
-        return v
-    else:
-        X = model.transform([text]).astype(np.float32).toarray()[0]
-        v = X / (np.linalg.norm(X) + 1e-9)
-        return v
+    with span("embed_text", model_kind=model_kind):
+        if model_kind in ("st", "onnx"):
+            v = model.encode([text], normalize_embeddings=True)[0]
+            return v
+        else:
+            # Одна строка словаря: плотный вектор запроса для CSR @ dense в cosine_sim
+            return normalize_rows(model.transform([text])).toarray()[0]
 
 def cosine_sim(a, B):
-    return (B @ a) / (np.linalg.norm(a)+1e-9)
+    with span("cosine_sim", rows=int(B.shape[0])):
+        return (B @ a) / (np.linalg.norm(a)+1e-9)
 
 def profile_keywords(theta):
     t = theta
@@ -233,52 +311,91 @@ def explain(row, theta):
     
     return " · ".join(bits[:3]) if bits else "совпадение по общему вкусу"
 
-def filter_and_rank(df, ITEM_EMB, theta, model_kind, model, top_k=6):
+def _normalized(values, mask):
+    """(values - min) / max(1, max - min) по строкам mask (float32 на весь каталог)"""
+    if not mask.any():
+        return np.zeros(len(values), dtype=np.float32)
+    low, high = values[mask].min(), values[mask].max()
+    return ((values - low) / max(1, high - low)).astype(np.float32)
+
+def _log_votes_share(votes_log, mask):
+    """votes_log / max по строкам mask (0, если голосов нет)"""
+    votes_max = votes_log[mask].max() if mask.any() else 0.0
+    if votes_max <= 0:
+        return np.zeros(len(votes_log), dtype=np.float32)
+    return (votes_log / votes_max).astype(np.float32)
+
+def score_features(df):
+    """
+    Статические компоненты score IMDB ранжирования (не зависят от theta)
+    
+    Считаются один раз при загрузке каталога в непрерывные float32 массивы,
+    запрос складывает нужные из них с вектором сходства. Нормировки года и
+    голосов берутся по всему каталогу и отдельно по тайтлам без насилия
+    (жесткий фильтр violence_tol < 0), как если бы фильтр применялся на запросе.
+    """
+    safe = df["violence"].to_numpy() == 0
+    everything = np.ones(len(df), dtype=bool)
+    year = df["year"].to_numpy(dtype=np.float64)
+    votes_log = np.log10(df["votes"].to_numpy(dtype=np.float64) + 1)
+    return {
+        "safe": safe,
+        "length_penalty": np.where(df["duration"].to_numpy() <= 110, 0.0, -0.1).astype(np.float32),
+        "rating": (0.1 * (df["rating"].to_numpy(dtype=np.float64) - 6.0) / 4.0).astype(np.float32),  # нормализация 6-10
+        "year": _normalized(year, everything),
+        "year_safe": _normalized(year, safe),
+        "popularity": _log_votes_share(votes_log, everything),
+        "popularity_safe": _log_votes_share(votes_log, safe),
+    }
+
+def filter_and_rank(df, ITEM_EMB, theta, model_kind, model, top_k=6, features=None):
+    """
+    Фильтрует и ранжирует каталог IMDB
+    
+    features - результат score_features(df); сервисам стоит считать его при
+    загрузке, иначе он пересчитывается на каждый запрос.
+    """
+    if features is None:
+        features = score_features(df)
     user_text = profile_keywords(theta)
     user_emb = embed_text(user_text, model_kind, model)
-    sims = cosine_sim(user_emb, ITEM_EMB)
-    res = df.copy()
-    res["sim"] = sims
-
-    # Жёсткие фильтры
-    if theta["violence_tol"] < 0:
-        res = res[res["violence"] == 0]
-
-    # Мягкие фильтры
-    res["length_penalty"] = 0.0
-    res["year_bonus"] = 0.0
-    res["rating_bonus"] = 0.0
-    res["popularity_bonus"] = 0.0
-
-    # Длина
-    if theta["length_short"] > 0.2:
-        res["length_penalty"] = np.where(res["duration"] <= 110, 0.0, -0.1)
-
-    # Новизна/классика
-    if len(res) > 0:
-        year_min, year_max = res["year"].min(), res["year"].max()
-        rng = max(1, year_max - year_min)
+    sims = np.asarray(cosine_sim(user_emb, ITEM_EMB), dtype=np.float32).ravel()
+
+    with span("filters", rows=len(sims)):
+        # Жёсткий фильтр: нормировки года и голосов - по оставшимся тайтлам
+        hard_filter = theta["violence_tol"] < 0
+        suffix = "_safe" if hard_filter else ""
+
+        score = sims.copy()
+        # Длина
+        if theta["length_short"] > 0.2:
+            score += features["length_penalty"]
+        # Новизна/классика
         if theta["recent"] > 0.2:
-            res["year_bonus"] = 0.05 * ((res["year"] - year_min) / rng)
+            score += np.float32(0.05) * features["year" + suffix]
         elif theta["classic"] > 0.2:
-            res["year_bonus"] = -0.05 * ((res["year"] - year_min) / rng)
+            score -= np.float32(0.05) * features["year" + suffix]
         elif theta["novelty"] > 0.2:
-            res["year_bonus"] = 0.03 * ((res["year"] - year_min) / rng)
-
-    # Рейтинг
-    if theta["high_rating"] > 0.2:
-        res["rating_bonus"] = 0.1 * (res["rating"] - 6.0) / 4.0  # нормализация 6-10
-
-    # Популярность
-    if theta["popular"] > 0.2:
-        votes_log = np.log10(res["votes"] + 1)
-        votes_max = votes_log.max()
-        if votes_max > 0:
-            res["popularity_bonus"] = 0.05 * (votes_log / votes_max)
-
-    res["score"] = (res["sim"] + res["length_penalty"] + 
-                   res["year_bonus"] + res["rating_bonus"] + res["popularity_bonus"])
-    res = res.sort_values("score", ascending=False).head(top_k)
+            score += np.float32(0.03) * features["year" + suffix]
+        # Рейтинг
+        if theta["high_rating"] > 0.2:
+            score += features["rating"]
+        # Популярность
+        if theta["popular"] > 0.2:
+            score += np.float32(0.05) * features["popularity" + suffix]
+
+        if hard_filter:
+            score[~features["safe"]] = -np.inf
+    with span("sort_top_k"):
+        available = int(features["safe"].sum()) if hard_filter else len(score)
+        top_k = min(top_k, available)
+        if top_k <= 0:
+            return df.iloc[:0].assign(sim=np.float32(0), score=np.float32(0))
+        idx = np.argpartition(-score, top_k - 1)[:top_k] if top_k < len(score) else np.arange(len(score))
+        idx = idx[np.argsort(-score[idx], kind="stable")]
+        res = df.iloc[idx].copy()
+        res["sim"] = sims[idx]
+        res["score"] = score[idx]
     return res
 
 def init_theta():
@@ -319,7 +436,8 @@ def main():
         ITEM_EMB = build_item_embeddings(df, model_kind, model)
     else:
         print("Используем предварительно созданную векторную БД")
-        model_kind, model = try_load_model()
+        model_kind, model = try_load_model("../data")
+    features = score_features(df)
 
     theta = init_theta()
     asked = set()
@@ -355,7 +473,7 @@ def main():
         asked.add(q["id"])
 
     print("\n=== Подборка для вас ===")
-    recs = filter_and_rank(df, ITEM_EMB, theta, model_kind, model, top_k=6)
+    recs = filter_and_rank(df, ITEM_EMB, theta, model_kind, model, top_k=6, features=features)
     if len(recs) == 0:
         print("Ничего не найдено. Ослабьте ограничения и попробуйте снова.")
     else:
@@ -13,9 +13,31 @@ import os
 import re
 from typing import Dict, List, Any, Optional
 
+# Трассировка этапов запроса (tracing.py в корне проекта; вне сервисов замеров нет)
+try:
+    from tracing import span
+except ImportError:
+    from contextlib import nullcontext
+
+    def span(name, **attributes):
+        return nullcontext()
+
+try:
+    from back.quantized_embeddings import QuantizedEmbeddings, load_embeddings, rerank_candidates
+    from back.sparse_embeddings import embeddings_path, normalize_rows, load_vectorizer, vectorizer_path
+    from back.title_features import attach_title_flags, get_title_flags, AGE_FAMILY, AGE_MATURE, AGE_ADULT
+except ImportError:
+    from quantized_embeddings import QuantizedEmbeddings, load_embeddings, rerank_candidates
+    from sparse_embeddings import embeddings_path, normalize_rows, load_vectorizer, vectorizer_path
+    from title_features import attach_title_flags, get_title_flags, AGE_FAMILY, AGE_MATURE, AGE_ADULT
+
 ETA = 0.3
 QUESTIONS_MAX = 15
+# Раньше этого числа ответов анкета не останавливается, даже если подборка устойчива
+QUESTIONS_MIN = 5
 MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# torch - sentence-transformers, onnx - ONNX Runtime (back/onnx_encoder.py)
+ENCODER_BACKEND = os.getenv("OKKO_ENCODER_BACKEND", "torch").lower()
 
 # Расширенные оси для параметров Okko
 AXES = [
@@ -101,6 +123,35 @@ LIKERT = {
     "5":  2,   # да
 }
 
+# Матричная форма анкеты: theta - вектор по AXES, цели вопросов - строки
+# QUESTION_MATRIX (вопросы x оси), признаки тайтлов - строки build_item_features
+AXIS_INDEX = {ax: i for i, ax in enumerate(AXES)}
+QUESTION_INDEX = {q["id"]: i for i, q in enumerate(QUESTIONS)}
+
+def targets_vector(targets):
+    """Цели вопроса {ось: вес} как вектор по AXES"""
+    vec = np.zeros(len(AXES), dtype=np.float32)
+    for ax, weight in targets.items():
+        if ax in AXIS_INDEX:
+            vec[AXIS_INDEX[ax]] = weight
+    return vec
+
+QUESTION_MATRIX = np.stack([targets_vector(q["targets"]) for q in QUESTIONS])
+
+# Выбор вопроса по ожидаемому приросту информации
+EIG_CANDIDATES = 2000     # кандидатов (лидеров по признакам), среди которых различаем
+EIG_TEMPERATURE = 0.25    # температура распределения над кандидатами
+ANSWER_SHARPNESS = 2.0    # крутизна P(ответ "да" | тайтл) по совпадению с целями
+# Флаги жанров тайтла (title_features.GENRE_KEYWORDS) -> оси анкеты
+GENRE_FLAG_AXES = {
+    "comedy": ("genre_comedy", "humor"),
+    "horror": ("genre_horror", "darkness"),
+}
+EUROPEAN_COUNTRIES = (
+    "великобритания", "франция", "германия", "италия", "испания", "швеция", "дания",
+    "норвегия", "финляндия", "польша", "бельгия", "нидерланды", "ирландия", "австрия"
+)
+
 def safe_str(value):
     """Безопасное преобразование в строку"""
     if pd.isna(value):
@@ -111,26 +162,35 @@ def safe_str(value):
         return str(value)
     return str(value)
 
+def _attach_flags(records_metadata):
+    """Флаги тайтлов для метаданных, построенных до их появления"""
+    added = attach_title_flags(records_metadata)
+    if added:
+        print(f"Флаги тайтлов рассчитаны при загрузке: {added} записей (пересоберите БД, чтобы сохранить их)")
+
 def load_okko_vector_db(data_dir="data"):
     """Загружает векторную базу данных Okko"""
     try:
         # Пробуем загрузить тестовые данные сначала
         test_files = [
             f"{data_dir}/okko_test_movies_df.pkl",
-            f"{data_dir}/okko_test_embeddings.npy", 
             f"{data_dir}/okko_test_metadata.json",
             f"{data_dir}/okko_test_records_metadata.json"
         ]
         
-        if all(os.path.exists(f) for f in test_files):
+        # Эмбеддинги: .npy (плотные) или .npz (TF-IDF CSR)
+        test_embeddings = embeddings_path(data_dir, "okko_test_embeddings")
+        if test_embeddings and all(os.path.exists(f) for f in test_files):
+            # Эмбеддинги через mmap (или квантованная копия, OKKO_EMBEDDING_DTYPE)
             df = pd.read_pickle(f"{data_dir}/okko_test_movies_df.pkl")
-            embeddings = np.load(f"{data_dir}/okko_test_embeddings.npy")
+            embeddings = load_embeddings(test_embeddings)
             
             with open(f"{data_dir}/okko_test_metadata.json", "r", encoding="utf-8") as f:
                 metadata = json.load(f)
             
             with open(f"{data_dir}/okko_test_records_metadata.json", "r", encoding="utf-8") as f:
                 records_metadata = json.load(f)
+            _attach_flags(records_metadata)
             
             print(f"Загружена тестовая векторная БД Okko: {len(df)} фильмов/сериалов")
             return df, embeddings, metadata, records_metadata
@@ -138,20 +198,21 @@ def load_okko_vector_db(data_dir="data"):
         # Пробуем загрузить полные данные
         full_files = [
             f"{data_dir}/okko_movies_df.pkl",
-            f"{data_dir}/okko_embeddings.npy",
             f"{data_dir}/okko_metadata.json",
             f"{data_dir}/okko_records_metadata.json"
         ]
         
-        if all(os.path.exists(f) for f in full_files):
+        full_embeddings = embeddings_path(data_dir, "okko_embeddings")
+        if full_embeddings and all(os.path.exists(f) for f in full_files):
             df = pd.read_pickle(f"{data_dir}/okko_movies_df.pkl")
-            embeddings = np.load(f"{data_dir}/okko_embeddings.npy")
+            embeddings = load_embeddings(full_embeddings)
             
             with open(f"{data_dir}/okko_metadata.json", "r", encoding="utf-8") as f:
                 metadata = json.load(f)
             
             with open(f"{data_dir}/okko_records_metadata.json", "r", encoding="utf-8") as f:
                 records_metadata = json.load(f)
+            _attach_flags(records_metadata)
             
             print(f"Загружена полная векторная БД Okko: {len(df)} фильмов/сериалов")
             return df, embeddings, metadata, records_metadata
@@ -163,14 +224,52 @@ def load_okko_vector_db(data_dir="data"):
         print(f"Ошибка загрузки векторной БД Okko: {e}")
         return None, None, None, None
 
-def load_model():
+def load_fitted_vectorizer(data_dir="data"):
+    """
+    Обученный TF-IDF векторной БД, которую выберет load_okko_vector_db
+    
+    Returns:
+        (vectorizer, store_is_sparse) - vectorizer None, если не сохранен
+    """
+    store = "okko_test" if embeddings_path(data_dir, "okko_test_embeddings") else "okko"
+    store_embeddings = embeddings_path(data_dir, f"{store}_embeddings")
+    store_is_sparse = bool(store_embeddings and store_embeddings.endswith(".npz"))
+    path = vectorizer_path(data_dir, store)
+    if path is None:
+        return None, store_is_sparse
+    try:
+        return load_vectorizer(path), store_is_sparse
+    except Exception as e:
+        print(f"Не удалось загрузить TF-IDF из {path}: {e}")
+        return None, store_is_sparse
+
+def load_model(data_dir="data"):
     """Загружает модель для создания эмбеддингов"""
+    vectorizer, store_is_sparse = load_fitted_vectorizer(data_dir)
+    if vectorizer is not None and store_is_sparse:
+        # Каталог закодирован TF-IDF: векторы трансформера не совпали бы с ним по пространству
+        print(f"Используем сохраненный TF-IDF ({len(vectorizer.vocabulary_)} терминов)")
+        return ("tfidf", vectorizer)
+    
+    if ENCODER_BACKEND == "onnx":
+        try:
+            from back.onnx_encoder import load_onnx_encoder
+        except ImportError:
+            from onnx_encoder import load_onnx_encoder
+        encoder = load_onnx_encoder(MODEL_NAME)
+        if encoder is not None:
+            return ("onnx", encoder)
+        print("Используем PyTorch энкодер")
+    
     try:
         from sentence_transformers import SentenceTransformer
         model = SentenceTransformer(MODEL_NAME)
         return ("st", model)
     except Exception as e:
         print(f"Не удалось загрузить SentenceTransformer: {e}")
+        if vectorizer is not None:
+            return ("tfidf", vectorizer)
+        print("Сохраненный TF-IDF не найден: векторизатор не обучен, пересоберите векторную БД")
         try:
             from sklearn.feature_extraction.text import TfidfVectorizer
             vec = TfidfVectorizer(max_features=10000, ngram_range=(1, 2))
@@ -234,17 +333,34 @@ def create_enhanced_text_for_search(row):
 
 def embed_text(text, model_kind, model):
     """Создает эмбеддинг для текста"""
-    if model_kind == "st":
-        v = model.encode([text], normalize_embeddings=True)[0]
-        return v
-    else:
-        X = model.transform([text]).astype(np.float32).toarray()[0]
-        v = X / (np.linalg.norm(X) + 1e-9)
-        return v
+    with span("embed_text", model_kind=model_kind):
+        if model_kind in ("st", "onnx"):
+            v = model.encode([text], normalize_embeddings=True)[0]
+            return v
+        else:
+            # Одна строка словаря: плотный вектор запроса для CSR @ dense в cosine_sim
+            return normalize_rows(model.transform([text])).toarray()[0]
+
+def embed_texts(texts, model_kind, model):
+    """Эмбеддинги нескольких текстов одним вызовом энкодера (тексты x dim)"""
+    with span("embed_texts", model_kind=model_kind, texts=len(texts)):
+        if model_kind in ("st", "onnx"):
+            return np.asarray(model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+        return normalize_rows(model.transform(list(texts))).toarray()
+
+def cosine_sim_batch(A, B):
+    """Косинусное сходство запросов A (запросы x dim) со строками B: матрица записи x запросы"""
+    with span("cosine_sim_batch", rows=int(B.shape[0]), queries=len(A)):
+        if isinstance(B, QuantizedEmbeddings):
+            return B.scores_batch(A)
+        return np.asarray(B @ A.T) / (np.linalg.norm(A, axis=1) + 1e-9)
 
 def cosine_sim(a, B):
     """Вычисляет косинусное сходство"""
-    return (B @ a) / (np.linalg.norm(a) + 1e-9)
+    with span("cosine_sim", rows=int(B.shape[0])):
+        if isinstance(B, QuantizedEmbeddings):
+            return B.scores(a)
+        return (B @ a) / (np.linalg.norm(a) + 1e-9)
 
 def profile_keywords(theta):
     """Создает ключевые слова на основе профиля пользователя"""
@@ -296,127 +412,253 @@ def profile_keywords(theta):
     return " ".join(tokens)
 
 def explain_recommendation(row, theta, record_meta):
-    """Объясняет, почему фильм был рекомендован"""
+    """Объясняет, почему фильм был рекомендован (по флагам тайтла, см. title_features)"""
     bits = []
-    
-    # Получаем информацию о фильме
-    title = safe_str(row["serial_name"])
-    genres = record_meta.get("genres", [])
-    content_type = record_meta.get("content_type", "")
-    country = record_meta.get("country", "")
+    flags = get_title_flags(record_meta)
     
     # Жанровые совпадения
     genre_matches = []
-    if theta.get("genre_action", 0) > 0.2 and any("боевик" in g.lower() or "экшн" in g.lower() for g in genres):
+    if theta.get("genre_action", 0) > 0.2 and flags["is_action"]:
         genre_matches.append("экшн")
-    if theta.get("genre_comedy", 0) > 0.2 and any("комедия" in g.lower() for g in genres):
+    if theta.get("genre_comedy", 0) > 0.2 and flags["is_comedy"]:
         genre_matches.append("комедия")
-    if theta.get("genre_drama", 0) > 0.2 and any("драма" in g.lower() for g in genres):
+    if theta.get("genre_drama", 0) > 0.2 and flags["is_drama"]:
         genre_matches.append("драма")
-    if theta.get("genre_crime", 0) > 0.2 and any("криминал" in g.lower() or "детектив" in g.lower() for g in genres):
+    if theta.get("genre_crime", 0) > 0.2 and flags["is_crime"]:
         genre_matches.append("криминал")
-    if theta.get("genre_horror", 0) > 0.2 and any("ужас" in g.lower() for g in genres):
+    if theta.get("genre_horror", 0) > 0.2 and flags["is_horror"]:
         genre_matches.append("ужасы")
-    if theta.get("genre_thriller", 0) > 0.2 and any("триллер" in g.lower() for g in genres):
+    if theta.get("genre_thriller", 0) > 0.2 and flags["is_thriller"]:
         genre_matches.append("триллер")
-    if theta.get("genre_romance", 0) > 0.2 and any("романтик" in g.lower() or "мелодрама" in g.lower() for g in genres):
+    if theta.get("genre_romance", 0) > 0.2 and flags["is_romance"]:
         genre_matches.append("романтика")
     
     if genre_matches:
         bits.append(f"жанр: {', '.join(genre_matches)}")
     
     # Тип контента
-    if theta.get("prefer_movies", 0) > 0.2 and "фильм" in content_type.lower():
+    if theta.get("prefer_movies", 0) > 0.2 and flags["is_film"]:
         bits.append("фильм")
-    elif theta.get("prefer_series", 0) > 0.2 and "сериал" in content_type.lower():
+    elif theta.get("prefer_series", 0) > 0.2 and flags["is_series"]:
         bits.append("сериал")
     
     # Страна
-    if theta.get("prefer_russian", 0) > 0.2 and any(c in country.lower() for c in ["россия", "рф", "советский"]):
+    domestic = flags["is_russian"] or flags["is_soviet"]
+    if theta.get("prefer_russian", 0) > 0.2 and domestic:
         bits.append("российский")
-    elif theta.get("prefer_foreign", 0) > 0.2 and not any(c in country.lower() for c in ["россия", "рф", "советский"]):
+    elif theta.get("prefer_foreign", 0) > 0.2 and not domestic:
         bits.append("зарубежный")
     
     # Возрастной рейтинг
-    age_rating = record_meta.get("age_rating")
-    if theta.get("family_friendly", 0) > 0.2 and age_rating and age_rating <= 12:
+    if theta.get("family_friendly", 0) > 0.2 and flags["age_bucket"] == AGE_FAMILY:
         bits.append("семейный")
-    elif theta.get("mature_content", 0) > 0.2 and age_rating and age_rating >= 16:
+    elif theta.get("mature_content", 0) > 0.2 and flags["age_bucket"] >= AGE_MATURE:
         bits.append("для взрослых")
     
     return " · ".join(bits[:3]) if bits else "совпадение по общим предпочтениям"
 
-def filter_and_rank(df, embeddings, records_metadata, theta, model_kind, model, top_k=6):
-    """Фильтрует и ранжирует рекомендации"""
+def filter_and_rank(df, embeddings, records_metadata, theta, model_kind, model, top_k=6, flags=None):
+    """
+    Фильтрует и ранжирует рекомендации
+    
+    flags - результат record_flags (сервис считает его при загрузке);
+    бонусы по метаданным - те же векторные правила, что и у группового ранжирования.
+    """
     # Создаем текст запроса на основе профиля
     user_text = profile_keywords(theta)
     user_emb = embed_text(user_text, model_kind, model)
     
     # Вычисляем сходство
-    sims = cosine_sim(user_emb, embeddings)
+    sims = np.asarray(cosine_sim(user_emb, embeddings), dtype=np.float32).ravel()
+    
+    # Бонусы на основе флагов тайтлов
+    if flags is None:
+        flags = record_flags(records_metadata, len(df))
+    with span("metadata_bonus", rows=len(sims)):
+        scores = sims + metadata_bonus(flags, [theta])[:, 0]
+    
+    # Точный float32 пересчет лидеров приближенного (квантованного) скана
+    if isinstance(embeddings, QuantizedEmbeddings):
+        with span("rerank_exact"):
+            candidates = rerank_candidates(scores, top_k)
+            exact = embeddings.exact_scores(user_emb, candidates)
+            reranked = np.full(len(scores), -np.inf, dtype=np.float32)
+            reranked[candidates] = scores[candidates] - sims[candidates] + exact
+            sims = sims.copy()
+            sims[candidates] = exact
+            scores = reranked
     
-    # Создаем результирующий DataFrame
-    res = df.copy()
-    res["sim"] = sims
-    res["score"] = sims.copy()
+    # Сортируем и возвращаем топ результатов
+    with span("sort_top_k"):
+        return _top_rows(df, sims, scores, top_k)
+
+# Пороги, через которые theta влияет на ранжирование (profile_keywords и бонусы filter_and_rank)
+SIGNATURE_THRESHOLD = 0.2
+
+def theta_signature(theta):
+    """
+    Дискретная сигнатура профиля: результат filter_and_rank зависит только от нее
+    
+    Для каждой оси +1 (> 0.2), -1 (< -0.2) или 0; для violence_tol
+    дополнительно учитывается знак (штраф 18+ при violence_tol < 0).
+    """
+    # float64: сравнение с порогом как в profile_keywords, без округления до float32
+    theta_vec = np.array([theta.get(ax, 0.0) for ax in AXES], dtype=np.float64)
+    levels = (theta_vec > SIGNATURE_THRESHOLD).astype(np.int8) - (theta_vec < -SIGNATURE_THRESHOLD).astype(np.int8)
+    violence_negative = int(theta.get("violence_tol", 0) < 0)
+    return tuple(levels.tolist()) + (violence_negative,)
+
+# Жанровые бонусы filter_and_rank: ось -> флаг жанра (title_features.GENRE_KEYWORDS)
+BONUS_GENRES = [
+    ("genre_comedy", "comedy"),
+    ("genre_drama", "drama"),
+    ("genre_action", "action"),
+    ("genre_horror", "horror"),
+    ("genre_thriller", "thriller"),
+    ("genre_romance", "romance"),
+]
+
+def record_flags(records_metadata, n_rows=None):
+    """
+    Признаки записей, от которых зависят бонусы filter_and_rank (массивы по записям)
+    
+    Собираются из флагов тайтлов (record_meta["flags"]), после чего бонусы
+    для любого числа профилей считаются векторно (metadata_bonus).
+    Различных сочетаний признаков немного, поэтому хранятся уникальные
+    сочетания и номер сочетания каждой записи.
+    """
+    n_rows = len(records_metadata) if n_rows is None else n_rows
+    table = np.zeros((n_rows, 4 + len(BONUS_GENRES)), dtype=np.int16)
+    for idx, record_meta in enumerate(records_metadata[:n_rows]):
+        title = get_title_flags(record_meta)
+        genre_hits = title["genre_hits"]
+        table[idx, :4] = (title["is_film"], title["is_series"], title["is_russian"], title["age_bucket"])
+        for g, (_, name) in enumerate(BONUS_GENRES):
+            table[idx, 4 + g] = genre_hits.get(name, 0)
+    
+    unique, inverse = np.unique(table, axis=0, return_inverse=True)
+    combos = {
+        "film": unique[:, 0] > 0,
+        "series": unique[:, 1] > 0,
+        "russian": unique[:, 2] > 0,
+        "age_bucket": unique[:, 3],
+        "genre_counts": unique[:, 4:].astype(np.float64),
+    }
+    return {"combos": combos, "inverse": inverse.ravel()}
+
+def metadata_bonus(flags, thetas):
+    """
+    Бонусы filter_and_rank по метаданным для нескольких профилей сразу
+    
+    Правила бонусов по флагам тайтлов в виде операций над массивами:
+    сочетания признаков x профили, затем разворот на записи.
+    """
+    return _combo_bonus(flags["combos"], thetas).astype(np.float32)[flags["inverse"]]
+
+def _combo_bonus(flags, thetas):
+    def axis(ax):
+        return np.array([theta.get(ax, 0) for theta in thetas], dtype=np.float64)[None, :]
     
-    # Применяем фильтры на основе метаданных
-    for idx, record_meta in enumerate(records_metadata):
-        if idx >= len(res):
-            break
-            
-        bonus = 0.0
-        
-        # Фильтр по типу контента
-        content_type = record_meta.get("content_type", "").lower()
-        if theta.get("prefer_movies", 0) > 0.2 and "фильм" in content_type:
-            bonus += 0.1
-        elif theta.get("prefer_series", 0) > 0.2 and "сериал" in content_type:
-            bonus += 0.1
-        
-        # Фильтр по стране
-        country = record_meta.get("country", "").lower()
-        if theta.get("prefer_russian", 0) > 0.2 and any(c in country for c in ["россия", "рф"]):
-            bonus += 0.15
-        elif theta.get("prefer_foreign", 0) > 0.2 and not any(c in country for c in ["россия", "рф"]):
-            bonus += 0.1
-        
-        # Фильтр по возрастному рейтингу
-        age_rating = record_meta.get("age_rating")
-        if age_rating:
-            if theta.get("family_friendly", 0) > 0.2 and age_rating <= 12:
-                bonus += 0.1
-            elif theta.get("mature_content", 0) > 0.2 and age_rating >= 16:
-                bonus += 0.1
-            elif theta.get("violence_tol", 0) < 0 and age_rating >= 18:
-                bonus -= 0.2  # штраф за взрослый контент если не хотят насилие
-        
-        # Фильтр по жанрам
-        genres = record_meta.get("genres", [])
-        genre_bonus = 0.0
-        for genre in genres:
-            genre_lower = genre.lower()
-            if theta.get("genre_comedy", 0) > 0.2 and "комедия" in genre_lower:
-                genre_bonus += 0.1
-            if theta.get("genre_drama", 0) > 0.2 and "драма" in genre_lower:
-                genre_bonus += 0.1
-            if theta.get("genre_action", 0) > 0.2 and ("боевик" in genre_lower or "экшн" in genre_lower):
-                genre_bonus += 0.1
-            if theta.get("genre_horror", 0) > 0.2 and "ужас" in genre_lower:
-                genre_bonus += 0.1
-            if theta.get("genre_thriller", 0) > 0.2 and "триллер" in genre_lower:
-                genre_bonus += 0.1
-            if theta.get("genre_romance", 0) > 0.2 and ("романтик" in genre_lower or "мелодрама" in genre_lower):
-                genre_bonus += 0.1
-        
-        bonus += min(genre_bonus, 0.2)  # ограничиваем жанровый бонус
-        
-        res.iloc[idx, res.columns.get_loc("score")] += bonus
+    def on(ax):
+        return axis(ax) > 0.2
     
-    # Сортируем и возвращаем топ результатов
-    res = res.sort_values("score", ascending=False).head(top_k)
+    film, series, russian = flags["film"][:, None], flags["series"][:, None], flags["russian"][:, None]
+    age_bucket = flags["age_bucket"][:, None]
+    
+    # Тип контента
+    movie_bonus = on("prefer_movies") & film
+    series_bonus = ~movie_bonus & on("prefer_series") & series
+    bonus = 0.1 * movie_bonus + 0.1 * series_bonus
+    
+    # Страна
+    russian_bonus = on("prefer_russian") & russian
+    foreign_bonus = ~russian_bonus & on("prefer_foreign") & ~russian
+    bonus += 0.15 * russian_bonus + 0.1 * foreign_bonus
+    
+    # Возрастной рейтинг
+    family = on("family_friendly") & (age_bucket == AGE_FAMILY)
+    mature = ~family & on("mature_content") & (age_bucket >= AGE_MATURE)
+    violent = ~family & ~mature & (axis("violence_tol") < 0) & (age_bucket == AGE_ADULT)
+    bonus += 0.1 * family + 0.1 * mature - 0.2 * violent
+    
+    # Жанры (ограничение жанрового бонуса)
+    genre_on = np.vstack([on(ax)[0] for ax, _ in BONUS_GENRES]).astype(np.float64)
+    bonus += np.minimum(0.1 * (flags["genre_counts"] @ genre_on), 0.2)
+    return bonus
+
+def top_indices(scores, top_k):
+    """Позиции top_k лучших оценок по убыванию (argpartition вместо полной сортировки)"""
+    top_k = min(top_k, len(scores))
+    idx = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(scores) else np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def _top_rows(df, sims, scores, top_k):
+    """Топ-k строк df по scores в формате filter_and_rank"""
+    idx = top_indices(scores, top_k)
+    res = df.iloc[idx].copy()
+    res["sim"] = sims[idx]
+    res["score"] = scores[idx]
     return res
 
+def filter_and_rank_batch(df, embeddings, records_metadata, thetas, model_kind, model, top_k=6, flags=None):
+    """
+    Ранжирование каталога сразу для нескольких профилей (группа)
+    
+    Одно кодирование уникальных текстов профилей, одно матричное
+    произведение каталог x профили и векторные бонусы - стоимость почти
+    не зависит от размера группы.
+    
+    Returns:
+        (members, scores) - топ-k участников (DataFrame как у filter_and_rank)
+        и итоговые оценки записи x участники
+    """
+    texts, inverse = np.unique([profile_keywords(theta) for theta in thetas], return_inverse=True)
+    user_embs = embed_texts(texts, model_kind, model)
+    sims = cosine_sim_batch(user_embs, embeddings)[:, inverse.ravel()]
+    
+    if flags is None:
+        flags = record_flags(records_metadata, len(df))
+    with span("metadata_bonus_batch", rows=len(df), profiles=len(thetas)):
+        scores = sims + metadata_bonus(flags, thetas)
+    
+    if isinstance(embeddings, QuantizedEmbeddings):
+        # Точный float32 пересчет объединения лидеров всех участников и групповых
+        # стратегий: fuse_group_scores сравнивает только точные значения, остальные
+        # записи, как и в filter_and_rank, исключаются (-inf)
+        with span("rerank_exact"):
+            inverse = inverse.ravel()
+            leaders = [scores[:, j] for j in range(len(thetas))]
+            leaders += [fuse_group_scores(scores, strategy) for strategy in GROUP_STRATEGIES]
+            candidates = np.unique(np.concatenate([rerank_candidates(col, top_k) for col in leaders]))
+            exact = np.stack(
+                [embeddings.exact_scores(user_embs[u], candidates) for u in range(len(texts))], axis=1
+            )[:, inverse]
+            reranked = np.full(scores.shape, -np.inf, dtype=np.float32)
+            reranked[candidates] = scores[candidates] - sims[candidates] + exact
+            sims = sims.copy()
+            sims[candidates] = exact
+            scores = reranked
+    
+    with span("sort_top_k"):
+        members = [_top_rows(df, sims[:, j], scores[:, j], top_k) for j in range(len(thetas))]
+    return members, scores
+
+# Стратегии групповой подборки (fuse_group_scores)
+GROUP_STRATEGIES = ("average", "least_misery")
+
+def fuse_group_scores(scores, strategy="average"):
+    """
+    Групповая оценка записей по оценкам участников (записи x участники)
+    
+    average - средняя оценка, least_misery - оценка самого недовольного
+    участника (подборка без фильмов, которые кому-то точно не подойдут).
+    """
+    if strategy == "least_misery":
+        return scores.min(axis=1)
+    if strategy == "average":
+        return scores.mean(axis=1)
+    raise ValueError(f"Неизвестная стратегия группового ранжирования: {strategy}")
+
 def init_theta():
     """Инициализирует профиль пользователя"""
     theta = {}
@@ -424,31 +666,156 @@ def init_theta():
         theta[ax] = 0.0
     return theta
 
+def theta_vector(theta):
+    """Профиль {ось: значение} как вектор по AXES"""
+    return np.array([theta.get(ax, 0.0) for ax in AXES], dtype=np.float32)
+
+def update_theta_vector(theta_vec, answer_value, target_vec):
+    """Шаг профиля по ответу в векторной форме (target_vec - строка QUESTION_MATRIX)"""
+    s = answer_value / 2.0  # масштабируем к [-1..+1]
+    return np.clip(theta_vec + ETA * s * target_vec, -1.0, 1.0)
+
 def update_theta(theta, answer_value, targets):
     """Обновляет профиль пользователя на основе ответа"""
-    s = answer_value / 2.0  # масштабируем к [-1..+1]
-    for ax, weight in targets.items():
-        # Инициализируем ключ если его нет
-        if ax not in theta:
-            theta[ax] = 0.0
-        theta[ax] = float(np.clip(theta[ax] + ETA * weight * s, -1.0, 1.0))
+    target_vec = targets_vector(targets)
+    updated = update_theta_vector(theta_vector(theta), answer_value, target_vec)
+    for i in np.flatnonzero(target_vec):
+        theta[AXES[i]] = float(updated[i])
+
+def build_item_features(records_metadata):
+    """
+    Признаки тайтлов по осям анкеты (тайтлы x AXES, 0/1)
+    
+    Тип, страна, возраст и жанры берутся из флагов тайтлов (get_title_flags),
+    как в бонусах filter_and_rank; локально разбираются только оси, которых
+    нет во флагах (шоу, США/Европа, год выхода). Считается один раз при загрузке.
+    """
+    features = np.zeros((len(records_metadata), len(AXES)), dtype=np.float32)
+    col = AXIS_INDEX
+    for i, record_meta in enumerate(records_metadata):
+        row = features[i]
+        
+        flags = get_title_flags(record_meta)
+        
+        # Тип, страна и возраст - те же флаги, что у бонусов filter_and_rank
+        row[col["prefer_movies"]] = flags["is_film"]
+        row[col["prefer_series"]] = flags["is_series"]
+        content_type = (record_meta.get("content_type") or "").lower()
+        if "шоу" in content_type:
+            row[col["prefer_shows"]] = 1
+        
+        row[col["prefer_russian"]] = flags["is_russian"]
+        row[col["prefer_foreign"]] = not flags["is_russian"]
+        country = (record_meta.get("country") or "").lower()
+        if "сша" in country:
+            row[col["prefer_american"]] = 1
+        if any(c in country for c in EUROPEAN_COUNTRIES):
+            row[col["prefer_european"]] = 1
+        
+        age = flags["age_bucket"]
+        row[col["family_friendly"]] = age == AGE_FAMILY
+        row[col["mature_content"]] = age >= AGE_MATURE
+        row[col["violence_tol"]] = age == AGE_ADULT
+        
+        for name in flags["genre_hits"]:
+            for ax in GENRE_FLAG_AXES.get(name, (f"genre_{name}",)):
+                row[col[ax]] = 1
+        
+        year = str(record_meta.get("release_date") or "")[:4]
+        if year.isdigit():
+            if int(year) >= 2015:
+                row[col["recent_content"]] = 1
+            elif int(year) < 1990:
+                row[col["classic_content"]] = 1
+    return features
+
+def _remaining_questions(asked_ids):
+    asked = set(asked_ids)
+    return np.array([i for i, q in enumerate(QUESTIONS) if q["id"] not in asked], dtype=np.int64)
+
+def _candidates(item_features, theta_vec):
+    """Лидеры по признакам при текущем профиле: (позиции, оценки)"""
+    scores = item_features @ theta_vec
+    if len(scores) > EIG_CANDIDATES:
+        # Стабильная сортировка: тайтлы с одинаковыми признаками не меняются местами
+        idx = np.argsort(-scores, kind="stable")[:EIG_CANDIDATES]
+        return idx, scores[idx]
+    return np.arange(len(scores)), scores
 
-def pick_next_question(theta, asked_ids):
-    """Выбирает следующий вопрос"""
+def _binary_entropy(p):
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+
+def expected_information_gain(theta, question_idx, item_features):
+    """
+    Ожидаемый прирост информации о тайтле-цели от каждого вопроса
+    
+    Распределение над кандидатами - softmax оценок по признакам,
+    P(да | тайтл) = sigmoid(совпадение признаков тайтла с целями вопроса).
+    EIG = H(ответ) - E[H(ответ | тайтл)] для всех вопросов одним
+    матричным умножением (кандидаты x вопросы).
+    """
+    idx, scores = _candidates(item_features, theta_vector(theta))
+    weights = np.exp((scores - scores.max()) / EIG_TEMPERATURE)
+    weights /= weights.sum()
+    
+    agreement = item_features[idx] @ QUESTION_MATRIX[question_idx].T
+    p_yes = 1.0 / (1.0 + np.exp(-ANSWER_SHARPNESS * agreement))
+    return _binary_entropy(weights @ p_yes) - weights @ _binary_entropy(p_yes)
+
+def ranking_stable(theta, question_idx):
+    """
+    Ответы на оставшиеся вопросы не меняют ранжирование filter_and_rank
+    
+    Результат filter_and_rank зависит только от theta_signature, поэтому
+    все исходы (вопрос x ответ) пересчитываются одной матрицей профилей и
+    сравниваются по сигнатуре: подборка устойчива, только если ни один
+    ответ не меняет сигнатуру.
+    """
+    theta_vec = theta_vector(theta)
+    answers = np.array([v for v in LIKERT.values() if v != 0], dtype=np.float32)
+    targets = QUESTION_MATRIX[question_idx]
+    outcomes = np.clip(
+        theta_vec[None, None, :] + ETA * (answers[None, :, None] / 2.0) * targets[:, None, :], -1.0, 1.0
+    ).reshape(-1, len(AXES)).astype(np.float64)
+    # update_theta меняет только оси вопроса, остальные остаются как в theta
+    touched = np.repeat(targets != 0, len(answers), axis=0)
+    current = np.array([theta.get(ax, 0.0) for ax in AXES], dtype=np.float64)
+    outcomes = np.where(touched, outcomes, current)
+    
+    levels = (outcomes > SIGNATURE_THRESHOLD).astype(np.int8) - (outcomes < -SIGNATURE_THRESHOLD).astype(np.int8)
+    violence_negative = (outcomes[:, AXIS_INDEX["violence_tol"]] < 0).astype(np.int8)
+    signatures = np.column_stack([levels, violence_negative])
+    return bool((signatures == np.array(theta_signature(theta), dtype=np.int8)).all())
+
+def pick_next_question(theta, asked_ids, item_features=None):
+    """
+    Выбирает следующий вопрос
+    
+    С признаками каталога (build_item_features) - вопрос с наибольшим
+    ожидаемым приростом информации; анкета заканчивается раньше, когда
+    после QUESTIONS_MIN ответов подборка уже не зависит от ответов.
+    Без признаков - вопрос о наименее определенных осях.
+    """
     if len(asked_ids) >= QUESTIONS_MAX:
         return None
     
-    remaining = [q for q in QUESTIONS if q["id"] not in asked_ids]
-    if not remaining:
+    remaining = _remaining_questions(asked_ids)
+    if len(remaining) == 0:
         return None
     
-    def priority(q):
-        unseen_axes = len(q["targets"])
-        flatness = sum(1.0 - abs(theta.get(ax, 0.0)) for ax in q["targets"])
-        return (unseen_axes, flatness)
-    
-    remaining.sort(key=priority, reverse=True)
-    return remaining[0]
+    if item_features is not None and len(item_features) > 0:
+        if len(asked_ids) >= QUESTIONS_MIN and ranking_stable(theta, remaining):
+            return None
+        gain = expected_information_gain(theta, remaining, item_features)
+        return QUESTIONS[remaining[int(np.argmax(gain))]]
+    
+    # Приоритет: больше осей, затем менее определенные оси
+    targets = QUESTION_MATRIX[remaining] != 0
+    unseen_axes = targets.sum(axis=1)
+    flatness = targets @ (1.0 - np.abs(theta_vector(theta)))
+    order = np.lexsort((-flatness, -unseen_axes))
+    return QUESTIONS[remaining[order[0]]]
 
 def main():
     """Основная функция"""
@@ -469,6 +836,7 @@ def main():
         print("Не удалось загрузить модель для эмбеддингов.")
         return
 
+    item_features = build_item_features(records_metadata)
     theta = init_theta()
     asked = set()
 
@@ -477,8 +845,10 @@ def main():
         if len(asked) >= QUESTIONS_MAX:
             break
 
-        q = pick_next_question(theta, asked)
+        q = pick_next_question(theta, asked, item_features)
         if q is None:
+            if len(asked) < len(QUESTIONS):
+                print("\nОтветы больше не меняют подборку.")
             break
 
         completeness = int(100 * len(asked) / QUESTIONS_MAX)
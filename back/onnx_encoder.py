@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX Runtime бэкенд энкодера запросов (MiniLM) для CPU
+
+Экспорт трансформера из sentence-transformers в ONNX с динамической
+int8 квантизацией весов и энкодер с API SentenceTransformer.encode
+(mean pooling + нормализация), который подставляется в embed_text
+вместо PyTorch модели при OKKO_ENCODER_BACKEND=onnx.
+
+Зависимости экспорта: sentence-transformers, torch, onnx, onnxruntime.
+В рантайме сервиса нужны только onnxruntime и transformers (токенайзер).
+
+Использование:
+    # Экспорт (fp32 + int8) и проверка совпадения с PyTorch векторами
+    python back/onnx_encoder.py export --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+    python back/onnx_encoder.py check --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+ONNX_MODEL_ROOT = os.getenv("OKKO_ONNX_MODEL_DIR", "models/onnx")
+ONNX_QUANTIZED = os.getenv("OKKO_ONNX_QUANTIZED", "true").lower() == "true"
+ONNX_NUM_THREADS = int(os.getenv("OKKO_ONNX_NUM_THREADS", "0"))
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+CONFIG_FILE = "encoder_config.json"
+
+# Минимальный косинус между PyTorch и ONNX векторами, при котором
+# подмена энкодера не меняет ранжирование заметно
+PARITY_THRESHOLD = {"fp32": 0.999, "int8": 0.98}
+
+PARITY_TEXTS = [
+    "комедия для всей семьи",
+    "мрачный скандинавский детектив с медленным темпом",
+    "российский сериал про школу",
+    "фантастика про космос и путешествия во времени",
+    "легкая романтическая мелодрама на вечер",
+    "документальный фильм о спорте",
+    "классический советский фильм",
+    "боевик с погонями и взрывами",
+    "funny animated movie for kids",
+    "psychological thriller with a twist ending",
+]
+
+
+def model_dir_for(model_name: str, root: str = ONNX_MODEL_ROOT) -> str:
+    """Каталог экспортированной модели: models/onnx/<имя модели>"""
+    return os.path.join(root, model_name.rstrip("/").split("/")[-1])
+
+
+class OnnxEncoder:
+    """Энкодер на ONNX Runtime с API SentenceTransformer.encode"""
+
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        model_file = INT8_FILE if quantized else FP32_FILE
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config.get("max_seq_length", 128)
+        self.quantized = quantized
+        self.model_file = model_file
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = False, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            tokens = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+            )
+            feeds = {
+                "input_ids": tokens["input_ids"].astype(np.int64),
+                "attention_mask": tokens["attention_mask"].astype(np.int64),
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+            hidden = self.session.run(None, feeds)[0]
+
+            # Mean pooling по значимым токенам, как в sentence-transformers
+            mask = feeds["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors.append(pooled.astype(np.float32))
+
+        result = np.concatenate(vectors, axis=0) if vectors else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            result /= np.linalg.norm(result, axis=1, keepdims=True) + 1e-12
+        return result
+
+
+def load_onnx_encoder(model_name: str) -> Optional[OnnxEncoder]:
+    """Загрузка экспортированного энкодера (None, если модели или onnxruntime нет)"""
+    model_dir = model_dir_for(model_name)
+    try:
+        encoder = OnnxEncoder(model_dir, quantized=ONNX_QUANTIZED, num_threads=ONNX_NUM_THREADS)
+        print(f"Энкодер ONNX Runtime: {model_dir}/{encoder.model_file}")
+        return encoder
+    except Exception as e:
+        print(f"Не удалось загрузить ONNX энкодер из {model_dir}: {e}")
+        print(f"Экспортируйте модель: python back/onnx_encoder.py export --model {model_name}")
+        return None
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True, opset: int = 14) -> Dict[str, Any]:
+    """
+    Экспорт трансформера sentence-transformers в ONNX (+ int8 квантизация)
+
+    Веса и токенайзер берутся из той же SentenceTransformer модели, что и в
+    PyTorch пути, поэтому векторы совместимы с уже построенными эмбеддингами.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    auto_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    dummy = tokenizer(["пример запроса для экспорта"], return_tensors="pt")
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(out_dir)
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": st_model.max_seq_length,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+        "opset": opset,
+    }
+    with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    sizes = {"fp32_mb": round(os.path.getsize(fp32_path) / 2 ** 20, 1)}
+    print(f"✅ ONNX модель сохранена: {fp32_path} ({sizes['fp32_mb']} МБ)")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        int8_path = os.path.join(out_dir, INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        sizes["int8_mb"] = round(os.path.getsize(int8_path) / 2 ** 20, 1)
+        print(f"✅ int8 модель сохранена: {int8_path} ({sizes['int8_mb']} МБ)")
+
+    return dict(config, **sizes)
+
+
+def _latency_ms(encode, texts: List[str], repeats: int = 5) -> float:
+    """Медианная задержка кодирования одного запроса (как в embed_text)"""
+    encode([texts[0]])  # прогрев
+    timings = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            encode([text])
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def parity_check(model_name: str, model_dir: str, texts: List[str] = PARITY_TEXTS) -> Dict[str, Any]:
+    """Сравнение векторов и задержки PyTorch и ONNX (fp32 и int8) энкодеров"""
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    reference = st_model.encode(texts, normalize_embeddings=True)
+    report = {
+        "model": model_name,
+        "texts": len(texts),
+        "torch_latency_ms": round(_latency_ms(lambda t: st_model.encode(t, normalize_embeddings=True), texts), 3),
+        "variants": {},
+    }
+
+    for variant, quantized in (("fp32", False), ("int8", True)):
+        model_path = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        if not os.path.exists(model_path):
+            continue
+        encoder = OnnxEncoder(model_dir, quantized=quantized, num_threads=ONNX_NUM_THREADS)
+        vectors = encoder.encode(texts, normalize_embeddings=True)
+        cosines = np.sum(vectors * reference, axis=1)
+
+        # Совпадение топ-1 соседа среди проверочных текстов: ранжирование не должно меняться
+        same_neighbours = np.mean(
+            np.argsort(-(vectors @ vectors.T), axis=1)[:, 1] == np.argsort(-(reference @ reference.T), axis=1)[:, 1]
+        )
+        report["variants"][variant] = {
+            "min_cosine": round(float(cosines.min()), 5),
+            "mean_cosine": round(float(cosines.mean()), 5),
+            "neighbour_agreement": round(float(same_neighbours), 3),
+            "latency_ms": round(_latency_ms(lambda t: encoder.encode(t, normalize_embeddings=True), texts), 3),
+            "model_mb": round(os.path.getsize(model_path) / 2 ** 20, 1),
+            "passed": bool(cosines.min() >= PARITY_THRESHOLD[variant]),
+        }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт и проверка ONNX энкодера запросов")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--model", default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--out", default=None, help="Каталог модели (по умолчанию OKKO_ONNX_MODEL_DIR/<имя>)")
+    parser.add_argument("--no-quantize", action="store_true", help="Экспорт без int8 варианта")
+    args = parser.parse_args()
+
+    model_dir = args.out or model_dir_for(args.model)
+
+    if args.command == "export":
+        export_onnx(args.model, model_dir, quantize=not args.no_quantize)
+        return 0
+
+    report = parity_check(args.model, model_dir)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["variants"]:
+        print(f"❌ В {model_dir} нет экспортированных моделей")
+        return 1
+    failed = [name for name, v in report["variants"].items() if not v["passed"]]
+    if failed:
+        print(f"❌ Расхождение с PyTorch выше допустимого: {', '.join(failed)}")
+        return 1
+    print("✅ Векторы ONNX совпадают с PyTorch")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
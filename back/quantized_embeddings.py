@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Квантованные эмбеддинги каталога: приближенный скан + точный реранк
+
+Первый проход cosine_sim идет по float16 или int8 копии матрицы
+(в 2 и 4 раза меньше памяти и пропускной способности), затем лидеры
+пересчитываются по исходным float32 векторам. Исходный файл открыт
+через mmap, поэтому в памяти остаются только квантованная копия и
+страницы реранкнутых строк.
+
+int8 - симметричная квантизация по строкам: x ≈ codes * scale,
+scale = max|x| / 127, скалярное произведение восстанавливается
+умножением на scale строки.
+
+Выбор формата: OKKO_EMBEDDING_DTYPE=float32|float16|int8. int8 быстрее
+float32 скана (меньше чтений из памяти), float16 только экономит память:
+преобразование float16 -> float32 в numpy без аппаратной поддержки
+медленнее самого умножения.
+
+Подготовка квантованных файлов рядом с исходным:
+    python back/quantized_embeddings.py data/okko_embeddings.npy --dtype int8
+"""
+
+import os
+import sys
+import argparse
+from typing import Optional
+
+import numpy as np
+
+try:
+    from back.sparse_embeddings import load_sparse
+except ImportError:
+    from sparse_embeddings import load_sparse
+
+EMBEDDING_DTYPE = os.getenv("OKKO_EMBEDDING_DTYPE", "float32").lower()
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Сколько кандидатов на каждое итоговое место пересчитывать точно
+RERANK_FACTOR = int(os.getenv("OKKO_RERANK_FACTOR", "10"))
+MIN_RERANK_CANDIDATES = 100
+
+# Размер блока скана: float32 копия блока (512 x 384 = 768 КБ) остается в
+# кэше процессора, и BLAS читает ее оттуда, а не из памяти
+SCAN_CHUNK_ROWS = 512
+
+
+def quantized_paths(path: str, dtype: str):
+    """Пути квантованной копии (и масштабов для int8) для исходного .npy"""
+    base = path[:-4] if path.endswith(".npy") else path
+    return f"{base}.{dtype}.npy", f"{base}.{dtype}_scale.npy"
+
+
+def quantize(full: np.ndarray, dtype: str):
+    """
+    Квантизация матрицы эмбеддингов
+
+    Returns:
+        (codes, scales) - scales только для int8, иначе None
+    """
+    if dtype == "float16":
+        return np.asarray(full, dtype=np.float16), None
+    if dtype == "int8":
+        codes = np.empty(full.shape, dtype=np.int8)
+        scales = np.empty(full.shape[0], dtype=np.float32)
+        for start in range(0, full.shape[0], SCAN_CHUNK_ROWS):
+            block = np.asarray(full[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            block_scales = np.abs(block).max(axis=1) / 127.0
+            block_scales[block_scales == 0] = 1.0
+            codes[start:start + len(block)] = np.round(block / block_scales[:, None])
+            scales[start:start + len(block)] = block_scales
+        return codes, scales
+    raise ValueError(f"Неподдерживаемый формат эмбеддингов: {dtype}")
+
+
+class QuantizedEmbeddings:
+    """Квантованная матрица эмбеддингов с доступом к исходным float32 строкам"""
+
+    def __init__(self, full: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray], dtype: str):
+        self.full = full
+        self.codes = codes
+        self.scales = scales
+        self.dtype = dtype
+        self.shape = full.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Память приближенного скана (без mmap исходника)"""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Приближенное косинусное сходство запроса со всеми строками (float32)"""
+        q = np.asarray(query, dtype=np.float32)
+        out = np.empty(self.shape[0], dtype=np.float32)
+        # Блоками: numpy не умножает int8/float16 через BLAS, а полная
+        # float32 копия свела бы экономию памяти на нет
+        buffer = np.empty((SCAN_CHUNK_ROWS, self.shape[1]), dtype=np.float32)
+        for start in range(0, self.shape[0], SCAN_CHUNK_ROWS):
+            block = self.codes[start:start + SCAN_CHUNK_ROWS]
+            rows = buffer[:len(block)]
+            np.copyto(rows, block, casting="unsafe")
+            np.dot(rows, q, out=out[start:start + len(block)])
+        if self.scales is not None:
+            out *= self.scales
+        return out / (np.linalg.norm(q) + 1e-9)
+
+    def scores_batch(self, queries: np.ndarray) -> np.ndarray:
+        """Приближенное сходство нескольких запросов (запросы x dim) со всеми строками: строки x запросы"""
+        q = np.asarray(queries, dtype=np.float32).T
+        out = np.empty((self.shape[0], q.shape[1]), dtype=np.float32)
+        buffer = np.empty((SCAN_CHUNK_ROWS, self.shape[1]), dtype=np.float32)
+        for start in range(0, self.shape[0], SCAN_CHUNK_ROWS):
+            block = self.codes[start:start + SCAN_CHUNK_ROWS]
+            rows = buffer[:len(block)]
+            np.copyto(rows, block, casting="unsafe")
+            np.dot(rows, q, out=out[start:start + len(block)])
+        if self.scales is not None:
+            out *= self.scales[:, None]
+        return out / (np.linalg.norm(q, axis=0) + 1e-9)
+
+    def exact_scores(self, query: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """Точное float32 сходство для выбранных строк"""
+        q = np.asarray(query, dtype=np.float32)
+        order = np.argsort(indices)  # последовательное чтение страниц mmap
+        rows = np.asarray(self.full[indices[order]], dtype=np.float32)
+        exact = np.empty(len(indices), dtype=np.float32)
+        exact[order] = rows @ q
+        return exact / (np.linalg.norm(q) + 1e-9)
+
+
+def rerank_candidates(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Позиции лидеров приближенного ранжирования, которые нужно пересчитать точно"""
+    n = min(len(scores), max(top_k * RERANK_FACTOR, MIN_RERANK_CANDIDATES))
+    if n >= len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, n - 1)[:n]
+
+
+def load_embeddings(path: str, dtype: str = EMBEDDING_DTYPE):
+    """
+    Загрузка эмбеддингов в выбранном формате
+
+    .npz - разреженная TF-IDF матрица (CSR). float32 - mmap исходного файла. float16/int8 - квантованная копия
+    (из файла рядом с исходным или квантуется при загрузке) и mmap
+    исходника для точного реранка.
+    """
+    if path.endswith(".npz"):
+        # TF-IDF CSR: квантовать нечего, матрица и так хранит только ненулевые веса
+        return load_sparse(path)
+    
+    full = np.load(path, mmap_mode="r")
+    if dtype == "float32" or dtype not in SUPPORTED_DTYPES:
+        if dtype not in SUPPORTED_DTYPES:
+            print(f"Неизвестный OKKO_EMBEDDING_DTYPE={dtype}, используем float32")
+        return full
+
+    codes_path, scales_path = quantized_paths(path, dtype)
+    if os.path.exists(codes_path) and os.path.getmtime(codes_path) >= os.path.getmtime(path):
+        codes = np.load(codes_path)
+        scales = np.load(scales_path) if dtype == "int8" else None
+    else:
+        print(f"Квантованная копия {codes_path} не найдена, квантуем при загрузке")
+        codes, scales = quantize(full, dtype)
+
+    print(f"Эмбеддинги {dtype}: {codes.nbytes / 2 ** 20:.1f} МБ вместо {full.nbytes / 2 ** 20:.1f} МБ")
+    return QuantizedEmbeddings(full, codes, scales, dtype)
+
+
+def save_quantized(path: str, dtype: str):
+    """Сохранение квантованной копии рядом с исходным .npy"""
+    full = np.load(path, mmap_mode="r")
+    codes, scales = quantize(full, dtype)
+    codes_path, scales_path = quantized_paths(path, dtype)
+    np.save(codes_path, codes)
+    if scales is not None:
+        np.save(scales_path, scales)
+    print(f"✅ {codes_path}: {codes.nbytes / 2 ** 20:.1f} МБ (исходник {full.nbytes / 2 ** 20:.1f} МБ)")
+
+
+def recall_at_k(full: np.ndarray, embeddings: QuantizedEmbeddings, queries: np.ndarray, k: int = 10,
+                rerank: bool = True) -> float:
+    """Доля точного топ-k (float32), найденная приближенным сканом (+ реранком)"""
+    hits = 0
+    for q in queries:
+        exact = np.asarray(full, dtype=np.float32) @ q
+        truth = set(np.argpartition(-exact, k - 1)[:k])
+        approx = embeddings.scores(q)
+        if rerank:
+            candidates = rerank_candidates(approx, k)
+            rescored = embeddings.exact_scores(q, candidates)
+            found = candidates[np.argpartition(-rescored, k - 1)[:k]]
+        else:
+            found = np.argpartition(-approx, k - 1)[:k]
+        hits += len(truth & set(found))
+    return hits / (k * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Квантованные копии эмбеддингов каталога")
+    parser.add_argument("path", help="Исходный .npy (например, data/okko_embeddings.npy)")
+    parser.add_argument("--dtype", choices=["float16", "int8", "all"], default="all")
+    parser.add_argument("--recall", action="store_true", help="Проверить recall@10 на строках каталога как запросах")
+    args = parser.parse_args()
+
+    dtypes = ["float16", "int8"] if args.dtype == "all" else [args.dtype]
+    for dtype in dtypes:
+        save_quantized(args.path, dtype)
+
+    if args.recall:
+        full = np.load(args.path, mmap_mode="r")
+        rng = np.random.default_rng(0)
+        queries = np.asarray(full[rng.choice(len(full), size=min(50, len(full)), replace=False)], dtype=np.float32)
+        for dtype in dtypes:
+            embeddings = load_embeddings(args.path, dtype)
+            print(
+                f"{dtype}: recall@10 без реранка {recall_at_k(full, embeddings, queries, rerank=False):.4f}, "
+                f"с реранком {recall_at_k(full, embeddings, queries):.4f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Разреженные TF-IDF эмбеддинги (режим без sentence-transformers)
+
+Матрица каталог x словарь остается CSR от fit_transform до поиска:
+нормализация строк без densify, сохранение через scipy.sparse.save_npz
+(.npz рядом с .npy для плотных эмбеддингов) и произведение CSR на
+плотный вектор запроса в cosine_sim. Плотная копия матрицы на полном
+каталоге занимала бы гигабайты, CSR - десятки мегабайт.
+"""
+
+import os
+import json
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+
+def is_sparse(X) -> bool:
+    return sp.issparse(X)
+
+
+def normalize_rows(X) -> sp.csr_matrix:
+    """L2 нормализация строк CSR матрицы (float32, без перехода к плотной)"""
+    return normalize(sp.csr_matrix(X, dtype=np.float32), norm="l2", copy=False)
+
+
+def dense_row(X, index: int) -> np.ndarray:
+    """Строка матрицы как плотный 1-D вектор (для вектора пользователя в свайпах)"""
+    row = X[index]
+    if sp.issparse(row):
+        return row.toarray().ravel()
+    return np.asarray(row)
+
+
+def save_sparse(path: str, X):
+    """Сохранение CSR матрицы (.npz)"""
+    sp.save_npz(path, sp.csr_matrix(X, dtype=np.float32), compressed=False)
+
+
+def load_sparse(path: str) -> sp.csr_matrix:
+    return sp.load_npz(path).tocsr()
+
+
+def embeddings_path(data_dir: str, name: str) -> Optional[str]:
+    """
+    Файл эмбеддингов: name.npy (плотные) или name.npz (TF-IDF CSR)
+
+    Если есть оба, берется более свежий - последний запуск построителя.
+    """
+    candidates = [p for p in (f"{data_dir}/{name}.npy", f"{data_dir}/{name}.npz") if os.path.exists(p)]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+
+def save_embeddings(output_dir: str, name: str, embeddings) -> str:
+    """Сохранение эмбеддингов построителем: CSR в name.npz, плотные в name.npy"""
+    if sp.issparse(embeddings):
+        path = f"{output_dir}/{name}.npz"
+        save_sparse(path, embeddings)
+    else:
+        path = f"{output_dir}/{name}.npy"
+        np.save(path, embeddings)
+    return path
+
+
+# Параметры TfidfVectorizer, от которых зависит вектор запроса
+VECTORIZER_PARAMS = (
+    "lowercase", "ngram_range", "token_pattern", "strip_accents", "stop_words",
+    "analyzer", "norm", "use_idf", "smooth_idf", "sublinear_tf", "binary"
+)
+
+
+def save_vectorizer(path: str, vectorizer):
+    """Сохранение словаря, idf и параметров обученного TfidfVectorizer (.npz)"""
+    params = vectorizer.get_params()
+    config = {key: params[key] for key in VECTORIZER_PARAMS}
+    if not isinstance(config["analyzer"], str):
+        raise ValueError("Векторизатор с пользовательским analyzer нельзя сохранить без pickle")
+    config["ngram_range"] = list(config["ngram_range"])
+    if config["stop_words"] is not None and not isinstance(config["stop_words"], str):
+        config["stop_words"] = sorted(config["stop_words"])
+
+    np.savez(
+        path,
+        terms=np.array(vectorizer.get_feature_names_out(), dtype=str),
+        idf=vectorizer.idf_.astype(np.float32),
+        params=np.array(json.dumps(config, ensure_ascii=False))
+    )
+
+
+def load_vectorizer(path: str):
+    """Восстановление обученного TfidfVectorizer без повторного обучения"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    with np.load(path, allow_pickle=False) as data:
+        terms = data["terms"]
+        idf = data["idf"]
+        config = json.loads(str(data["params"]))
+
+    config["ngram_range"] = tuple(config["ngram_range"])
+    vectorizer = TfidfVectorizer(
+        vocabulary={term: i for i, term in enumerate(terms.tolist())},
+        dtype=np.float32,
+        **config
+    )
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+def vectorizer_path(data_dir: str, name: str) -> Optional[str]:
+    """Сохраненный векторизатор для хранилища name (None, если его нет)"""
+    path = f"{data_dir}/{name}_tfidf.npz"
+    return path if os.path.exists(path) else None
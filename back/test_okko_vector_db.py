@@ -13,6 +13,9 @@ from typing import List, Dict, Any, Tuple
 from datetime import datetime
 import logging
 
+from sparse_embeddings import normalize_rows, save_embeddings, save_vectorizer
+from title_features import title_flags
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -156,6 +159,9 @@ def create_metadata(row: pd.Series, index: int) -> Dict[str, Any]:
     else:
         metadata["actors"] = []
     
+    # Флаги для бонусов ранжирования и объяснений (разбор строк один раз)
+    metadata["flags"] = title_flags(metadata)
+    
     return metadata
 
 def create_embeddings(df: pd.DataFrame, model_kind: str, model) -> np.ndarray:
@@ -173,10 +179,8 @@ def create_embeddings(df: pd.DataFrame, model_kind: str, model) -> np.ndarray:
     if model_kind == "st":
         embeddings = model.encode(texts, normalize_embeddings=True, show_progress_bar=True)
     else:
-        embeddings = model.fit_transform(texts).astype(np.float32)
-        A = embeddings.toarray()
-        norms = np.linalg.norm(A, axis=1, keepdims=True) + 1e-9
-        embeddings = A / norms
+        # CSR без densify: плотная матрица каталог x словарь занимала бы гигабайты
+        embeddings = normalize_rows(model.fit_transform(texts))
     
     logger.info(f"Создано эмбеддингов размерности: {embeddings.shape}")
     return embeddings
@@ -243,7 +247,7 @@ def analyze_okko_data(df: pd.DataFrame) -> Dict[str, Any]:
     return metadata
 
 def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str, Any], 
-                  output_dir: str = "data") -> None:
+                  output_dir: str = "data", vectorizer=None) -> None:
     """Сохраняет векторную базу данных"""
     os.makedirs(output_dir, exist_ok=True)
     
@@ -258,7 +262,7 @@ def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str,
     
     # Сохраняем данные
     df.to_pickle(f"{output_dir}/okko_test_movies_df.pkl")
-    np.save(f"{output_dir}/okko_test_embeddings.npy", embeddings)
+    embeddings_file = save_embeddings(output_dir, "okko_test_embeddings", embeddings)
     
     # Сохраняем общие метаданные
     with open(f"{output_dir}/okko_test_metadata.json", "w", encoding="utf-8") as f:
@@ -270,7 +274,12 @@ def save_vector_db(df: pd.DataFrame, embeddings: np.ndarray, metadata: Dict[str,
     
     logger.info(f"Сохранено в директории: {output_dir}")
     logger.info(f"  - okko_test_movies_df.pkl: {len(df)} фильмов")
-    logger.info(f"  - okko_test_embeddings.npy: эмбеддинги {embeddings.shape}")
+    logger.info(f"  - {os.path.basename(embeddings_file)}: эмбеддинги {embeddings.shape}")
+    
+    # Обученный TF-IDF: сервис кодирует запросы в том же пространстве без повторного обучения
+    if vectorizer is not None:
+        save_vectorizer(f"{output_dir}/okko_test_tfidf.npz", vectorizer)
+        logger.info(f"  - okko_test_tfidf.npz: словарь TF-IDF ({len(vectorizer.vocabulary_)} терминов)")
     logger.info(f"  - okko_test_metadata.json: общие метаданные")
     logger.info(f"  - okko_test_records_metadata.json: метаданные записей")
 
@@ -320,7 +329,7 @@ def main():
         embeddings = create_embeddings(df, model_kind, model)
         
         # Сохранение
-        save_vector_db(df, embeddings, metadata)
+        save_vector_db(df, embeddings, metadata, vectorizer=model if model_kind == "tfidf" else None)
         
         logger.info("=== ТЕСТ ЗАВЕРШЕН ===")
         logger.info("Тестовая векторная база данных Okko создана!")
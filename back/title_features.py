@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Признаки тайтлов Okko для ранжирования и объяснений
+
+Построитель векторной БД один раз разбирает строки метаданных (тип
+контента, страна, возрастной рейтинг, жанры) и сохраняет результат в
+record_meta["flags"]. Бонусы filter_and_rank, explain_recommendation и
+признаки выбора вопросов (build_item_features) читают готовые флаги
+вместо поиска подстрок на каждый запрос.
+Метаданные старых построений дополняются флагами при загрузке.
+"""
+
+from typing import Dict, List, Any
+
+# Версия набора флагов: при изменении правил флаги пересчитываются при загрузке
+FLAGS_VERSION = 2
+
+# Жанры: имя флага -> подстроки жанра (в нижнем регистре); жанр может
+# совпасть с несколькими флагами ("детектив" - crime и mystery)
+GENRE_KEYWORDS = [
+    ("comedy", ("комедия",)),
+    ("drama", ("драма",)),
+    ("action", ("боевик", "экшн")),
+    ("crime", ("криминал", "детектив")),
+    ("horror", ("ужас",)),
+    ("thriller", ("триллер",)),
+    ("romance", ("романтик", "мелодрама")),
+    ("scifi", ("фантастик",)),
+    ("fantasy", ("фэнтези",)),
+    ("animation", ("мульт", "анимац")),
+    ("biography", ("биограф",)),
+    ("history", ("истор",)),
+    ("mystery", ("мистик", "детектив")),
+    ("adventure", ("приключен",)),
+    ("sport", ("спорт",)),
+    ("documentary", ("документальн",)),
+    ("family", ("семейн",)),
+    ("musical", ("мюзикл",)),
+    ("war", ("военн",)),
+]
+
+RUSSIAN_MARKERS = ("россия", "рф")
+SOVIET_MARKER = "советский"
+
+# Возрастные корзины: бонусы сравнивают рейтинг с 12, 16 и 18
+AGE_UNKNOWN = 0  # нет рейтинга (и 0+, как и раньше бонусы его не учитывают)
+AGE_FAMILY = 1   # до 12+ включительно
+AGE_TEEN = 2     # 13+ - 15+
+AGE_MATURE = 3   # 16+ - 17+
+AGE_ADULT = 4    # 18+
+
+
+def age_bucket(age_rating) -> int:
+    """Возрастная корзина по рейтингу"""
+    if not age_rating:
+        return AGE_UNKNOWN
+    if age_rating <= 12:
+        return AGE_FAMILY
+    if age_rating < 16:
+        return AGE_TEEN
+    if age_rating < 18:
+        return AGE_MATURE
+    return AGE_ADULT
+
+
+def title_flags(record_meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Флаги тайтла по его метаданным
+
+    genre_hits - число жанров тайтла, совпавших с каждым флагом жанра
+    (жанровый бонус filter_and_rank начисляется за каждое совпадение).
+    """
+    content_type = (record_meta.get("content_type") or "").lower()
+    country = (record_meta.get("country") or "").lower()
+    flags = {
+        "version": FLAGS_VERSION,
+        "is_film": "фильм" in content_type,
+        "is_series": "сериал" in content_type,
+        "is_russian": any(c in country for c in RUSSIAN_MARKERS),
+        "is_soviet": SOVIET_MARKER in country,
+        "age_bucket": age_bucket(record_meta.get("age_rating")),
+    }
+
+    genre_hits = {}
+    for genre in record_meta.get("genres") or []:
+        genre_lower = genre.lower()
+        for name, keywords in GENRE_KEYWORDS:
+            if any(k in genre_lower for k in keywords):
+                genre_hits[name] = genre_hits.get(name, 0) + 1
+    for name, _ in GENRE_KEYWORDS:
+        flags[f"is_{name}"] = name in genre_hits
+    flags["genre_hits"] = genre_hits
+    return flags
+
+
+def get_title_flags(record_meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Сохраненные флаги тайтла или рассчитанные на лету (старые метаданные)"""
+    flags = record_meta.get("flags")
+    if flags is None or flags.get("version") != FLAGS_VERSION:
+        flags = title_flags(record_meta)
+    return flags
+
+
+def attach_title_flags(records_metadata: List[Dict[str, Any]]) -> int:
+    """Дополняет метаданные записей флагами, где их нет; возвращает число дополненных"""
+    added = 0
+    for record_meta in records_metadata:
+        flags = record_meta.get("flags")
+        if flags is None or flags.get("version") != FLAGS_VERSION:
+            record_meta["flags"] = title_flags(record_meta)
+            added += 1
+    return added
@@ -0,0 +1,81 @@
+"""
+Общие фикстуры микробенчмарков
+
+Размеры каталогов задаются BENCH_SIZES (через запятую), размерность
+эмбеддингов - BENCH_DIM. Результаты сохраняются в benchmarks/results/micro
+(pytest-benchmark storage), пиковая память - в extra_info каждого замера.
+"""
+
+import os
+import sys
+import tracemalloc
+from functools import lru_cache
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_catalog import make_okko_catalog, make_imdb_catalog, HashingEncoder
+
+SIZES = [int(s) for s in os.getenv("BENCH_SIZES", "1000,10000,100000,1000000").split(",") if s.strip()]
+DIM = int(os.getenv("BENCH_DIM", "384"))
+
+DEFAULT_STORAGE = "file://./.benchmarks"
+
+
+def pytest_configure(config):
+    # Хранилище результатов рядом с бенчмарками, независимо от текущей директории
+    if getattr(config.option, "benchmark_storage", None) == DEFAULT_STORAGE:
+        config.option.benchmark_storage = "file://" + os.path.join(BENCH_DIR, "results", "micro")
+
+
+def rounds_for(size: int) -> int:
+    """Количество повторов: больше для маленьких каталогов, один для миллиона"""
+    if size <= 1_000:
+        return 50
+    if size <= 10_000:
+        return 20
+    if size <= 100_000:
+        return 5
+    return 1
+
+
+@lru_cache(maxsize=2)
+def okko_catalog(size: int):
+    return make_okko_catalog(size, DIM)
+
+
+@lru_cache(maxsize=2)
+def imdb_catalog(size: int):
+    return make_imdb_catalog(size, DIM)
+
+
+@pytest.fixture(scope="session")
+def encoder():
+    return HashingEncoder(DIM)
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Замер времени и пиковой памяти ядра
+
+    Пиковая память снимается отдельным прогоном под tracemalloc (numpy
+    сообщает ему о своих аллокациях), чтобы трассировка не искажала время;
+    этот же прогон служит прогревом.
+    """
+    def run(fn, *args, rounds: int = 10, **kwargs):
+        tracemalloc.start()
+        try:
+            fn(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_mb"] = round(peak / 2 ** 20, 3)
+
+        return benchmark.pedantic(fn, args=args, kwargs=kwargs, rounds=rounds, iterations=1)
+
+    return run
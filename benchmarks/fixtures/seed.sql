@@ -0,0 +1,56 @@
+-- Минимальная копия схемы каталога Okko для бенчмарков
+-- Данные синтетические, объем подобран так, чтобы JOIN по связующим таблицам был заметен
+
+CREATE TABLE title (
+    title_id integer PRIMARY KEY,
+    serial_name text NOT NULL,
+    content_type text NOT NULL,
+    age_rating integer,
+    release_date date,
+    description text
+);
+
+CREATE TABLE genre (genre_id integer PRIMARY KEY, name text NOT NULL);
+CREATE TABLE actor (actor_id integer PRIMARY KEY, name text NOT NULL);
+CREATE TABLE director_item (director_item_id integer PRIMARY KEY, name text NOT NULL);
+
+CREATE TABLE title_genre (title_id integer REFERENCES title, genre_id integer REFERENCES genre);
+CREATE TABLE title_actor (title_id integer REFERENCES title, actor_id integer REFERENCES actor);
+CREATE TABLE title_director_item (title_id integer REFERENCES title, director_item_id integer REFERENCES director_item);
+
+INSERT INTO genre (genre_id, name) VALUES
+    (1, 'Комедия'), (2, 'Драма'), (3, 'Боевик'), (4, 'Триллер'), (5, 'Фантастика'),
+    (6, 'Мелодрама'), (7, 'Ужасы'), (8, 'Мультфильм'), (9, 'Детектив'), (10, 'Документальный');
+
+INSERT INTO title (title_id, serial_name, content_type, age_rating, release_date, description)
+SELECT
+    i,
+    'Тайтл ' || i,
+    (ARRAY['Фильм', 'Фильм', 'Сериал', 'Многосерийный фильм'])[1 + i % 4],
+    (ARRAY[0, 6, 12, 16, 18])[1 + i % 5],
+    DATE '1970-01-01' + (i * 37 % 20000),
+    'Описание тайтла ' || i || ': история о приключениях, дружбе и выборе.'
+FROM generate_series(1, 20000) AS i;
+
+INSERT INTO actor (actor_id, name)
+SELECT i, 'Актер ' || i FROM generate_series(1, 5000) AS i;
+
+INSERT INTO director_item (director_item_id, name)
+SELECT i, 'Режиссер ' || i FROM generate_series(1, 1000) AS i;
+
+INSERT INTO title_genre (title_id, genre_id)
+SELECT i, 1 + i % 10 FROM generate_series(1, 20000) AS i
+UNION ALL
+SELECT i, 1 + (i * 7) % 10 FROM generate_series(1, 20000) AS i WHERE (i * 7) % 10 <> i % 10;
+
+INSERT INTO title_actor (title_id, actor_id)
+SELECT t, 1 + (t * k * 13) % 5000 FROM generate_series(1, 20000) AS t, generate_series(1, 5) AS k;
+
+INSERT INTO title_director_item (title_id, director_item_id)
+SELECT i, 1 + (i * 17) % 1000 FROM generate_series(1, 20000) AS i;
+
+CREATE INDEX title_genre_title_idx ON title_genre (title_id);
+CREATE INDEX title_actor_title_idx ON title_actor (title_id);
+CREATE INDEX title_director_item_title_idx ON title_director_item (title_id);
+
+ANALYZE;
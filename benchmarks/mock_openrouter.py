@@ -0,0 +1,329 @@
+"""
+Детерминированный mock OpenRouter API для бенчмарков и офлайн тестов
+
+Возвращает сценарные ответы chat completions (обычный текст, tool calls,
+структурированный JSON, SSE стриминг) и умеет внедрять задержки, ошибки
+403/502 и обрезанный JSON. Все случайные решения выводятся из seed, тела
+запроса и номера попытки, поэтому не зависят от порядка параллельных запросов:
+одинаковый прогон дает одинаковые ответы, а повтор запроса (retry, fallback)
+получает следующую по счету попытку.
+
+Поведение задается переменными окружения MOCK_*, аргументами командной строки
+или во время работы через POST /mock/config. Модели вида mock/error-403,
+mock/error-502, mock/truncated и mock/slow всегда дают соответствующий сбой -
+удобно для проверки fallback.
+
+Использование:
+    python benchmarks/mock_openrouter.py --port 5999 --seed 1 --error-502-rate 0.05
+    OPENROUTER_BASE_URL=http://127.0.0.1:5999/api/v1 python simple_chat_service.py
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from typing import Dict, List, Any, Optional
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+# Настройки по умолчанию (переопределяются MOCK_* и аргументами)
+CONFIG = {
+    "seed": int(os.getenv("MOCK_SEED", "0")),
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", "50")),
+    "latency_jitter_ms": float(os.getenv("MOCK_LATENCY_JITTER_MS", "0")),
+    "error_403_rate": float(os.getenv("MOCK_ERROR_403_RATE", "0")),
+    "error_502_rate": float(os.getenv("MOCK_ERROR_502_RATE", "0")),
+    "truncate_rate": float(os.getenv("MOCK_TRUNCATE_RATE", "0")),
+    "stream_chunk_chars": int(os.getenv("MOCK_STREAM_CHUNK_CHARS", "16")),
+    "stream_chunk_delay_ms": float(os.getenv("MOCK_STREAM_CHUNK_DELAY_MS", "10")),
+    "tool_calls": os.getenv("MOCK_TOOL_CALLS", "true").lower() == "true",
+    "prompt_tokens": int(os.getenv("MOCK_PROMPT_TOKENS", "500")),
+    "completion_tokens": int(os.getenv("MOCK_COMPLETION_TOKENS", "50")),
+}
+
+# Сценарии: [{"match": "подстрока последнего сообщения", "content": "...", "tool_calls": [...]}]
+SCRIPTS: List[Dict[str, Any]] = []
+
+STRUCTURED_ANSWER = {
+    "status": "found",
+    "message": "Подобрал несколько фильмов под ваш запрос.",
+    "recommended_movie_ids": [1, 2, 3],
+    "confidence": 0.8
+}
+
+# Аргументы tool calls по умолчанию (первый доступный из списка)
+DEFAULT_TOOL_CALLS = [
+    ("search_movie_candidates", lambda text: {"query": text, "top_k": 5}),
+    ("execute_database_query", lambda text: {
+        "query": "SELECT title_id, serial_name, release_year FROM title_search LIMIT 5"
+    }),
+]
+
+_state_lock = threading.Lock()
+_attempts: Dict[str, int] = {}
+_stats = {"requests": 0, "errors_403": 0, "errors_502": 0, "truncated": 0, "streams": 0, "tool_calls": 0}
+
+
+def _count(key: str):
+    with _state_lock:
+        _stats[key] += 1
+
+
+def _request_rng(body: Dict[str, Any]) -> random.Random:
+    """ГСЧ для запроса: seed + хэш тела + номер попытки с тем же телом"""
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    with _state_lock:
+        attempt = _attempts.get(digest, 0)
+        _attempts[digest] = attempt + 1
+        _stats["requests"] += 1
+    return random.Random(f"{CONFIG['seed']}:{digest}:{attempt}")
+
+
+def _last_user_text(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content or ""
+    return ""
+
+
+def _usage(rng: random.Random) -> Dict[str, Any]:
+    prompt_tokens = CONFIG["prompt_tokens"]
+    cached_tokens = rng.choice([0, prompt_tokens // 2])
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": CONFIG["completion_tokens"],
+        "total_tokens": prompt_tokens + CONFIG["completion_tokens"],
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        "cost": 0.0
+    }
+
+
+def _match_script(text: str) -> Optional[Dict[str, Any]]:
+    lowered = text.lower()
+    for script in SCRIPTS:
+        if script.get("match", "").lower() in lowered:
+            return script
+    return None
+
+
+def _build_message(body: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    """Сценарный ответ ассистента"""
+    messages = body.get("messages", [])
+    text = _last_user_text(messages)
+    script = _match_script(text)
+
+    has_tool_results = any(m.get("role") == "tool" for m in messages)
+    tool_names = [t.get("function", {}).get("name") for t in body.get("tools") or []]
+
+    # Первый шаг диалога с tools - вызов инструмента, дальше финальный ответ
+    if tool_names and not has_tool_results and CONFIG["tool_calls"]:
+        tool_calls = script.get("tool_calls") if script else None
+        if tool_calls is None:
+            for name, make_args in DEFAULT_TOOL_CALLS:
+                if name in tool_names:
+                    tool_calls = [{"name": name, "arguments": make_args(text)}]
+                    break
+            else:
+                tool_calls = [{"name": tool_names[0], "arguments": {}}]
+
+        _count("tool_calls")
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{rng.randrange(16 ** 8):08x}",
+                    "type": "function",
+                    "function": {
+                        "name": call["name"],
+                        "arguments": json.dumps(call.get("arguments", {}), ensure_ascii=False)
+                    }
+                }
+                for call in tool_calls
+            ]
+        }
+
+    if body.get("response_format"):
+        content = json.dumps(script.get("structured", STRUCTURED_ANSWER) if script else STRUCTURED_ANSWER,
+                             ensure_ascii=False)
+    elif script and script.get("content"):
+        content = script["content"]
+    else:
+        content = f"Тестовый ответ mock сервера на сообщение: {text[:80]}"
+
+    return {"role": "assistant", "content": content}
+
+
+def _error(status: int, message: str):
+    return jsonify({"error": {"code": status, "message": message}}), status
+
+
+def _sleep_latency(rng: random.Random, model: str):
+    latency = CONFIG["latency_ms"] + rng.uniform(0, CONFIG["latency_jitter_ms"])
+    if model == "mock/slow":
+        latency *= 20
+    time.sleep(latency / 1000)
+
+
+def _stream(body: Dict[str, Any], message: Dict[str, Any], usage: Dict[str, Any], truncate: bool):
+    """SSE поток в формате OpenRouter"""
+    model = body.get("model", "mock/model")
+    chunk_chars = max(1, CONFIG["stream_chunk_chars"])
+    delay = CONFIG["stream_chunk_delay_ms"] / 1000
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, with_usage: bool = False) -> str:
+        payload = {
+            "id": "mock-completion",
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if with_usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def generate():
+        yield ": OPENROUTER PROCESSING\n\n"
+        if message.get("tool_calls"):
+            yield chunk({"role": "assistant", "tool_calls": message["tool_calls"]})
+        content = message.get("content") or ""
+        for start in range(0, len(content), chunk_chars):
+            time.sleep(delay)
+            data = chunk({"content": content[start:start + chunk_chars]})
+            if truncate and start + chunk_chars >= len(content) // 2:
+                # Оборванный поток: половина JSON чанка без завершения
+                yield data[:len(data) // 2]
+                return
+            yield data
+        yield chunk({}, "tool_calls" if message.get("tool_calls") else "stop", with_usage=True)
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream")
+
+
+@app.route('/api/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """Ответ в формате OpenAI/OpenRouter chat completions"""
+    body = request.get_json(silent=True) or {}
+    model = body.get("model", "mock/model")
+    rng = _request_rng(body)
+
+    _sleep_latency(rng, model)
+
+    roll = rng.random()
+    if model == "mock/error-403" or roll < CONFIG["error_403_rate"]:
+        _count("errors_403")
+        return _error(403, "Provider returned error: model is not available in your region")
+    if model == "mock/error-502" or roll < CONFIG["error_403_rate"] + CONFIG["error_502_rate"]:
+        _count("errors_502")
+        return _error(502, "Upstream provider error")
+
+    truncate = model == "mock/truncated" or rng.random() < CONFIG["truncate_rate"]
+    if truncate:
+        _count("truncated")
+
+    message = _build_message(body, rng)
+    usage = _usage(rng)
+
+    if body.get("stream"):
+        _count("streams")
+        return _stream(body, message, usage, truncate)
+
+    payload = json.dumps({
+        "id": "mock-completion",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+        }],
+        "usage": usage
+    }, ensure_ascii=False)
+
+    if truncate:
+        payload = payload[:len(payload) // 2]
+
+    return Response(payload, status=200, mimetype="application/json")
+
+
+@app.route('/api/v1/models', methods=['GET'])
+def models():
+    """Список моделей"""
+    return jsonify({"data": [
+        {"id": "anthropic/claude-haiku-4.5"},
+        {"id": "openai/gpt-4o"},
+        {"id": "x-ai/grok-4-fast"},
+        {"id": "mock/error-403"},
+        {"id": "mock/error-502"},
+        {"id": "mock/truncated"},
+        {"id": "mock/slow"},
+    ]})
+
+
+@app.route('/mock/config', methods=['GET', 'POST'])
+def mock_config():
+    """Текущие настройки mock сервера; POST меняет их на лету"""
+    if request.method == 'POST':
+        updates = request.get_json(silent=True) or {}
+        unknown = [key for key in updates if key not in CONFIG]
+        if unknown:
+            return jsonify({"success": False, "error": f"Неизвестные параметры: {', '.join(unknown)}"}), 400
+        CONFIG.update(updates)
+    return jsonify({"success": True, "config": CONFIG})
+
+
+@app.route('/mock/stats', methods=['GET'])
+def mock_stats():
+    """Счетчики обработанных запросов и внедренных сбоев"""
+    with _state_lock:
+        return jsonify(dict(_stats))
+
+
+@app.route('/mock/reset', methods=['POST'])
+def mock_reset():
+    """Сброс счетчиков и номеров попыток (повтор прогона с тем же seed)"""
+    with _state_lock:
+        _attempts.clear()
+        for key in _stats:
+            _stats[key] = 0
+    return jsonify({"success": True})
+
+
+def load_scripts(path: str):
+    """Загрузка сценарных ответов из JSON файла"""
+    with open(path, "r", encoding="utf-8") as f:
+        SCRIPTS[:] = json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock OpenRouter API")
+    parser.add_argument("--port", type=int, default=5999)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--latency-jitter-ms", type=float)
+    parser.add_argument("--error-403-rate", type=float)
+    parser.add_argument("--error-502-rate", type=float)
+    parser.add_argument("--truncate-rate", type=float)
+    parser.add_argument("--no-tool-calls", action="store_true", help="Сразу финальный ответ без tool calls")
+    parser.add_argument("--scripts", default=os.getenv("MOCK_SCRIPTS_FILE"), help="JSON файл со сценариями")
+    args = parser.parse_args()
+
+    for key in ("seed", "latency_ms", "latency_jitter_ms", "error_403_rate", "error_502_rate", "truncate_rate"):
+        value = getattr(args, key)
+        if value is not None:
+            CONFIG[key] = value
+    if args.no_tool_calls:
+        CONFIG["tool_calls"] = False
+    if args.scripts:
+        load_scripts(args.scripts)
+
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
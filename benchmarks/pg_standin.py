@@ -0,0 +1,111 @@
+"""
+Временный локальный PostgreSQL для бенчмарков
+
+Поднимает кластер через initdb/pg_ctl во временной директории, загружает
+fixtures/seed.sql и собирает витрину title_search. Требует PostgreSQL
+бинарники в PATH (или PG_BIN).
+"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import subprocess
+
+import psycopg2
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+logger = logging.getLogger(__name__)
+
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "seed.sql")
+
+
+def _pg_binary(name: str) -> str:
+    pg_bin = os.getenv("PG_BIN")
+    if pg_bin:
+        return os.path.join(pg_bin, name)
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(f"{name} не найден: установите PostgreSQL или укажите PG_BIN")
+    return path
+
+
+class PostgresStandin:
+    """Одноразовый кластер PostgreSQL с тестовым каталогом"""
+
+    def __init__(self, port: int = 55432, database: str = "okko_bench", user: str = "bench"):
+        self.port = port
+        self.database = database
+        self.user = user
+        self.data_dir = None
+
+    def start(self):
+        """Создание кластера, запуск и загрузка данных"""
+        self.data_dir = tempfile.mkdtemp(prefix="okko_bench_pg_")
+        log_file = os.path.join(self.data_dir, "postgres.log")
+
+        subprocess.run(
+            [_pg_binary("initdb"), "-D", self.data_dir, "-U", self.user, "--auth=trust", "-E", "UTF8"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run(
+            [_pg_binary("pg_ctl"), "-D", self.data_dir, "-l", log_file, "-w",
+             "-o", f"-p {self.port} -k {self.data_dir} -c listen_addresses=127.0.0.1", "start"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+
+        conn = psycopg2.connect(host="127.0.0.1", port=self.port, user=self.user, dbname="postgres")
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {self.database}")
+        conn.close()
+
+        conn = psycopg2.connect(host="127.0.0.1", port=self.port, user=self.user, dbname=self.database)
+        conn.autocommit = True
+        with conn.cursor() as cur, open(SEED_FILE, "r", encoding="utf-8") as f:
+            cur.execute(f.read())
+        conn.close()
+
+        self._build_title_search()
+        logger.info(f"PostgreSQL для бенчмарков запущен на порту {self.port}")
+
+    def _build_title_search(self):
+        """Сборка витрины title_search, как в рабочем окружении"""
+        env_backup = dict(os.environ)
+        os.environ.update(self.env())
+        try:
+            from build_title_search import build_view
+            from database_tool import DatabaseTool
+            build_view(DatabaseTool().engine)
+        except Exception as e:
+            logger.warning(f"Витрина title_search не собрана: {e}")
+        finally:
+            os.environ.clear()
+            os.environ.update(env_backup)
+
+    def env(self) -> dict:
+        """Переменные окружения для сервисов"""
+        return {
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(self.port),
+            "DB_NAME": self.database,
+            "DB_USER": self.user,
+            "DB_PASSWORD": "bench",
+        }
+
+    def stop(self):
+        """Остановка кластера и удаление данных"""
+        if self.data_dir is None:
+            return
+        try:
+            subprocess.run(
+                [_pg_binary("pg_ctl"), "-D", self.data_dir, "-m", "fast", "-w", "stop"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except RuntimeError:
+            pass
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        self.data_dir = None
@@ -0,0 +1,396 @@
+"""
+Сквозной бенчмарк задержек всех пяти сервисов
+
+Запускает app.py, okkonator_service.py, swipe_service.py,
+movie_recommendation_service.py и simple_chat_service.py с локальным mock
+OpenRouter и временным PostgreSQL, воспроизводит смесь запросов из
+benchmarks/mixes/*.json и печатает p50/p95/p99 и RPS по каждому endpoint.
+
+Использование:
+    python benchmarks/run_e2e.py
+    python benchmarks/run_e2e.py --mix benchmarks/mixes/default.json --output results.json
+    python benchmarks/run_e2e.py --baseline benchmarks/results/baseline.json
+    python benchmarks/run_e2e.py --no-start   # сервисы уже запущены
+
+При --baseline код возврата 1, если p95 какого-либо endpoint вырос больше
+допустимого порога.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BENCH_DIR)
+
+MOCK_OPENROUTER_PORT = 5999
+
+# Сервисы и их адреса (порты совпадают с адресами в app.py)
+SERVICES = {
+    "app": {"script": "app.py", "port": 5000, "health": "/"},
+    "okkonator": {"script": "okkonator_service.py", "port": 5001, "health": "/ready"},
+    "swipe": {"script": "swipe_service.py", "port": 5002, "health": "/ready"},
+    "movie_recommendation": {"script": "movie_recommendation_service.py", "port": 5003, "health": "/health"},
+    "simple_chat": {"script": "simple_chat_service.py", "port": 5004, "health": "/health"},
+}
+
+
+def service_url(service: str, path: str) -> str:
+    return f"http://127.0.0.1:{SERVICES[service]['port']}{path}"
+
+
+class ProcessGroup:
+    """Запущенные фоновые процессы (в отдельных группах, чтобы убить и дочерние)"""
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        self.processes: Dict[str, subprocess.Popen] = {}
+        os.makedirs(log_dir, exist_ok=True)
+
+    def start(self, name: str, args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+        log = open(os.path.join(self.log_dir, f"{name}.log"), "w")
+        process = subprocess.Popen(
+            args, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        self.processes[name] = process
+        return process
+
+    def stop_all(self):
+        for process in self.processes.values():
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + 10
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self.processes.clear()
+
+
+def wait_for_url(url: str, timeout: float, process: Optional[subprocess.Popen] = None) -> bool:
+    """Ожидание, пока сервис начнет отвечать"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def _extract(data: Any, path: str) -> Any:
+    """Значение по пути вида 'movies.0.id'"""
+    for part in path.split("."):
+        data = data[int(part)] if isinstance(data, list) else data[part]
+    return data
+
+
+def _render(template: Any, values: Dict[str, Any]) -> Any:
+    """Подстановка значений из setup в тело запроса ("{session_id}" -> значение)"""
+    if isinstance(template, dict):
+        return {k: _render(v, values) for k, v in template.items()}
+    if isinstance(template, list):
+        return [_render(v, values) for v in template]
+    if isinstance(template, str) and template.startswith("{") and template.endswith("}"):
+        return values.get(template[1:-1], template)
+    return template
+
+
+def run_setup(mix: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Выполнение подготовительных запросов (например, создание сессии свайпов)"""
+    results = {}
+    for name, step in mix.get("setup", {}).items():
+        try:
+            response = requests.request(
+                step["method"], service_url(step["service"], step["path"]),
+                json=step.get("json"), timeout=60
+            )
+            response.raise_for_status()
+            body = response.json()
+            results[name] = {key: _extract(body, path) for key, path in step.get("extract", {}).items()}
+        except Exception as e:
+            print(f"⚠️  Setup {name} не выполнен: {e}")
+            results[name] = None
+    return results
+
+
+def build_schedule(mix: Dict[str, Any], endpoints: List[Dict[str, Any]], total: int) -> List[Dict[str, Any]]:
+    """Детерминированная последовательность запросов по весам endpoint"""
+    rng = random.Random(mix.get("seed", 42))
+    weights = [e.get("weight", 1) for e in endpoints]
+    return rng.choices(endpoints, weights=weights, k=total)
+
+
+def replay(schedule: List[Dict[str, Any]], setup: Dict[str, Any], concurrency: int):
+    """Воспроизведение запросов с заданной конкурентностью"""
+    local = threading.local()
+    samples: List[tuple] = []
+    samples_lock = threading.Lock()
+
+    def send(endpoint):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        body = _render(endpoint.get("json"), setup.get(endpoint.get("setup")) or {})
+
+        start = time.perf_counter()
+        try:
+            response = local.session.request(
+                endpoint["method"], service_url(endpoint["service"], endpoint["path"]),
+                json=body, timeout=60
+            )
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with samples_lock:
+            samples.append((endpoint["name"], elapsed_ms, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, schedule))
+    wall_seconds = time.perf_counter() - started
+
+    return samples, wall_seconds
+
+
+def summarize(samples: List[tuple], wall_seconds: float) -> Dict[str, Dict[str, float]]:
+    """p50/p95/p99, среднее, доля ошибок и RPS по endpoint"""
+    by_endpoint: Dict[str, List[tuple]] = {}
+    for name, elapsed_ms, ok in samples:
+        by_endpoint.setdefault(name, []).append((elapsed_ms, ok))
+
+    report = {}
+    for name, rows in sorted(by_endpoint.items()):
+        latencies = np.array([r[0] for r in rows])
+        errors = sum(1 for r in rows if not r[1])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report[name] = {
+            "count": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows),
+            "mean_ms": float(latencies.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "rps": len(rows) / wall_seconds if wall_seconds else 0.0,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, float]], wall_seconds: float):
+    header = f"{'endpoint':<34} {'count':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>8}"
+    print("\n" + header)
+    print("-" * len(header))
+    total = 0
+    for name, stats in report.items():
+        total += stats["count"]
+        print(
+            f"{name:<34} {stats['count']:>6} {stats['errors']:>5} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['rps']:>8.1f}"
+        )
+    print("-" * len(header))
+    print(f"Всего: {total} запросов за {wall_seconds:.1f} сек ({total / wall_seconds:.1f} RPS)")
+
+
+def compare_with_baseline(report: Dict[str, Dict[str, float]], baseline: Dict[str, Any],
+                          threshold: float, min_delta_ms: float) -> List[str]:
+    """Список регрессий p95 относительно сохраненного прогона"""
+    regressions = []
+    for name, base in baseline.get("endpoints", {}).items():
+        current = report.get(name)
+        if current is None:
+            continue
+        delta = current["p95_ms"] - base["p95_ms"]
+        if current["p95_ms"] > base["p95_ms"] * (1 + threshold) and delta > min_delta_ms:
+            regressions.append(
+                f"{name}: p95 {base['p95_ms']:.1f} -> {current['p95_ms']:.1f} мс (+{delta:.1f} мс)"
+            )
+        if current["error_rate"] > base.get("error_rate", 0) + 0.01:
+            regressions.append(
+                f"{name}: доля ошибок {base.get('error_rate', 0):.1%} -> {current['error_rate']:.1%}"
+            )
+    return regressions
+
+
+def configure_mock(mix: Dict[str, Any], overrides: List[str]):
+    """Настройки mock OpenRouter из смеси ("mock": {...}) и --mock KEY=VALUE"""
+    config = dict(mix.get("mock", {}))
+    for item in overrides:
+        key, _, value = item.partition("=")
+        config[key] = json.loads(value)
+    if config:
+        response = requests.post(
+            f"http://127.0.0.1:{MOCK_OPENROUTER_PORT}/mock/config", json=config, timeout=5
+        )
+        response.raise_for_status()
+    requests.post(f"http://127.0.0.1:{MOCK_OPENROUTER_PORT}/mock/reset", timeout=5)
+
+
+def start_stack(args, processes: ProcessGroup):
+    """Запуск mock OpenRouter, PostgreSQL и сервисов"""
+    env = dict(os.environ)
+    env.update({
+        "OPENROUTER_API_KEY": "bench-key",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{MOCK_OPENROUTER_PORT}/api/v1",
+        "MOVIE_RECOMMENDATION_PORT": str(SERVICES["movie_recommendation"]["port"]),
+        "SIMPLE_CHAT_PORT": str(SERVICES["simple_chat"]["port"]),
+        "PYTHONUNBUFFERED": "1",
+        # Без отладочного режима Flask (перезагрузчик, debugger) - как в продакшене
+        "FLASK_DEBUG": "false",
+        # Смесь повторяет одни и те же сообщения: с кэшем мерился бы только он,
+        # а не цикл LLM + tools (включить: --env SEMANTIC_CACHE_ENABLED=true)
+        "SEMANTIC_CACHE_ENABLED": "false",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    mock = processes.start(
+        "mock_openrouter",
+        [sys.executable, os.path.join(BENCH_DIR, "mock_openrouter.py"), "--port", str(MOCK_OPENROUTER_PORT),
+         "--scripts", args.mock_scripts],
+        env
+    )
+    if not wait_for_url(f"http://127.0.0.1:{MOCK_OPENROUTER_PORT}/api/v1/models", 30, mock):
+        raise RuntimeError("Mock OpenRouter не запустился")
+
+    postgres = None
+    if not args.external_db:
+        from pg_standin import PostgresStandin
+        postgres = PostgresStandin()
+        try:
+            postgres.start()
+            env.update(postgres.env())
+        except Exception as e:
+            print(f"⚠️  Локальный PostgreSQL не запущен ({e}), используются DB_* из окружения")
+            postgres.stop()
+            postgres = None
+
+    started = []
+    for name in args.services:
+        service = SERVICES[name]
+        process = processes.start(name, [sys.executable, service["script"]], env)
+        if wait_for_url(service_url(name, service["health"]), args.startup_timeout, process):
+            print(f"✅ {name} готов")
+            started.append(name)
+        else:
+            print(f"❌ {name} не запустился, см. {os.path.join(processes.log_dir, name + '.log')}")
+
+    return postgres, started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк задержек сервисов")
+    parser.add_argument("--mix", default=os.path.join(BENCH_DIR, "mixes", "default.json"))
+    parser.add_argument("--requests", type=int, help="Количество запросов (по умолчанию из смеси)")
+    parser.add_argument("--concurrency", type=int, help="Параллельных клиентов (по умолчанию из смеси)")
+    parser.add_argument("--services", nargs="+", default=list(SERVICES), choices=list(SERVICES))
+    parser.add_argument("--output", help="Куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="Результаты прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост p95 (доля)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Игнорировать рост p95 меньше N мс")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--no-start", action="store_true", help="Не запускать сервисы, они уже работают")
+    parser.add_argument("--external-db", action="store_true", help="Использовать БД из DB_* окружения")
+    parser.add_argument("--env", action="append", default=[], help="Доп. переменные сервисов KEY=VALUE")
+    parser.add_argument("--mock", action="append", default=[],
+                        help="Настройка mock OpenRouter KEY=VALUE (JSON значение), например error_502_rate=0.05")
+    parser.add_argument("--mock-scripts", default=os.path.join(BENCH_DIR, "fixtures", "mock_scripts.json"))
+    args = parser.parse_args()
+
+    with open(args.mix, "r", encoding="utf-8") as f:
+        mix = json.load(f)
+
+    processes = ProcessGroup(os.path.join(BENCH_DIR, "results", "logs"))
+    postgres = None
+    try:
+        if args.no_start:
+            available = args.services
+        else:
+            postgres, available = start_stack(args, processes)
+
+        if not args.no_start:
+            configure_mock(mix, args.mock)
+
+        endpoints = [e for e in mix["endpoints"] if e["service"] in available]
+        if not endpoints:
+            print("❌ Нет доступных сервисов для бенчмарка")
+            return 1
+
+        setup = run_setup(mix)
+        endpoints = [e for e in endpoints if not e.get("setup") or setup.get(e["setup"])]
+
+        concurrency = args.concurrency or mix.get("concurrency", 8)
+        total = args.requests or mix.get("requests", 400)
+
+        # Прогрев: загрузка моделей, пулы соединений, JIT кэши
+        warmup = build_schedule(mix, endpoints, mix.get("warmup", 20))
+        replay(warmup, setup, concurrency)
+
+        samples, wall_seconds = replay(build_schedule(mix, endpoints, total), setup, concurrency)
+        report = summarize(samples, wall_seconds)
+        print_report(report, wall_seconds)
+
+        mock_stats = None
+        if not args.no_start:
+            mock_stats = requests.get(f"http://127.0.0.1:{MOCK_OPENROUTER_PORT}/mock/stats", timeout=5).json()
+            print(f"Mock OpenRouter: {mock_stats}")
+
+        result = {
+            "mix": mix.get("name"),
+            "mock_stats": mock_stats,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "concurrency": concurrency,
+            "requests": total,
+            "wall_seconds": wall_seconds,
+            "endpoints": report,
+        }
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"Результаты сохранены в {args.output}")
+
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_with_baseline(report, baseline, args.threshold, args.min_delta_ms)
+            if regressions:
+                print("\n❌ Регрессии относительно baseline:")
+                for line in regressions:
+                    print(f"   - {line}")
+                return 1
+            print("\n✅ Регрессий относительно baseline нет")
+
+        return 0
+    finally:
+        processes.stop_all()
+        if postgres is not None:
+            postgres.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
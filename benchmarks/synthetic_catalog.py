@@ -0,0 +1,168 @@
+"""
+Синтетические каталоги для микробенчмарков
+
+Генерирует каталог Okko (df, эмбеддинги, records_metadata в формате
+build_okko_vector_db.py) и каталог IMDB (df в формате load_movies_fallback)
+заданного размера. Распределения типов, стран, рейтингов и жанров близки к
+реальному каталогу, поэтому ветки бонусов в filter_and_rank срабатывают
+с реалистичной частотой.
+"""
+
+import zlib
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+OKKO_CONTENT_TYPES = (["Фильм", "Сериал", "Многосерийный фильм"], [0.6, 0.3, 0.1])
+OKKO_COUNTRIES = (
+    ["Россия", "США", "Великобритания", "Франция", "СССР", "Южная Корея", "Германия", "Япония"],
+    [0.35, 0.3, 0.08, 0.07, 0.06, 0.05, 0.05, 0.04]
+)
+OKKO_AGE_RATINGS = ([0.0, 6.0, 12.0, 16.0, 18.0, None], [0.1, 0.15, 0.2, 0.3, 0.2, 0.05])
+OKKO_GENRES = [
+    "Комедия", "Драма", "Боевик", "Триллер", "Ужасы", "Мелодрама", "Фантастика", "Фэнтези",
+    "Детектив", "Криминал", "Приключения", "Семейный", "Мультфильм", "Документальный",
+    "Военный", "Исторический", "Биография", "Спорт", "Мюзикл", "Романтика"
+]
+
+IMDB_GENRES = [
+    "Action", "Comedy", "Drama", "Crime", "Horror", "Thriller", "Romance",
+    "Sci-Fi", "Fantasy", "Animation", "Adventure", "Mystery", "Biography", "Family"
+]
+
+
+def _choice(rng: np.random.Generator, values_probs: Tuple[List[Any], List[float]], n: int) -> List[Any]:
+    values, probs = values_probs
+    return [values[i] for i in rng.choice(len(values), size=n, p=probs)]
+
+
+def make_embeddings(n: int, dim: int = 384, seed: int = 0) -> np.ndarray:
+    """Нормализованные float32 эмбеддинги (как у SentenceTransformer с normalize_embeddings)"""
+    rng = np.random.default_rng(seed)
+    emb = rng.standard_normal((n, dim), dtype=np.float32)
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    return emb
+
+
+def make_okko_catalog(n: int, dim: int = 384, seed: int = 0):
+    """
+    Каталог Okko в формате load_okko_vector_db
+
+    Returns:
+        (df, embeddings, records_metadata)
+    """
+    rng = np.random.default_rng(seed)
+
+    content_types = _choice(rng, OKKO_CONTENT_TYPES, n)
+    countries = _choice(rng, OKKO_COUNTRIES, n)
+    age_ratings = _choice(rng, OKKO_AGE_RATINGS, n)
+    years = rng.integers(1950, 2025, size=n)
+    genre_counts = rng.integers(1, 4, size=n)
+    genre_ids = rng.integers(0, len(OKKO_GENRES), size=(n, 3))
+    actor_ids = rng.integers(0, max(10, n // 4), size=(n, 5))
+
+    records_metadata = []
+    for i in range(n):
+        genres = list(dict.fromkeys(OKKO_GENRES[g] for g in genre_ids[i, :genre_counts[i]]))
+        records_metadata.append({
+            "id": i,
+            "title": f"Тайтл {i}",
+            "content_type": content_types[i],
+            "country": countries[i],
+            "age_rating": age_ratings[i],
+            "url": f"https://okko.tv/movie/title-{i}",
+            "studio": "",
+            "director": f"Режиссер {i % 997}",
+            "release_date": f"{years[i]}-01-01",
+            "genres": genres,
+            "actors": [f"Актер {a}" for a in actor_ids[i]],
+        })
+
+    df = pd.DataFrame({
+        "serial_name": [r["title"] for r in records_metadata],
+        "content_type": content_types,
+        "genres": [", ".join(r["genres"]) for r in records_metadata],
+        "country": countries,
+        "age_rating": age_ratings,
+        "release_date": [r["release_date"] for r in records_metadata],
+        "description": [f"Описание тайтла {i}: история о дружбе, выборе и приключениях." for i in range(n)],
+        "url": [r["url"] for r in records_metadata],
+    })
+
+    return df, make_embeddings(n, dim, seed), records_metadata
+
+
+def make_imdb_catalog(n: int, dim: int = 384, seed: int = 0):
+    """
+    Каталог IMDB в формате load_movies_fallback (swipe_service, back/okkonator.py)
+
+    Returns:
+        (df, embeddings)
+    """
+    rng = np.random.default_rng(seed + 1)
+
+    genre_ids = rng.integers(0, len(IMDB_GENRES), size=(n, 2))
+    genres = [f"{IMDB_GENRES[a]}, {IMDB_GENRES[b]}" for a, b in genre_ids]
+    violent = {"Horror", "Thriller", "Crime", "Action"}
+
+    df = pd.DataFrame({
+        "title": [f"Movie {i}" for i in range(n)],
+        "year": rng.integers(1950, 2025, size=n).astype(float),
+        "certificate": rng.choice(["PG", "PG-13", "R", "TV-MA", "G"], size=n),
+        "duration": rng.integers(70, 200, size=n).astype(float),
+        "genre": genres,
+        "rating": np.round(rng.uniform(3.0, 9.5, size=n), 1),
+        "description": [f"Description of movie {i}." for i in range(n)],
+        "stars": ["" for _ in range(n)],
+        "votes": np.floor(10 ** rng.uniform(2, 6.5, size=n)),
+    })
+    df["violence"] = [
+        int(cert in ("R", "TV-MA") or bool(violent & {g.strip() for g in genre.split(",")}))
+        for cert, genre in zip(df["certificate"], df["genre"])
+    ]
+
+    return df, make_embeddings(n, dim, seed + 1)
+
+
+class HashingEncoder:
+    """
+    Детерминированный энкодер с API SentenceTransformer.encode
+
+    Бенчмарки измеряют ранжирование, а не инференс модели, поэтому текст
+    профиля превращается в вектор через хэш без загрузки трансформера.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        vectors = np.stack([
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dim).astype(np.float32)
+            for text in texts
+        ])
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def okko_theta() -> Dict[str, float]:
+    """Профиль, при котором срабатывают все ветки бонусов Okko filter_and_rank"""
+    from back.okkonator_okko import init_theta
+    theta = init_theta()
+    theta.update({
+        "prefer_movies": 0.6, "prefer_russian": 0.5, "family_friendly": 0.4,
+        "genre_comedy": 0.7, "genre_drama": 0.3, "genre_romance": 0.4, "humor": 0.6
+    })
+    return theta
+
+
+def imdb_theta() -> Dict[str, float]:
+    """Профиль, при котором срабатывают все фильтры IMDB filter_and_rank"""
+    from back.okkonator import init_theta
+    theta = init_theta()
+    theta.update({
+        "violence_tol": -0.4, "length_short": 0.5, "recent": 0.6,
+        "high_rating": 0.5, "popular": 0.5, "genre_comedy": 0.6
+    })
+    return theta
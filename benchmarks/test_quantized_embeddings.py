@@ -0,0 +1,84 @@
+"""
+Квантованные эмбеддинги: скорость скана и полнота после реранка
+
+Запуск:
+    BENCH_SIZES=10000,100000 python -m pytest benchmarks/test_quantized_embeddings.py --benchmark-autosave
+"""
+
+import numpy as np
+import pytest
+
+from conftest import SIZES, DIM, okko_catalog, rounds_for
+from synthetic_catalog import okko_theta
+
+import back.okkonator_okko as okko
+from back.quantized_embeddings import QuantizedEmbeddings, quantize, recall_at_k
+
+DTYPES = ["float16", "int8"]
+
+
+def make_quantized(full, dtype):
+    codes, scales = quantize(full, dtype)
+    return QuantizedEmbeddings(full, codes, scales, dtype)
+
+
+def make_queries(full, n=20, seed=0):
+    """Запросы рядом с тайтлами каталога: близкие соседи, как у реального профиля"""
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(full[rng.choice(len(full), size=n, replace=False)], dtype=np.float32)
+    queries = rows + 0.5 * rng.standard_normal(rows.shape).astype(np.float32) / np.sqrt(DIM)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_quantized_scan(measure, size, dtype):
+    _, embeddings, _ = okko_catalog(size)
+    quantized = make_quantized(embeddings, dtype)
+    query = make_queries(embeddings, n=1)[0]
+
+    scores = measure(quantized.scores, query, rounds=rounds_for(size))
+
+    assert scores.shape == (size,)
+    assert quantized.nbytes <= embeddings.nbytes // (2 if dtype == "float16" else 3)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_recall_after_rerank(dtype):
+    _, embeddings, _ = okko_catalog(min(SIZES))
+    quantized = make_quantized(embeddings, dtype)
+    queries = make_queries(embeddings)
+
+    assert recall_at_k(embeddings, quantized, queries, k=10) >= 0.99
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_filter_and_rank_matches_float32(encoder, dtype):
+    df, embeddings, records_metadata = okko_catalog(min(SIZES))
+    theta = okko_theta()
+
+    expected = okko.filter_and_rank(df, embeddings, records_metadata, theta, "st", encoder, 6)
+    result = okko.filter_and_rank(df, make_quantized(embeddings, dtype), records_metadata, theta, "st", encoder, 6)
+
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_allclose(result["score"], expected["score"], atol=1e-5)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_group_rank_matches_float32(encoder, dtype):
+    df, embeddings, records_metadata = okko_catalog(min(SIZES))
+    rng = np.random.default_rng(7)
+    thetas = [{ax: float(rng.choice([-0.5, 0.0, 0.5])) for ax in okko.AXES} for _ in range(5)]
+
+    _, expected = okko.filter_and_rank_batch(df, embeddings, records_metadata, thetas, "st", encoder, 6)
+    _, scores = okko.filter_and_rank_batch(
+        df, make_quantized(embeddings, dtype), records_metadata, thetas, "st", encoder, 6
+    )
+
+    # Групповые оценки сравнивают только точно пересчитанные записи
+    for strategy in okko.GROUP_STRATEGIES:
+        fused = okko.fuse_group_scores(scores, strategy)
+        top = okko.top_indices(fused, 6)
+        reference = okko.fuse_group_scores(expected, strategy)
+        assert list(top) == list(okko.top_indices(reference, 6))
+        np.testing.assert_allclose(fused[top], reference[top], atol=1e-5)
@@ -0,0 +1,191 @@
+"""
+Микробенчмарки ядер ранжирования на каталогах 1k-1M тайтлов
+
+Запуск:
+    python -m pytest benchmarks --benchmark-autosave
+    BENCH_SIZES=1000,10000 python -m pytest benchmarks -k okko
+
+Сравнение с прошлыми коммитами:
+    pytest-benchmark --storage file://benchmarks/results/micro compare --group-by=name
+"""
+
+import numpy as np
+import pytest
+
+from conftest import SIZES, okko_catalog, imdb_catalog, rounds_for
+from synthetic_catalog import okko_theta, imdb_theta
+
+import back.okkonator_okko as okko
+import back.okkonator as imdb
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_cosine_sim(measure, encoder, size):
+    _, embeddings, _ = okko_catalog(size)
+    query = encoder.encode(["комедия для всей семьи"])[0]
+
+    sims = measure(okko.cosine_sim, query, embeddings, rounds=rounds_for(size))
+
+    assert sims.shape == (size,)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_okko_filter_and_rank(measure, encoder, size):
+    df, embeddings, records_metadata = okko_catalog(size)
+    flags = okko.record_flags(records_metadata, len(df))
+
+    result = measure(
+        okko.filter_and_rank, df, embeddings, records_metadata, okko_theta(), "st", encoder, 6, flags,
+        rounds=rounds_for(size)
+    )
+
+    assert len(result) == 6
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_imdb_filter_and_rank(measure, encoder, size):
+    df, embeddings = imdb_catalog(size)
+    features = imdb.score_features(df)
+
+    result = measure(
+        imdb.filter_and_rank, df, embeddings, imdb_theta(), "st", encoder, 6, features,
+        rounds=rounds_for(size)
+    )
+
+    assert len(result) == 6
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("history", ["cold", "warm"])
+def test_get_next_movies_batch(measure, monkeypatch, size, history):
+    import swipe_service
+
+    df, embeddings = imdb_catalog(size)
+    monkeypatch.setattr(swipe_service, "df", df)
+    monkeypatch.setattr(swipe_service, "ITEM_EMB", embeddings)
+    monkeypatch.setattr(swipe_service, "user_sessions", {})
+
+    session_id = swipe_service.create_user_session()
+    if history == "warm":
+        # Сессия с лайками: ветка ранжирования по вектору пользователя
+        session = swipe_service.user_sessions[session_id]
+        session["swipe_history"].append({"movie_id": 0, "action": "like"})
+        session["user_vector"] = embeddings[:10].mean(axis=0)
+
+    batch = measure(swipe_service.get_next_movies_batch, session_id, 20, rounds=rounds_for(size))
+
+    assert len(batch) == 20
+
+
+@pytest.mark.parametrize("module", [okko, imdb], ids=["okko", "imdb"])
+def test_profile_keywords(measure, module):
+    theta = okko_theta() if module is okko else imdb_theta()
+
+    text = measure(module.profile_keywords, theta, rounds=1000)
+
+    assert isinstance(text, str) and text
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_pick_next_question(measure, size):
+    _, _, records_metadata = okko_catalog(size)
+    item_features = okko.build_item_features(records_metadata)
+    asked = ["q1", "q7", "q16"]
+
+    question = measure(okko.pick_next_question, okko_theta(), asked, item_features, rounds=rounds_for(size))
+
+    assert question is None or question["id"] not in asked
+
+
+def test_item_features_match_bonus_flags():
+    _, _, records_metadata = okko_catalog(min(SIZES))
+    records_metadata = records_metadata + [
+        {"country": "СССР", "content_type": "Фильм", "age_rating": 0, "genres": ["Детектив"]},
+    ]
+    features = okko.build_item_features(records_metadata)
+    flags = okko.record_flags(records_metadata)
+    combos, inverse = flags["combos"], flags["inverse"]
+    col = okko.AXIS_INDEX
+
+    # Анкета и бонусы filter_and_rank одинаково понимают тип, страну и возраст
+    np.testing.assert_array_equal(features[:, col["prefer_movies"]] > 0, combos["film"][inverse])
+    np.testing.assert_array_equal(features[:, col["prefer_series"]] > 0, combos["series"][inverse])
+    np.testing.assert_array_equal(features[:, col["prefer_russian"]] > 0, combos["russian"][inverse])
+    np.testing.assert_array_equal(
+        features[:, col["family_friendly"]] > 0, combos["age_bucket"][inverse] == okko.AGE_FAMILY
+    )
+    soviet = features[-1]
+    assert soviet[col["prefer_russian"]] == 0 and soviet[col["family_friendly"]] == 0
+    assert soviet[col["genre_crime"]] == 1 and soviet[col["genre_mystery"]] == 1
+
+
+def test_early_stop_keeps_ranking(encoder):
+    df, embeddings, records_metadata = okko_catalog(min(SIZES))
+    item_features = okko.build_item_features(records_metadata)
+    # Насыщенный профиль: ни один ответ не переводит оси через порог 0.2
+    theta = {ax: (1.0 if i % 2 else -1.0) for i, ax in enumerate(okko.AXES)}
+    asked = [question["id"] for question in okko.QUESTIONS[:okko.QUESTIONS_MIN]]
+
+    assert okko.pick_next_question(theta, asked, item_features) is None
+
+    expected = okko.filter_and_rank(df, embeddings, records_metadata, theta, "st", encoder, 6)
+    for question in okko.QUESTIONS[okko.QUESTIONS_MIN:]:
+        for answer in (-2, -1, 1, 2):
+            outcome = dict(theta)
+            okko.update_theta(outcome, answer, question["targets"])
+            result = okko.filter_and_rank(df, embeddings, records_metadata, outcome, "st", encoder, 6)
+            assert list(result.index) == list(expected.index)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_ranking_cache_hit(measure, encoder, size):
+    from ranking_cache import RankingCache
+
+    df, embeddings, records_metadata = okko_catalog(size)
+    theta = okko_theta()
+    cache = RankingCache()
+    cache.reset(df, "bench")
+
+    def compute(n):
+        return okko.filter_and_rank(df, embeddings, records_metadata, theta, "st", encoder, n)
+
+    expected = cache.rank(theta, 6, compute)
+    result = measure(cache.rank, theta, 6, compute, rounds=1000)
+
+    assert list(result.index) == list(expected.index)
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("members", [1, 10])
+def test_okko_group_rank(measure, encoder, size, members):
+    df, embeddings, records_metadata = okko_catalog(size)
+    flags = okko.record_flags(records_metadata, len(df))
+    rng = np.random.default_rng(members)
+    thetas = [{ax: float(rng.choice([-0.5, 0.0, 0.5])) for ax in okko.AXES} for _ in range(members)]
+
+    ranked, scores = measure(
+        okko.filter_and_rank_batch, df, embeddings, records_metadata, thetas, "st", encoder, 6, flags,
+        rounds=rounds_for(size)
+    )
+
+    assert scores.shape == (size, members)
+    expected = okko.filter_and_rank(df, embeddings, records_metadata, thetas[0], "st", encoder, 6)
+    assert list(ranked[0].index) == list(expected.index)
+
+
+def test_swipe_batches_skip_seen(monkeypatch):
+    import swipe_service
+
+    df, embeddings = imdb_catalog(min(SIZES))
+    monkeypatch.setattr(swipe_service, "df", df)
+    monkeypatch.setattr(swipe_service, "ITEM_EMB", embeddings)
+    monkeypatch.setattr(swipe_service, "user_sessions", {})
+
+    session_id = swipe_service.create_user_session()
+    seen = set()
+    for _ in range(5):
+        batch = swipe_service.get_next_movies_batch(session_id, 20)
+        ids = {movie["id"] for movie in batch}
+        assert len(ids) == 20 and not ids & seen
+        seen |= ids
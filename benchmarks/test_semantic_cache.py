@@ -0,0 +1,51 @@
+"""
+Семантический кэш: запросы, отличающиеся отрицанием или числом, не совпадают
+
+Сходство эмбеддингов здесь не проверяется (HashingEncoder и порог -1 -
+любая пара "похожа"), проверяются только ограничения поверх него.
+"""
+
+import pytest
+
+from synthetic_catalog import HashingEncoder
+from semantic_cache import SemanticCache
+
+MODEL = "test/model"
+ANSWER = {"status": "found", "recommended_movie_ids": [1, 2, 3]}
+
+
+def make_cache(threshold=-1.0):
+    cache = SemanticCache(threshold=threshold, catalog_version="test")
+    cache.model_kind, cache.model, cache.ready = "st", HashingEncoder(), True
+    return cache
+
+
+@pytest.mark.parametrize("stored, query", [
+    ("хочу комедию", "не хочу комедию"),
+    ("посоветуй хорошую комедию на вечер", "посоветуй на вечер что-нибудь без комедии"),
+    ("подбери фантастику 80-х для вечера с друзьями", "подбери фантастику 90-х для вечера с друзьями"),
+    ("фильм про войну 1941 года для семьи", "фильм про войну 1812 года для семьи"),
+])
+def test_negation_and_numbers_do_not_match(stored, query):
+    cache = make_cache()
+    cache.store(stored, MODEL, ANSWER)
+
+    assert cache.lookup(query, MODEL) is None
+    assert cache.lookup(stored, MODEL)["similarity"] == 1.0
+
+
+def test_short_messages_match_only_exactly():
+    cache = make_cache()
+    cache.store("хочу комедию", MODEL, ANSWER)
+
+    assert cache.lookup("посоветуй комедию", MODEL) is None
+    assert cache.lookup("  Хочу   комедию ", MODEL) is not None
+
+
+def test_paraphrase_with_same_guards_matches():
+    cache = make_cache()
+    cache.store("посоветуй смешную комедию для вечера с семьей", MODEL, ANSWER)
+
+    hit = cache.lookup("подбери веселую комедию для семейного вечера", MODEL)
+
+    assert hit is not None and hit["data"] == ANSWER
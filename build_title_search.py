@@ -0,0 +1,140 @@
+"""
+Сборка денормализованной витрины title_search для DB tools
+
+Материализованное представление хранит по одной строке на тайтл с массивами
+жанров, актеров и режиссеров, поэтому типичный запрос подбора выполняется
+одним индексированным поиском без JOIN по связующим таблицам.
+
+Использование:
+    python build_title_search.py            # создать (пересоздать) витрину
+    python build_title_search.py --refresh  # обновить данные после загрузки каталога
+"""
+
+import sys
+import time
+import logging
+
+from sqlalchemy import text
+
+from database_tool import DatabaseTool
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VIEW_NAME = "title_search"
+
+CREATE_VIEW_SQL = f"""
+CREATE MATERIALIZED VIEW {VIEW_NAME} AS
+WITH genres AS (
+    SELECT tg.title_id, array_agg(DISTINCT g.name) AS genres
+    FROM title_genre tg
+    JOIN genre g ON g.genre_id = tg.genre_id
+    GROUP BY tg.title_id
+),
+actors AS (
+    SELECT ta.title_id, array_agg(DISTINCT a.name) AS actors
+    FROM title_actor ta
+    JOIN actor a ON a.actor_id = ta.actor_id
+    GROUP BY ta.title_id
+),
+directors AS (
+    SELECT td.title_id, array_agg(DISTINCT d.name) AS directors
+    FROM title_director_item td
+    JOIN director_item d ON d.director_item_id = td.director_item_id
+    GROUP BY td.title_id
+)
+SELECT
+    t.title_id,
+    t.serial_name,
+    t.content_type,
+    t.age_rating,
+    t.release_date,
+    substring(t.release_date::text FROM '\\d{{4}}')::int AS release_year,
+    t.description,
+    COALESCE(g.genres, '{{}}') AS genres,
+    COALESCE(a.actors, '{{}}') AS actors,
+    COALESCE(d.directors, '{{}}') AS directors,
+    lower(COALESCE(array_to_string(g.genres, ', '), '')) AS genres_text,
+    lower(COALESCE(array_to_string(a.actors, ', '), '')) AS actors_text,
+    lower(COALESCE(array_to_string(d.directors, ', '), '')) AS directors_text
+FROM title t
+LEFT JOIN genres g ON g.title_id = t.title_id
+LEFT JOIN actors a ON a.title_id = t.title_id
+LEFT JOIN directors d ON d.title_id = t.title_id
+"""
+
+# Уникальный индекс обязателен для REFRESH ... CONCURRENTLY
+BASE_INDEXES_SQL = [
+    f"CREATE UNIQUE INDEX {VIEW_NAME}_title_id_idx ON {VIEW_NAME} (title_id)",
+    f"CREATE INDEX {VIEW_NAME}_type_year_idx ON {VIEW_NAME} (content_type, release_year)",
+    f"CREATE INDEX {VIEW_NAME}_genres_gin_idx ON {VIEW_NAME} USING gin (genres)",
+    f"CREATE INDEX {VIEW_NAME}_actors_gin_idx ON {VIEW_NAME} USING gin (actors)",
+    f"CREATE INDEX {VIEW_NAME}_directors_gin_idx ON {VIEW_NAME} USING gin (directors)",
+]
+
+# Триграммные индексы для ILIKE '%...%' по названию и текстовым спискам
+TRGM_INDEXES_SQL = [
+    f"CREATE INDEX {VIEW_NAME}_name_trgm_idx ON {VIEW_NAME} USING gin (lower(serial_name) gin_trgm_ops)",
+    f"CREATE INDEX {VIEW_NAME}_genres_trgm_idx ON {VIEW_NAME} USING gin (genres_text gin_trgm_ops)",
+    f"CREATE INDEX {VIEW_NAME}_actors_trgm_idx ON {VIEW_NAME} USING gin (actors_text gin_trgm_ops)",
+    f"CREATE INDEX {VIEW_NAME}_directors_trgm_idx ON {VIEW_NAME} USING gin (directors_text gin_trgm_ops)",
+]
+
+
+def enable_trigram(engine) -> bool:
+    """Подключение расширения pg_trgm (нужны права на CREATE EXTENSION)"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        return True
+    except Exception as e:
+        logger.warning(f"pg_trgm недоступен, триграммные индексы не будут созданы: {e}")
+        return False
+
+
+def build_view(engine):
+    """Создание витрины и индексов с нуля"""
+    has_trgm = enable_trigram(engine)
+
+    start = time.time()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {VIEW_NAME}"))
+        conn.execute(text(CREATE_VIEW_SQL))
+
+        for sql in BASE_INDEXES_SQL + (TRGM_INDEXES_SQL if has_trgm else []):
+            conn.execute(text(sql))
+
+        conn.execute(text(f"ANALYZE {VIEW_NAME}"))
+        rows = conn.execute(text(f"SELECT count(*) FROM {VIEW_NAME}")).scalar()
+
+    logger.info(f"Витрина {VIEW_NAME} создана: {rows} записей за {time.time() - start:.1f} сек")
+
+
+def refresh_view(engine):
+    """Обновление данных витрины без блокировки чтения"""
+    start = time.time()
+    with engine.begin() as conn:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {VIEW_NAME}"))
+        conn.execute(text(f"ANALYZE {VIEW_NAME}"))
+
+    logger.info(f"Витрина {VIEW_NAME} обновлена за {time.time() - start:.1f} сек")
+
+
+def main():
+    """Основная функция"""
+    # DDL запрещен в execute_sql_query, поэтому работаем с engine напрямую
+    db_tool = DatabaseTool()
+
+    try:
+        if "--refresh" in sys.argv[1:]:
+            refresh_view(db_tool.engine)
+        else:
+            build_view(db_tool.engine)
+    except Exception as e:
+        logger.error(f"Ошибка сборки витрины {VIEW_NAME}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
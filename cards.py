@@ -0,0 +1,134 @@
+"""
+Карточки фильмов для ответов сервисов и быстрая сериализация JSON
+
+Статические поля карточек (название, год, жанры, отформатированные
+голоса, обрезанное описание...) рендерятся один раз при загрузке каталога
+столбцовыми операциями. Ответ на k фильмов - k обращений к списку и
+поверхностные копии, к которым добавляются поля запроса (score, reason).
+
+fast_jsonify сериализует через orjson (если установлен), иначе через json.
+"""
+
+import json
+import logging
+from typing import Callable, Dict, List, Any, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POSTER_PLACEHOLDER = "https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=400&h=600&fit=crop"
+
+
+def _json_default(value):
+    """Типы numpy для json.dumps"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload: Any) -> bytes:
+    """JSON ответа: orjson или стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+def fast_jsonify(payload: Any, status: int = 200) -> Response:
+    """Замена jsonify для горячих маршрутов"""
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+
+class CardCache:
+    """Предрассчитанные статические поля карточек по строкам каталога"""
+
+    def __init__(self, df: pd.DataFrame, builder: Callable[[pd.DataFrame], List[Dict[str, Any]]]):
+        self.df = df
+        self.cards = builder(df)
+        logger.info(f"Карточки каталога подготовлены: {len(self.cards)}")
+
+    def get(self, positions: Iterable[int], **fields: Optional[Iterable[Any]]) -> List[Dict[str, Any]]:
+        """
+        Карточки для строк каталога
+
+        Args:
+            positions: Номера строк каталога
+            **fields: Поля запроса по карточкам, например score=[...]
+        """
+        result = [dict(self.cards[position]) for position in positions]
+        for name, values in fields.items():
+            for card, value in zip(result, values):
+                card[name] = value
+        return result
+
+
+def _is_missing(value) -> bool:
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return len(value) == 0
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _text_column(df: pd.DataFrame, column: str, default: str = "") -> List[str]:
+    if column not in df.columns:
+        return [default] * len(df)
+    return [default if _is_missing(value) else str(value) for value in df[column].tolist()]
+
+
+def _number_column(df: pd.DataFrame, column: str, dtype) -> List[Any]:
+    return df[column].fillna(0).to_numpy().astype(dtype).tolist()
+
+
+def build_imdb_cards(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Карточки каталога IMDB (свайпы)"""
+    ids = (df.index if "id" not in df.columns else df["id"]).to_numpy().astype(np.int64).tolist()
+    if "votes" in df.columns:
+        votes = [f"{v:,}" for v in _number_column(df, "votes", np.int64)]
+    else:
+        votes = ["N/A"] * len(df)
+
+    columns = {
+        "id": ids,
+        "title": _text_column(df, "title"),
+        "year": _number_column(df, "year", np.int64),
+        "genre": _text_column(df, "genre"),
+        "rating": _number_column(df, "rating", np.float64),
+        "duration": _number_column(df, "duration", np.int64),
+        "votes": votes,
+        "description": _text_column(df, "description"),
+    }
+    keys = list(columns) + ["poster"]
+    return [dict(zip(keys, values + (POSTER_PLACEHOLDER,))) for values in zip(*columns.values())]
+
+
+def build_okko_cards(df: pd.DataFrame, records_metadata: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Карточки каталога Okko (Окконатор)"""
+    titles = _text_column(df, "serial_name", "Неизвестно")
+    descriptions = _text_column(df, "description")
+
+    cards = []
+    for position, (title, description) in enumerate(zip(titles, descriptions)):
+        record_meta = records_metadata[position] if position < len(records_metadata) else {}
+        age_rating = record_meta.get("age_rating")
+        cards.append({
+            "id": record_meta.get("id", position),
+            "title": title,
+            "content_type": record_meta.get("content_type", ""),
+            "genres": ", ".join(record_meta.get("genres", [])),
+            "country": record_meta.get("country", ""),
+            "age_rating": f"{age_rating}+" if age_rating else "N/A",
+            "description": description[:200] + "..." if len(description) > 200 else description,
+            "url": record_meta.get("url", ""),
+            "poster": POSTER_PLACEHOLDER,  # Заглушка
+        })
+    return cards
@@ -0,0 +1,37 @@
+"""
+Версия каталога Okko для инвалидации кэшей
+
+Семантический кэш (semantic_cache.py) и кэш ранжирования
+(ranking_cache.py) привязывают записи к этой версии: после пересборки
+векторной БД старые ответы и топы не используются.
+"""
+
+import os
+import json
+import logging
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def current_catalog_version(data_dir: str = "data") -> str:
+    """
+    Версия каталога для инвалидации кэша
+
+    Берется из CATALOG_VERSION, иначе из даты создания векторной БД Okko
+    """
+    version = os.getenv("CATALOG_VERSION")
+    if version:
+        return version
+
+    for name in ("okko_metadata.json", "okko_test_metadata.json"):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return str(json.load(f).get("created_at", "unknown"))
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать версию каталога из {path}: {e}")
+
+    return "unknown"
@@ -195,7 +195,7 @@ def get_all_celebrities():
     return CELEBRITIES
 
 def get_celebrity_system_prompt(celebrity_id):
-    """Получить системный промпт для знаменитости"""
+    """Получить системный промпт для знаменитости (детерминированный: без времени и случайных вставок)"""
     celebrity = get_celebrity_by_id(celebrity_id)
     if not celebrity:
         return None
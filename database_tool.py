@@ -6,6 +6,7 @@ Tool для выполнения SQL запросов к PostgreSQL базе д
 import os
 import json
 import logging
+import threading
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 from dotenv import load_dotenv
@@ -13,7 +14,10 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import sqlalchemy
 from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+
+from tracing import span
+from metrics import Counter, register_collector
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -22,6 +26,43 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Код ошибки PostgreSQL при срабатывании statement_timeout
+QUERY_CANCELED_PGCODE = "57014"
+
+# Сколько ждать свободный слот, прежде чем ответить "занято"
+QUERY_SLOT_WAIT_SECONDS = 1.0
+
+# Engine (с пулом соединений) и семафор на процесс для каждой строки подключения
+_engines: Dict[str, Any] = {}
+_query_slots: Dict[str, threading.BoundedSemaphore] = {}
+_engines_lock = threading.Lock()
+
+DB_QUERIES_REJECTED = Counter(
+    "okko_db_queries_rejected_total",
+    "Запросы к БД, отклоненные из-за отсутствия свободного слота"
+)
+
+
+def _pool_collector():
+    """Загрузка пулов соединений и слотов запросов для /metrics"""
+    with _engines_lock:
+        items = [(engine, _query_slots[key]) for key, engine in _engines.items()]
+    size, checked_out, slots_in_use = [], [], []
+    for engine, slots in items:
+        labels = {"database": f"{engine.url.host}:{engine.url.port}/{engine.url.database}"}
+        size.append((labels, engine.pool.size()))
+        checked_out.append((labels, engine.pool.checkedout()))
+        # У BoundedSemaphore нет публичного счетчика, берем разницу начального и текущего значения
+        slots_in_use.append((labels, slots._initial_value - slots._value))
+    return [
+        ("okko_db_pool_size", "gauge", "Размер пула соединений", size),
+        ("okko_db_pool_checked_out", "gauge", "Соединения, выданные из пула", checked_out),
+        ("okko_db_query_slots_in_use", "gauge", "Занятые слоты конкурентных запросов", slots_in_use),
+    ]
+
+
+register_collector(_pool_collector)
+
 
 @dataclass
 class DatabaseConfig:
@@ -32,6 +73,9 @@ class DatabaseConfig:
     username: str
     password: str
     schema: Optional[str] = None
+    statement_timeout_ms: int = 5000
+    max_query_cost: float = 1000000.0
+    max_concurrent_queries: int = 4
 
 
 class DatabaseTool:
@@ -65,84 +109,146 @@ class DatabaseTool:
             database=os.getenv("DB_NAME"),
             username=os.getenv("DB_USER"),
             password=os.getenv("DB_PASSWORD"),
-            schema=os.getenv("DB_SCHEMA")
+            schema=os.getenv("DB_SCHEMA"),
+            statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000")),
+            max_query_cost=float(os.getenv("DB_MAX_QUERY_COST", "1000000")),
+            max_concurrent_queries=int(os.getenv("DB_MAX_CONCURRENT_QUERIES", "4"))
         )
     
     def _connect(self):
-        """Установка соединения с базой данных"""
+        """Установка соединения с базой данных (engine переиспользуется между вызовами)"""
         try:
             connection_string = (
                 f"postgresql://{self.config.username}:{self.config.password}"
                 f"@{self.config.host}:{self.config.port}/{self.config.database}"
             )
             
-            self.engine = create_engine(connection_string, echo=False)
-            
-            # Тестируем соединение
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            with _engines_lock:
+                engine = _engines.get(connection_string)
+                if engine is None:
+                    engine = create_engine(
+                        connection_string,
+                        echo=False,
+                        pool_size=self.config.max_concurrent_queries,
+                        max_overflow=0,
+                        pool_pre_ping=True
+                    )
+                    
+                    # Тестируем соединение
+                    with engine.connect() as conn:
+                        conn.execute(text("SELECT 1"))
+                    
+                    _engines[connection_string] = engine
+                    _query_slots[connection_string] = threading.BoundedSemaphore(
+                        self.config.max_concurrent_queries
+                    )
+                    logger.info("Успешное подключение к PostgreSQL")
             
-            logger.info("Успешное подключение к PostgreSQL")
+            self.engine = engine
+            self.query_slots = _query_slots[connection_string]
             
         except Exception as e:
             logger.error(f"Ошибка подключения к БД: {str(e)}")
             raise
     
-    def execute_sql_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def execute_sql_query(
+        self,
+        query: str,
+        params: Optional[Dict[str, Any]] = None,
+        read_only: bool = True
+    ) -> Dict[str, Any]:
         """
         Выполнение SQL запроса
         
+        Запрос выполняется в отдельной транзакции с statement_timeout, перед
+        выполнением оценивается через EXPLAIN, число одновременных запросов
+        ограничено на процесс.
+        
         Args:
             query: SQL запрос
             params: Параметры для запроса (опционально)
+            read_only: Выполнять в read-only транзакции (только SELECT/WITH)
             
         Returns:
             Результат выполнения запроса
         """
+        if not self.query_slots.acquire(timeout=QUERY_SLOT_WAIT_SECONDS):
+            DB_QUERIES_REJECTED.inc()
+            logger.warning("Все слоты для запросов к БД заняты")
+            return {
+                "success": False,
+                "error": "База данных занята другими запросами, попробуйте позже",
+                "error_type": "BUSY"
+            }
+        
         try:
             logger.info(f"Выполнение SQL запроса: {query[:100]}...")
             
             # Проверка на опасные операции
-            self._validate_query(query)
+            self._validate_query(query, read_only)
             
             with self.engine.connect() as conn:
-                if params:
-                    result = conn.execute(text(query), params)
-                else:
-                    result = conn.execute(text(query))
-                
-                # Если это SELECT запрос, возвращаем данные
-                if query.strip().upper().startswith('SELECT'):
-                    rows = result.fetchall()
-                    columns = result.keys()
+                with conn.begin():
+                    if read_only:
+                        conn.execute(text("SET TRANSACTION READ ONLY"))
+                    conn.execute(text(f"SET LOCAL statement_timeout = {int(self.config.statement_timeout_ms)}"))
                     
-                    # Преобразуем в список словарей
-                    data = []
-                    for row in rows:
-                        row_dict = {}
-                        for i, column in enumerate(columns):
-                            value = row[i]
-                            # Преобразуем datetime и другие типы в строки
-                            if hasattr(value, 'isoformat'):
-                                value = value.isoformat()
-                            row_dict[column] = value
-                        data.append(row_dict)
+                    with span("db.explain"):
+                        cost_error = self._check_query_cost(conn, query, params)
+                    if cost_error:
+                        return cost_error
                     
-                    return {
-                        "success": True,
-                        "data": data,
-                        "row_count": len(data),
-                        "columns": list(columns)
-                    }
-                else:
-                    # Для INSERT, UPDATE, DELETE возвращаем количество затронутых строк
-                    conn.commit()
-                    return {
-                        "success": True,
-                        "message": "Запрос выполнен успешно",
-                        "row_count": result.rowcount
-                    }
+                    with span("db.query", statement=query[:200]):
+                        result = conn.execute(text(query), params or {})
                     
+                    # Если запрос возвращает строки (SELECT, WITH), возвращаем данные
+                    if result.returns_rows:
+                        rows = result.fetchall()
+                        columns = result.keys()
+                        
+                        # Преобразуем в список словарей
+                        data = []
+                        for row in rows:
+                            row_dict = {}
+                            for i, column in enumerate(columns):
+                                value = row[i]
+                                # Преобразуем datetime и другие типы в строки
+                                if hasattr(value, 'isoformat'):
+                                    value = value.isoformat()
+                                row_dict[column] = value
+                            data.append(row_dict)
+                        
+                        return {
+                            "success": True,
+                            "data": data,
+                            "row_count": len(data),
+                            "columns": list(columns)
+                        }
+                    else:
+                        # Для INSERT, UPDATE, DELETE возвращаем количество затронутых строк
+                        return {
+                            "success": True,
+                            "message": "Запрос выполнен успешно",
+                            "row_count": result.rowcount
+                        }
+                    
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) == QUERY_CANCELED_PGCODE:
+                logger.warning(f"Запрос прерван по таймауту {self.config.statement_timeout_ms} мс")
+                return {
+                    "success": False,
+                    "error": (
+                        f"Запрос выполнялся дольше {self.config.statement_timeout_ms} мс и был прерван. "
+                        "Добавьте фильтры и LIMIT или используйте title_search"
+                    ),
+                    "error_type": "TIMEOUT"
+                }
+            logger.error(f"Ошибка SQL: {str(e)}")
+            return {
+                "success": False,
+                "error": f"Ошибка SQL: {str(e)}",
+                "error_type": "SQL_ERROR"
+            }
         except SQLAlchemyError as e:
             logger.error(f"Ошибка SQL: {str(e)}")
             return {
@@ -157,13 +263,44 @@ class DatabaseTool:
                 "error": f"Общая ошибка: {str(e)}",
                 "error_type": "GENERAL_ERROR"
             }
+        finally:
+            self.query_slots.release()
     
-    def _validate_query(self, query: str):
+    def _check_query_cost(self, conn, query: str, params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Оценка стоимости запроса планировщиком до выполнения
+        
+        Returns:
+            Ответ с ошибкой, если стоимость выше порога, иначе None
+        """
+        if self.config.max_query_cost <= 0:
+            return None
+        
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params or {}).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        total_cost = plan[0]["Plan"]["Total Cost"]
+        
+        if total_cost > self.config.max_query_cost:
+            logger.warning(f"Запрос отклонен: стоимость {total_cost:.0f} > {self.config.max_query_cost:.0f}")
+            return {
+                "success": False,
+                "error": (
+                    f"Запрос слишком тяжелый (оценка стоимости {total_cost:.0f}, "
+                    f"лимит {self.config.max_query_cost:.0f}). "
+                    "Добавьте фильтры и LIMIT, избегайте декартовых произведений или используйте title_search"
+                ),
+                "error_type": "QUERY_TOO_EXPENSIVE"
+            }
+        return None
+    
+    def _validate_query(self, query: str, read_only: bool = True):
         """
         Валидация SQL запроса на предмет опасных операций
         
         Args:
             query: SQL запрос для проверки
+            read_only: Разрешать только чтение
             
         Raises:
             ValueError: Если запрос содержит опасные операции
@@ -171,11 +308,18 @@ class DatabaseTool:
         query_upper = query.upper().strip()
         
         # Разрешенные операции
-        allowed_operations = ['SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE']
+        if read_only:
+            allowed_operations = ['SELECT', 'WITH']
+        else:
+            allowed_operations = ['SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE']
         
         # Проверяем, что запрос начинается с разрешенной операции
         if not any(query_upper.startswith(op) for op in allowed_operations):
-            raise ValueError("Разрешены только SELECT, INSERT, UPDATE, DELETE операции")
+            raise ValueError(f"Разрешены только {', '.join(allowed_operations)} операции")
+        
+        # Несколько выражений в одном вызове обходят read-only транзакцию и EXPLAIN
+        if ';' in query.strip().rstrip(';'):
+            raise ValueError("Разрешено только одно SQL выражение")
         
         # Запрещенные операции
         dangerous_operations = [
@@ -211,6 +355,21 @@ class DatabaseTool:
             
             result = self.execute_sql_query(query, {"table_name": table_name})
             
+            # Колонки материализованных представлений есть только в pg_catalog
+            if result["success"] and not result["data"]:
+                result = self.execute_sql_query("""
+                SELECT
+                    a.attname AS column_name,
+                    format_type(a.atttypid, a.atttypmod) AS data_type,
+                    CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END AS is_nullable,
+                    NULL AS column_default
+                FROM pg_attribute a
+                JOIN pg_class c ON c.oid = a.attrelid
+                WHERE c.relname = :table_name AND c.relkind = 'm'
+                  AND a.attnum > 0 AND NOT a.attisdropped
+                ORDER BY a.attnum
+                """, {"table_name": table_name})
+            
             if result["success"]:
                 return {
                     "success": True,
@@ -235,10 +394,15 @@ class DatabaseTool:
             Список таблиц
         """
         try:
+            # information_schema не содержит материализованные представления (title_search)
             query = """
             SELECT table_name, table_type
             FROM information_schema.tables 
             WHERE table_schema = 'public'
+            UNION ALL
+            SELECT matviewname AS table_name, 'MATERIALIZED VIEW' AS table_type
+            FROM pg_matviews
+            WHERE schemaname = 'public'
             ORDER BY table_name
             """
             
@@ -326,13 +490,13 @@ DATABASE_TOOLS = [
         "type": "function",
         "function": {
             "name": "execute_database_query",
-            "description": "Выполнение SQL запроса к PostgreSQL базе данных. Поддерживает SELECT, INSERT, UPDATE, DELETE операции.",
+            "description": "Выполнение SQL запроса к PostgreSQL базе данных в режиме только чтения (SELECT, WITH). Запрос ограничен по времени, слишком тяжелые запросы отклоняются - используй фильтры и LIMIT.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "query": {
                         "type": "string",
-                        "description": "SQL запрос для выполнения. Поддерживаются SELECT, INSERT, UPDATE, DELETE операции."
+                        "description": "SQL запрос для выполнения. Поддерживаются только SELECT и WITH."
                     },
                     "params": {
                         "type": "object",
@@ -0,0 +1,265 @@
+"""
+Метрики сервисов в текстовом формате Prometheus
+
+- init_metrics(app, service) добавляет /metrics и считает латентность
+  запросов по маршрутам и число запросов в обработке
+- Counter/Gauge/Histogram для метрик, которые обновляются по событию
+  (например, латентность и ошибки OpenRouter)
+- register_collector(fn) для значений, которые дешевле снять в момент
+  опроса (размер хранилища сессий, пул БД, статистика кэшей)
+
+Без зависимости от prometheus_client: формат экспозиции простой, а
+сервисам нужен только небольшой набор типов метрик.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Границы бакетов латентности, секунды (от быстрых ручек до LLM вызовов)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Метрика, снятая коллектором: (имя, тип, описание, [(метки, значение)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_metrics: Dict[str, "_Metric"] = {}
+_collectors: List[Callable[[], List[Sample]]] = []
+_registry_lock = threading.Lock()
+_service_name = "unknown"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Базовая метрика с метками"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+        with _registry_lock:
+            if name in _metrics:
+                raise ValueError(f"Метрика {name} уже зарегистрирована")
+            _metrics[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение (может расти и уменьшаться)"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Гистограмма с кумулятивными бакетами"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state) -> List[str]:
+        labels = self._labels(key)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le='+Inf'))} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {state['count']}")
+        return lines
+
+
+def register_collector(collector: Callable[[], List[Sample]]):
+    """
+    Регистрация функции, снимающей метрики в момент опроса /metrics
+
+    Функция возвращает список (имя, тип, описание, [(метки, значение)]).
+    """
+    with _registry_lock:
+        _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    with _registry_lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    for collector in collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            logger.warning(f"Ошибка коллектора метрик {getattr(collector, '__name__', collector)}: {e}")
+            continue
+        for name, kind, description, values in samples:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Метрики HTTP запросов (общие для всех сервисов)
+HTTP_REQUEST_DURATION = Histogram(
+    "okko_http_request_duration_seconds",
+    "Латентность HTTP запросов по маршрутам",
+    ("service", "method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "okko_http_requests_in_flight",
+    "Запросы в обработке",
+    ("service",)
+)
+
+# Вызовы OpenRouter (обновляются из openrouter_client.post_chat_completion)
+OPENROUTER_REQUEST_DURATION = Histogram(
+    "okko_openrouter_request_duration_seconds",
+    "Латентность вызовов OpenRouter по моделям",
+    ("model",)
+)
+OPENROUTER_ERRORS = Counter(
+    "okko_openrouter_errors_total",
+    "Ошибки вызовов OpenRouter по моделям (reason - HTTP код или тип исключения)",
+    ("model", "reason")
+)
+
+
+def init_metrics(app, service_name: str, sessions: Optional[Callable[[], int]] = None):
+    """
+    Подключение метрик к Flask приложению
+
+    Args:
+        app: Flask приложение
+        service_name: Имя сервиса (метка service)
+        sessions: Функция, возвращающая размер хранилища сессий/диалогов
+    """
+    global _service_name
+    _service_name = service_name
+
+    from flask import Response, g, request
+
+    HTTP_REQUESTS_IN_FLIGHT.set(0, service=service_name)
+
+    @app.before_request
+    def _metrics_before_request():
+        g._metrics_start = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc(service=service_name)
+
+    @app.after_request
+    def _metrics_after_request(response):
+        start = g.get("_metrics_start")
+        if start is not None:
+            # Шаблон маршрута, а не путь: иначе id в URL раздувают число рядов
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                service=service_name, method=request.method, route=route, status=str(response.status_code)
+            )
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        if g.pop("_metrics_start", None) is not None:
+            HTTP_REQUESTS_IN_FLIGHT.dec(service=service_name)
+
+    if sessions is not None:
+        def _sessions_collector() -> List[Sample]:
+            return [(
+                "okko_sessions", "gauge", "Размер хранилища сессий",
+                [({"service": service_name}, sessions())]
+            )]
+        register_collector(_sessions_collector)
+
+    @app.route('/metrics')
+    def _metrics_endpoint():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -4,11 +4,17 @@
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import hmac
 import json
 import logging
 import os
 from dotenv import load_dotenv
 from movie_recommendation_tool import MovieRecommendationTool
+from openrouter_client import get_usage_stats
+from semantic_cache import create_semantic_cache_from_env
+from tracing import init_tracing
+from metrics import init_metrics, register_collector
+from profiling import init_profiling
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -19,6 +25,9 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+init_tracing(app, "movie_recommendation")
+init_metrics(app, "movie_recommendation", sessions=lambda: len(user_dialogs))
+init_profiling(app, "movie_recommendation")
 
 # Инициализация системы подбора фильмов
 try:
@@ -28,6 +37,12 @@ except Exception as e:
     logger.error(f"Ошибка инициализации системы подбора фильмов: {e}")
     movie_tool = None
 
+# Семантический кэш ответов (модель эмбеддингов загружается в фоне)
+semantic_cache = create_semantic_cache_from_env()
+if semantic_cache is not None:
+    semantic_cache.load_encoder_async()
+    register_collector(semantic_cache.collect_metrics)
+
 # Глобальное состояние диалогов пользователей
 user_dialogs = {}
 
@@ -65,8 +80,17 @@ def movie_chat():
         
         logger.info(f"Получен запрос от пользователя {user_id}: {message}")
         
-        # Выполняем подбор фильмов
-        result = movie_tool.recommend_movies(message, model=model)
+        # Перефразированный популярный запрос отдаем из кэша без LLM
+        cached = semantic_cache.lookup(message, model) if semantic_cache else None
+        
+        if cached:
+            result = {"success": True, "data": cached["data"], "iterations": 0}
+        else:
+            # Выполняем подбор фильмов
+            result = movie_tool.recommend_movies(message, model=model)
+            
+            if result["success"] and semantic_cache:
+                semantic_cache.store(message, model, result["data"])
         
         if result["success"]:
             data = result["data"]
@@ -90,9 +114,13 @@ def movie_chat():
                 "recommended_movie_ids": data.get('recommended_movie_ids', []),
                 "search_criteria": data.get('search_criteria', {}),
                 "confidence": data.get('confidence', 0.0),
-                "iterations": result.get('iterations', 0)
+                "iterations": result.get('iterations', 0),
+                "cached": cached is not None
             }
             
+            if cached:
+                response["cache_similarity"] = cached["similarity"]
+            
             logger.info(f"Успешный ответ для пользователя {user_id}: статус {data.get('status')}")
             return jsonify(response)
         else:
@@ -175,6 +203,48 @@ def get_available_models():
         }), 500
 
 
+@app.route('/api/movie-recommendation/usage', methods=['GET'])
+def get_usage():
+    """Статистика токенов по моделям, включая токены из кэша промпта"""
+    return jsonify({
+        "success": True,
+        "usage": get_usage_stats()
+    })
+
+
+@app.route('/api/movie-recommendation/cache', methods=['GET'])
+def get_cache_stats():
+    """Статистика семантического кэша"""
+    if not semantic_cache:
+        return jsonify({"success": True, "enabled": False})
+    
+    return jsonify({
+        "success": True,
+        "enabled": True,
+        "cache": semantic_cache.stats()
+    })
+
+
+@app.route('/api/movie-recommendation/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Сбросить семантический кэш (например, после обновления каталога), только с токеном"""
+    token = os.getenv("SEMANTIC_CACHE_ADMIN_TOKEN", "")
+    given = request.headers.get("X-Admin-Token", "")
+    if not token or not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+        return jsonify({"success": False, "error": "Требуется X-Admin-Token"}), 403
+    
+    if not semantic_cache:
+        return jsonify({"success": True, "enabled": False})
+    
+    data = request.get_json(silent=True) or {}
+    semantic_cache.invalidate(data.get('catalog_version'))
+    
+    return jsonify({
+        "success": True,
+        "catalog_version": semantic_cache.catalog_version
+    })
+
+
 @app.route('/api/movie-recommendation/database/query', methods=['POST'])
 def direct_database_query():
     """Прямой запрос к базе данных (для отладки)"""
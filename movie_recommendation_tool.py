@@ -17,6 +17,8 @@ from database_tool import (
     list_database_tables,
     DATABASE_TOOLS
 )
+from retrieval_tool import search_movie_candidates, RETRIEVAL_TOOLS
+from openrouter_client import apply_prompt_caching, record_usage, post_chat_completion
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -34,6 +36,7 @@ class OpenRouterConfig:
     site_url: Optional[str] = None
     site_name: Optional[str] = None
     timeout: int = 30
+    prompt_caching: bool = True
 
 
 class MovieRecommendationTool:
@@ -64,6 +67,7 @@ class MovieRecommendationTool:
         
         # Маппинг функций для tool calling
         self.tool_functions = {
+            "search_movie_candidates": search_movie_candidates,
             "execute_database_query": execute_database_query,
             "get_database_schema": get_database_schema,
             "list_database_tables": list_database_tables
@@ -79,9 +83,17 @@ class MovieRecommendationTool:
             api_key=api_key,
             site_url=os.getenv("OPENROUTER_SITE_URL"),
             site_name=os.getenv("OPENROUTER_SITE_NAME"),
-            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30"))
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30")),
+            prompt_caching=os.getenv("OPENROUTER_PROMPT_CACHING", "true").lower() == "true"
         )
     
+    def _prepare_messages(self, messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        """Пометка стабильного префикса (системный промпт, история) для кэша провайдера"""
+        if self.config.prompt_caching:
+            return apply_prompt_caching(messages, model)
+        return messages
+    
     def recommend_movies(
         self,
         user_request: str,
@@ -108,8 +120,8 @@ class MovieRecommendationTool:
 ИНСТРУКЦИИ:
 1. Проанализируй запрос от пользователя
 2. Определи, достаточно ли информации дано. Если нет, то задай уточняющие вопросы
-3. Определи какие tools надо использовать
-4. Используй выбранные tools и получи информацию от них
+3. Для подбора вызови search_movie_candidates с фильтрами из запроса (один вызов, максимум два)
+4. SQL tools используй, только если нужны данные, которых нет в search_movie_candidates
 5. Если ты готов подобрать фильмы для пользователя - верни их ids (в строгом формате)
 6. Так же напиши текстовое сообщение, которое увидит пользователь
 
@@ -120,11 +132,14 @@ class MovieRecommendationTool:
 ОБЯЗАТЕЛЬНО ОТВЕТНОЕ СООБЩЕНИЕ!
 
 ДОСТУПНЫЕ TOOLS:
-- execute_database_query: для поиска фильмов в базе данных
+- search_movie_candidates: ОСНОВНОЙ инструмент - поиск по смыслу с фильтрами (жанры, годы, тип, актеры), возвращает id для ответа
+- execute_database_query: для точечных SQL запросов к базе данных
 - get_database_schema: для получения структуры таблиц
 - list_database_tables: для получения списка таблиц
 
 СХЕМА БАЗЫ ДАННЫХ:
+- title_search: ИСПОЛЬЗУЙ ДЛЯ ПОИСКА - одна строка на фильм, без JOIN (title_id, serial_name, content_type, age_rating, release_date, release_year, description, genres, actors, directors - массивы; genres_text, actors_text, directors_text - списки в нижнем регистре)
+  Пример: SELECT title_id, serial_name, release_year FROM title_search WHERE genres_text LIKE '%комед%' AND content_type = 'Фильм' AND release_year >= 2010 LIMIT 10
 - title: основная таблица с фильмами (title_id, serial_name, content_type, age_rating, release_date, description)
 - genre: жанры фильмов
 - actor: актеры
@@ -215,7 +230,7 @@ class MovieRecommendationTool:
                 response = self._send_request_with_tools(
                     conversation_messages,
                     model,
-                    tools=DATABASE_TOOLS
+                    tools=RETRIEVAL_TOOLS + DATABASE_TOOLS
                 )
                 
                 # Проверяем, есть ли tool calls
@@ -298,21 +313,23 @@ class MovieRecommendationTool:
         
         data = {
             "model": model,
-            "messages": messages,
+            "messages": self._prepare_messages(messages, model),
             "tools": tools,
-            "temperature": temperature
+            "temperature": temperature,
+            "usage": {"include": True}
         }
         
         url = f"{self.config.base_url}/chat/completions"
-        response = requests.post(
+        response = post_chat_completion(
             url,
             headers=self.headers,
-            json=data,
+            payload=data,
             timeout=self.config.timeout
         )
         
         response.raise_for_status()
         response_data = response.json()
+        record_usage(model, response_data.get("usage"))
         
         choice = response_data["choices"][0]
         message = choice["message"]
@@ -352,8 +369,9 @@ class MovieRecommendationTool:
         
         data = {
             "model": model,
-            "messages": messages,
+            "messages": self._prepare_messages(messages, model),
             "temperature": temperature,
+            "usage": {"include": True},
             "response_format": {
                 "type": "json_schema",
                 "json_schema": {
@@ -367,15 +385,16 @@ class MovieRecommendationTool:
         url = f"{self.config.base_url}/chat/completions"
         
         try:
-            response = requests.post(
+            response = post_chat_completion(
                 url,
                 headers=self.headers,
-                json=data,
+                payload=data,
                 timeout=self.config.timeout
             )
             
             response.raise_for_status()
             response_data = response.json()
+            record_usage(model, response_data.get("usage"))
             
             # Парсим JSON ответ
             content = response_data["choices"][0]["message"]["content"]
@@ -445,20 +464,22 @@ class MovieRecommendationTool:
         
         data = {
             "model": model,
-            "messages": messages_with_instruction,
-            "temperature": temperature
+            "messages": self._prepare_messages(messages_with_instruction, model),
+            "temperature": temperature,
+            "usage": {"include": True}
         }
         
         url = f"{self.config.base_url}/chat/completions"
-        response = requests.post(
+        response = post_chat_completion(
             url,
             headers=self.headers,
-            json=data,
+            payload=data,
             timeout=self.config.timeout
         )
         
         response.raise_for_status()
         response_data = response.json()
+        record_usage(model, response_data.get("usage"))
         
         # Парсим JSON ответ
         content = response_data["choices"][0]["message"]["content"]
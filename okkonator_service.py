@@ -18,12 +18,30 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Импортируем логику из okkonator_okko.py
 from back.okkonator_okko import (
     load_okko_vector_db, load_model, embed_text, cosine_sim, profile_keywords,
-    filter_and_rank, init_theta, update_theta, pick_next_question,
-    QUESTIONS, LIKERT, AXES, QUESTIONS_MAX, explain_recommendation
+    filter_and_rank, init_theta, update_theta, pick_next_question, build_item_features,
+    filter_and_rank_batch, fuse_group_scores, top_indices, record_flags, GROUP_STRATEGIES,
+    QUESTIONS, QUESTION_INDEX, LIKERT, AXES, QUESTIONS_MAX, explain_recommendation
 )
+from tracing import init_tracing, span
+from metrics import init_metrics, register_collector
+from profiling import init_profiling
+from readiness import Readiness
+from cards import CardCache, build_okko_cards, fast_jsonify
+from ranking_cache import create_ranking_cache_from_env, ranking_catalog_version, PRECOMPUTED_FILE
 
 app = Flask(__name__)
 CORS(app)
+init_tracing(app, "okkonator")
+init_metrics(app, "okkonator")
+init_profiling(app, "okkonator")
+
+# Данные и модель загружаются в фоне, готовность - /ready
+readiness = Readiness("okkonator")
+readiness.init_app(app)
+
+# Топ-N ранжирования по сигнатуре профиля (см. ranking_cache.py)
+ranking_cache = create_ranking_cache_from_env()
+register_collector(ranking_cache.collect_metrics)
 
 # Глобальные переменные для кэширования
 df = None
@@ -32,10 +50,17 @@ model_kind = None
 model = None
 metadata = None
 records_metadata = None
+item_features = None  # признаки тайтлов по осям анкеты для выбора вопросов
+bonus_flags = None  # признаки записей для векторных бонусов ранжирования
+card_cache = None  # статические поля карточек по строкам каталога
+
+# Ограничения размера группы и подборки в одном запросе
+GROUP_MAX_MEMBERS = 20
+GROUP_MAX_TOP_K = 50
 
 def initialize_okkonator():
     """Инициализация Окконатора при запуске сервиса"""
-    global df, embeddings, model_kind, model, metadata, records_metadata
+    global df, embeddings, model_kind, model, metadata, records_metadata, item_features, bonus_flags
     
     print("Инициализация Окконатора для Okko...")
     
@@ -46,6 +71,10 @@ def initialize_okkonator():
         print("❌ Не удалось загрузить данные Okko. Убедитесь, что векторная БД создана.")
         return False
     
+    item_features = build_item_features(records_metadata)
+    bonus_flags = record_flags(records_metadata, len(df))
+    okko_cards()
+    
     # Загружаем модель
     model_kind, model = load_model()
     
@@ -53,6 +82,10 @@ def initialize_okkonator():
         print("❌ Не удалось загрузить модель для эмбеддингов.")
         return False
     
+    # Новый каталог или энкодер - записи кэша ранжирования больше не верны
+    ranking_cache.reset(df, ranking_catalog_version("data", model_kind))
+    ranking_cache.load_precomputed(os.path.join("data", PRECOMPUTED_FILE))
+    
     print(f"✅ Окконатор готов! Загружено {len(df)} фильмов/сериалов с Okko")
     return True
 
@@ -62,7 +95,8 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "movies_loaded": len(df) if df is not None else 0,
-        "model_ready": model is not None
+        "model_ready": model is not None,
+        "ready": readiness.ready
     })
 
 @app.route('/api/okkonator/questions')
@@ -84,10 +118,15 @@ def get_next_question():
     if not theta:
         theta = init_theta()
     
-    question = pick_next_question(theta, asked_ids)
+    # До загрузки каталога (item_features = None) - выбор без оценки кандидатов
+    question = pick_next_question(theta, asked_ids, item_features)
     
     if question is None:
-        return jsonify({"message": "Вопросы закончились"})
+        return jsonify({
+            "message": "Вопросы закончились",
+            # Подборка устойчива: ответы на оставшиеся вопросы ее не меняют
+            "stopped_early": len(asked_ids) < min(QUESTIONS_MAX, len(QUESTIONS))
+        })
     
     # Вычисляем уверенность профиля (максимум 15 вопросов)
     confidence = int(100 * len(asked_ids) / QUESTIONS_MAX)
@@ -112,11 +151,7 @@ def submit_answer():
         theta = init_theta()
     
     # Находим вопрос
-    question = None
-    for q in QUESTIONS:
-        if q['id'] == question_id:
-            question = q
-            break
+    question = QUESTIONS[QUESTION_INDEX[question_id]] if question_id in QUESTION_INDEX else None
     
     if not question:
         return jsonify({"error": "Вопрос не найден"}), 400
@@ -134,7 +169,25 @@ def submit_answer():
         "updated": True
     })
 
+def okko_cards():
+    """Карточки текущего каталога (пересобираются, если каталог заменен)"""
+    global card_cache
+    if card_cache is None or card_cache.df is not df:
+        card_cache = CardCache(df, lambda frame: build_okko_cards(frame, records_metadata))
+    return card_cache
+
+def format_recommendations(recommendations, theta):
+    """Карточки рекомендаций из DataFrame filter_and_rank"""
+    positions = recommendations.index.tolist()
+    rows = recommendations[["serial_name"]].to_dict("records")
+    reasons = [
+        explain_recommendation(row, theta, records_metadata[idx] if idx < len(records_metadata) else {})
+        for idx, row in zip(positions, rows)
+    ]
+    return okko_cards().get(positions, score=recommendations["score"].astype(float).tolist(), reason=reasons)
+
 @app.route('/api/okkonator/recommendations', methods=['POST'])
+@readiness.required
 def get_recommendations():
     """Получить рекомендации на основе профиля"""
     data = request.get_json()
@@ -150,55 +203,101 @@ def get_recommendations():
     
     try:
         # Получаем рекомендации
-        recommendations = filter_and_rank(df, embeddings, records_metadata, theta, model_kind, model, top_k)
+        with span("filter_and_rank", top_k=top_k):
+            recommendations = ranking_cache.rank(theta, top_k, lambda n: filter_and_rank(
+                df, embeddings, records_metadata, theta, model_kind, model, n, bonus_flags
+            ))
         
         # Форматируем результат
-        result = []
-        for i, (idx, row) in enumerate(recommendations.iterrows()):
-            record_meta = records_metadata[idx] if idx < len(records_metadata) else {}
-            why = explain_recommendation(row, theta, record_meta)
-            
-            # Безопасное получение данных
-            def safe_get(value, default=""):
-                if pd.isna(value):
-                    return default
-                if isinstance(value, (list, tuple, np.ndarray)):
-                    return str(value) if len(value) > 0 else default
-                return str(value)
-            
-            title = safe_get(row["serial_name"], "Неизвестно")
-            genres = ", ".join(record_meta.get("genres", []))
-            content_type = record_meta.get("content_type", "")
-            country = record_meta.get("country", "")
-            age_rating = record_meta.get("age_rating")
-            url = record_meta.get("url", "")
-            description = safe_get(row.get("description", ""))
-            
-            movie_data = {
-                "id": record_meta.get("id", i),
-                "title": title,
-                "content_type": content_type,
-                "genres": genres,
-                "country": country,
-                "age_rating": f"{age_rating}+" if age_rating else "N/A",
-                "description": description[:200] + "..." if len(description) > 200 else description,
-                "score": float(row.get('score', 0)),
-                "reason": why,
-                "url": url,
-                "poster": f"https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=400&h=600&fit=crop"  # Заглушка
-            }
-            result.append(movie_data)
+        with span("format_response"):
+            result = format_recommendations(recommendations, theta)
         
-        return jsonify({
-            "recommendations": result,
-            "profile": theta,
-            "total_found": len(result)
-        })
+        with span("serialize"):
+            response = fast_jsonify({
+                "recommendations": result,
+                "profile": theta,
+                "total_found": len(result)
+            })
+        return response
         
     except Exception as e:
         print(f"Ошибка при получении рекомендаций: {e}")
         return jsonify({"error": f"Ошибка обработки: {str(e)}"}), 500
 
+@app.route('/api/okkonator/group-recommendations', methods=['POST'])
+@readiness.required
+def get_group_recommendations():
+    """
+    Рекомендации для группы: подборки участников и общая подборка
+    
+    Тело: {"members": [{"name": ..., "theta": {...}}, ...], "top_k": 6},
+    top_k ограничивается диапазоном 1..GROUP_MAX_TOP_K.
+    Все профили ранжируются одним проходом по каталогу (filter_and_rank_batch).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Ожидается JSON объект"}), 400
+    members = data.get('members', [])
+    try:
+        top_k = int(data.get('top_k', 6))
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_k должен быть целым числом"}), 400
+    top_k = min(max(top_k, 1), GROUP_MAX_TOP_K)
+    
+    if df is None or embeddings is None:
+        return jsonify({"error": "Сервис не инициализирован"}), 500
+    if not isinstance(members, list) or not all(isinstance(member, dict) for member in members):
+        return jsonify({"error": "members должен быть списком объектов"}), 400
+    if not members:
+        return jsonify({"error": "Нет участников"}), 400
+    if len(members) > GROUP_MAX_MEMBERS:
+        return jsonify({"error": f"Участников больше {GROUP_MAX_MEMBERS}"}), 400
+    
+    thetas = [member.get('theta') or init_theta() for member in members]
+    if not all(
+        isinstance(theta, dict) and all(isinstance(value, (int, float)) for value in theta.values())
+        for theta in thetas
+    ):
+        return jsonify({"error": "theta участника должен быть объектом с числовыми значениями"}), 400
+    
+    try:
+        with span("filter_and_rank_batch", members=len(thetas), top_k=top_k):
+            member_recs, scores = filter_and_rank_batch(
+                df, embeddings, records_metadata, thetas, model_kind, model, top_k, bonus_flags
+            )
+        
+        # Общий профиль группы для объяснений: средние предпочтения участников
+        group_theta = {ax: float(np.mean([theta.get(ax, 0.0) for theta in thetas])) for ax in AXES}
+        
+        with span("format_response"):
+            members_result = [
+                {
+                    "name": member.get('name', f"Участник {i + 1}"),
+                    "recommendations": format_recommendations(recs, theta)
+                }
+                for i, (member, theta, recs) in enumerate(zip(members, thetas, member_recs))
+            ]
+            group_result = {}
+            for strategy in GROUP_STRATEGIES:
+                fused = fuse_group_scores(scores, strategy)
+                top = top_indices(fused, top_k)
+                ranked = df.iloc[top].copy()
+                ranked["score"] = fused[top]
+                group_result[strategy] = format_recommendations(ranked, group_theta)
+        
+        with span("serialize"):
+            response = fast_jsonify({
+                "members": members_result,
+                "group": group_result,
+                "group_profile": group_theta,
+                "total_members": len(members)
+            })
+        return response
+        
+    except Exception as e:
+        print(f"Ошибка при получении групповых рекомендаций: {e}")
+        return jsonify({"error": f"Ошибка обработки: {str(e)}"}), 500
+
 @app.route('/api/okkonator/profile-keywords', methods=['POST'])
 def get_profile_keywords():
     """Получить ключевые слова профиля"""
@@ -213,6 +312,7 @@ def get_profile_keywords():
     })
 
 @app.route('/api/okkonator/explain-recommendation', methods=['POST'])
+@readiness.required
 def explain_specific_recommendation():
     """Объяснить конкретную рекомендацию"""
     data = request.get_json()
@@ -245,10 +345,9 @@ def explain_specific_recommendation():
 
 if __name__ == '__main__':
     print("Запуск микросервиса Окконатора для Okko...")
-    success = initialize_okkonator()
-    if success:
-        print("✅ Микросервис Окконатора запущен на порту 5001")
-        app.run(debug=True, host='0.0.0.0', port=5001)
-    else:
-        print("❌ Не удалось инициализировать сервис")
-        sys.exit(1)
+    # Сервер отвечает сразу, рекомендации доступны после загрузки (/ready)
+    readiness.start(initialize_okkonator)
+    print("✅ Микросервис Окконатора запущен на порту 5001")
+    # Без перезагрузчика: он запускает процесс дважды и грузит модель повторно
+    debug = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+    app.run(debug=debug, use_reloader=False, host='0.0.0.0', port=5001)
@@ -5,11 +5,16 @@
 import os
 import json
 import logging
+import time
+import threading
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
 from dotenv import load_dotenv
 import requests
 
+from tracing import span
+from metrics import OPENROUTER_REQUEST_DURATION, OPENROUTER_ERRORS, register_collector
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -26,6 +31,162 @@ class OpenRouterConfig:
     site_url: Optional[str] = None
     site_name: Optional[str] = None
     timeout: int = 30
+    prompt_caching: bool = True
+
+
+# Префиксы моделей, для которых OpenRouter принимает явные cache_control метки.
+# OpenAI, DeepSeek, Grok и другие провайдеры кэшируют префикс автоматически.
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+# Статистика использования токенов по моделям (включая токены из кэша)
+_usage_lock = threading.Lock()
+usage_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def supports_cache_control(model: str) -> bool:
+    """Проверка, поддерживает ли модель явные cache_control метки"""
+    return model.startswith(CACHE_CONTROL_MODEL_PREFIXES)
+
+
+def _with_cache_control(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия сообщения, контент которого помечен как точка кэширования"""
+    return {
+        **message,
+        "content": [{
+            "type": "text",
+            "text": message["content"],
+            "cache_control": {"type": "ephemeral"}
+        }]
+    }
+
+
+def apply_prompt_caching(messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+    """
+    Помечает стабильный префикс диалога cache_control метками
+    
+    Метки ставятся на системные сообщения и на последнее сообщение
+    стабильного префикса: в цикле tools это последний результат tool (весь
+    список повторится в следующем запросе цикла), иначе - последнее текстовое
+    сообщение перед текущим запросом пользователя. Исходный список сообщений
+    не изменяется.
+    
+    Args:
+        messages: Список сообщений
+        model: Название модели
+        
+    Returns:
+        Новый список сообщений (или исходный, если модель не поддерживает метки)
+    """
+    if not supports_cache_control(model) or len(messages) < 2:
+        return messages
+    
+    prefix_end = None
+    if messages[-1].get("role") == "tool" and isinstance(messages[-1].get("content"), str):
+        # Цикл tools: следующий запрос начнется со всего текущего списка
+        prefix_end = len(messages) - 1
+    else:
+        # Последнее текстовое сообщение перед хвостом диалога
+        for i in range(len(messages) - 2, -1, -1):
+            if messages[i].get("role") in ("user", "assistant", "tool") and isinstance(messages[i].get("content"), str):
+                prefix_end = i
+                break
+    
+    result = []
+    for i, message in enumerate(messages):
+        is_stable_system = message.get("role") == "system" and isinstance(message.get("content"), str)
+        if message.get("content") and (is_stable_system or i == prefix_end):
+            message = _with_cache_control(message)
+        result.append(message)
+    
+    return result
+
+
+def record_usage(model: str, usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Учет использованных токенов, включая токены, прочитанные из кэша промпта
+    
+    Args:
+        model: Название модели
+        usage: Поле usage из ответа OpenRouter
+        
+    Returns:
+        Сводка по запросу: prompt_tokens, completion_tokens, cached_tokens, cost
+    """
+    usage = usage or {}
+    details = usage.get("prompt_tokens_details") or {}
+    summary = {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "cached_tokens": details.get("cached_tokens", 0) or 0,
+        "cost": usage.get("cost", 0.0) or 0.0
+    }
+    
+    with _usage_lock:
+        stats = usage_stats.setdefault(model, {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "cost": 0.0
+        })
+        stats["requests"] += 1
+        for key, value in summary.items():
+            stats[key] += value
+    
+    if summary["cached_tokens"]:
+        logger.info(
+            f"Кэш промпта {model}: {summary['cached_tokens']}/{summary['prompt_tokens']} токенов из кэша"
+        )
+    
+    return summary
+
+
+def get_usage_stats() -> Dict[str, Dict[str, Any]]:
+    """Копия накопленной статистики использования токенов по моделям"""
+    with _usage_lock:
+        return {model: dict(stats) for model, stats in usage_stats.items()}
+
+
+def post_chat_completion(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float) -> requests.Response:
+    """
+    POST в /chat/completions с трассировкой и метриками по модели
+    
+    Латентность пишется в okko_openrouter_request_duration_seconds, ответы
+    с кодом >= 400 и сетевые ошибки - в okko_openrouter_errors_total.
+    """
+    model = payload.get("model", "unknown")
+    start = time.perf_counter()
+    try:
+        with span("openrouter.chat", model=model):
+            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        OPENROUTER_ERRORS.inc(model=model, reason=type(e).__name__)
+        raise
+    finally:
+        OPENROUTER_REQUEST_DURATION.observe(time.perf_counter() - start, model=model)
+    
+    if response.status_code >= 400:
+        OPENROUTER_ERRORS.inc(model=model, reason=str(response.status_code))
+    return response
+
+
+def _usage_collector():
+    """Токены и доля промпта из кэша по моделям для /metrics"""
+    stats = get_usage_stats()
+    tokens = []
+    ratios = []
+    for model, s in stats.items():
+        tokens.append(({"model": model, "kind": "prompt"}, s["prompt_tokens"]))
+        tokens.append(({"model": model, "kind": "completion"}, s["completion_tokens"]))
+        tokens.append(({"model": model, "kind": "cached"}, s["cached_tokens"]))
+        ratios.append(({"model": model}, s["cached_tokens"] / s["prompt_tokens"] if s["prompt_tokens"] else 0.0))
+    return [
+        ("okko_openrouter_tokens_total", "counter", "Токены OpenRouter по моделям", tokens),
+        ("okko_openrouter_prompt_cache_hit_ratio", "gauge", "Доля токенов промпта из кэша", ratios),
+    ]
+
+
+register_collector(_usage_collector)
 
 
 class OpenRouterClient:
@@ -64,7 +225,9 @@ class OpenRouterClient:
             api_key=api_key,
             site_url=os.getenv("OPENROUTER_SITE_URL"),
             site_name=os.getenv("OPENROUTER_SITE_NAME"),
-            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30"))
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30")),
+            prompt_caching=os.getenv("OPENROUTER_PROMPT_CACHING", "true").lower() == "true"
         )
     
     def chat_completion(
@@ -96,12 +259,16 @@ class OpenRouterClient:
         try:
             logger.info(f"Отправка запроса к модели {model}")
             
+            if self.config.prompt_caching:
+                messages = apply_prompt_caching(messages, model)
+            
             # Подготовка данных запроса
             data = {
                 "model": model,
                 "messages": messages,
                 "temperature": temperature,
                 "stream": stream,
+                "usage": {"include": True},
                 **kwargs
             }
             
@@ -110,19 +277,19 @@ class OpenRouterClient:
             
             # Отправка запроса
             url = f"{self.config.base_url}/chat/completions"
-            response = requests.post(
+            response = post_chat_completion(
                 url,
                 headers=self.headers,
-                json=data,
+                payload=data,
                 timeout=self.config.timeout
             )
             
             response.raise_for_status()
             
             if stream:
-                return self._handle_streaming_response(response)
+                return self._handle_streaming_response(response, model)
             else:
-                return self._handle_regular_response(response.json())
+                return self._handle_regular_response(response.json(), model)
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка HTTP при запросе к OpenRouter: {str(e)}")
@@ -131,18 +298,22 @@ class OpenRouterClient:
             logger.error(f"Ошибка при запросе к OpenRouter: {str(e)}")
             raise
     
-    def _handle_regular_response(self, response_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _handle_regular_response(self, response_data: Dict[str, Any], model: str) -> Dict[str, Any]:
         """Обработка обычного (не потокового) ответа"""
+        usage = response_data.get("usage", {})
+        usage_summary = record_usage(model, usage)
         return {
             "content": response_data["choices"][0]["message"]["content"],
             "model": response_data.get("model", "unknown"),
-            "usage": response_data.get("usage", {}),
+            "usage": usage,
+            "cached_tokens": usage_summary["cached_tokens"],
             "finish_reason": response_data["choices"][0].get("finish_reason", "unknown")
         }
     
-    def _handle_streaming_response(self, response) -> Dict[str, Any]:
+    def _handle_streaming_response(self, response, model: str) -> Dict[str, Any]:
         """Обработка потокового ответа"""
         content = ""
+        usage = {}
         for line in response.iter_lines():
             if line:
                 line_str = line.decode('utf-8')
@@ -156,12 +327,19 @@ class OpenRouterClient:
                             delta = data['choices'][0].get('delta', {})
                             if 'content' in delta:
                                 content += delta['content']
+                        # Статистика токенов приходит в последнем чанке
+                        if data.get('usage'):
+                            usage = data['usage']
                     except json.JSONDecodeError:
                         continue
         
+        usage_summary = record_usage(model, usage)
+        
         return {
             "content": content,
             "model": "unknown",
+            "usage": usage,
+            "cached_tokens": usage_summary["cached_tokens"],
             "stream": True
         }
     
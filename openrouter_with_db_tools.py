@@ -19,6 +19,7 @@ from database_tool import (
     list_database_tables,
     DATABASE_TOOLS
 )
+from openrouter_client import apply_prompt_caching, record_usage, post_chat_completion
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -36,6 +37,7 @@ class OpenRouterConfig:
     site_url: Optional[str] = None
     site_name: Optional[str] = None
     timeout: int = 30
+    prompt_caching: bool = True
 
 
 class OpenRouterWithDBTools:
@@ -81,7 +83,9 @@ class OpenRouterWithDBTools:
             api_key=api_key,
             site_url=os.getenv("OPENROUTER_SITE_URL"),
             site_name=os.getenv("OPENROUTER_SITE_NAME"),
-            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30"))
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            timeout=int(os.getenv("OPENROUTER_TIMEOUT", "30")),
+            prompt_caching=os.getenv("OPENROUTER_PROMPT_CACHING", "true").lower() == "true"
         )
     
     def chat_with_db_tools(
@@ -185,12 +189,17 @@ class OpenRouterWithDBTools:
     ) -> Dict[str, Any]:
         """Отправка запроса с tools к OpenRouter с retry логикой"""
         
+        # Помечаем стабильный префикс для кэша провайдера
+        if self.config.prompt_caching:
+            messages = apply_prompt_caching(messages, model)
+        
         # Подготовка данных запроса
         data = {
             "model": model,
             "messages": messages,
             "tools": DATABASE_TOOLS,
-            "temperature": temperature
+            "temperature": temperature,
+            "usage": {"include": True}
         }
         
         if max_tokens is not None:
@@ -201,15 +210,16 @@ class OpenRouterWithDBTools:
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
+                response = post_chat_completion(
                     url,
                     headers=self.headers,
-                    json=data,
+                    payload=data,
                     timeout=self.config.timeout
                 )
                 
                 response.raise_for_status()
                 response_data = response.json()
+                record_usage(model, response_data.get("usage"))
                 
                 # Извлекаем нужные данные из ответа
                 choice = response_data["choices"][0]
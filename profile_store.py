@@ -0,0 +1,269 @@
+"""
+Хранилище профилей пользователей шлюза (app.py)
+
+Профиль привязан к cookie сессии, а не к глобальной переменной процесса:
+у каждого посетителя свои предпочтения, и несколько воркеров шлюза видят
+одни и те же профили через общий SQLite файл. Предпочтения хранятся
+множествами (проверка "фильм понравился" за O(1)), история чата
+ограничена последними PROFILE_CHAT_HISTORY сообщениями.
+
+Бэкенды: sqlite (по умолчанию, общий для воркеров на одной машине) и
+memory (один процесс, для разработки).
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Any
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_COOKIE = "okko_profile"
+PREFERENCE_FIELDS = (
+    "liked_movies", "disliked_movies",
+    "liked_genres", "disliked_genres",
+    "liked_actors", "disliked_actors",
+)
+
+
+def default_profile() -> Dict[str, Any]:
+    """Профиль нового посетителя"""
+    return {
+        'mood_joy_sadness': 0.5,  # 0 = грусть, 1 = радость
+        'mood_calm_energy': 0.5,  # 0 = спокойствие, 1 = энергия
+        'alone_company': 'alone',  # 'alone' или 'company'
+        'duration': 'short',  # 'short' или 'full'
+        'preferences': {field: set() for field in PREFERENCE_FIELDS},
+        'okkonator_answers': [],
+        'okkonator_theta': {},  # Профиль Окконатора
+        'chat_history': [],
+        'identified_movies': [],
+        'current_movie_index': 0,  # Позиция в демо-ленте /api/swipe
+    }
+
+
+def profile_to_json(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Профиль для ответа API и хранения: множества -> отсортированные списки"""
+    data = dict(profile)
+    data['preferences'] = {
+        field: sorted(values, key=str) for field, values in profile['preferences'].items()
+    }
+    return data
+
+
+def profile_from_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Профиль из хранилища; недостающие поля берутся из профиля по умолчанию"""
+    profile = default_profile()
+    profile.update({key: value for key, value in data.items() if key != 'preferences'})
+    for field, values in data.get('preferences', {}).items():
+        profile['preferences'][field] = set(values)
+    return profile
+
+
+def preference_key(content: Any) -> Any:
+    """Хешируемый ключ предпочтения (жанр/актер приходят строкой или объектом)"""
+    if isinstance(content, dict):
+        return content.get('id', content.get('name', json.dumps(content, ensure_ascii=False, sort_keys=True)))
+    return content
+
+
+def new_user_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_valid_user_id(user_id: Optional[str]) -> bool:
+    """Cookie сессии - 32 hex символа (uuid4), остальное игнорируется"""
+    return bool(user_id) and len(user_id) == 32 and all(c in "0123456789abcdef" for c in user_id)
+
+
+class ProfileStore(ABC):
+    """Базовое хранилище: get/update профиля по идентификатору сессии"""
+
+    def __init__(self, chat_history_limit: int = 50, ttl_seconds: int = 30 * 24 * 3600):
+        """
+        Args:
+            chat_history_limit: Сколько последних сообщений чата хранить в профиле
+            ttl_seconds: Срок жизни профиля без обращений (и cookie сессии)
+        """
+        self.chat_history_limit = chat_history_limit
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Профиль из хранилища или None"""
+
+    @abstractmethod
+    def _save(self, user_id: str, profile: Dict[str, Any]):
+        """Запись профиля (вызывается внутри _transaction)"""
+
+    @abstractmethod
+    def _transaction(self):
+        """Контекстный менеджер атомарного чтения-изменения-записи"""
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        """Профиль пользователя (новый, если его еще нет)"""
+        return self._load(user_id) or default_profile()
+
+    def update(self, user_id: str, mutate: Callable[[Dict[str, Any]], Any]) -> Dict[str, Any]:
+        """
+        Атомарное изменение профиля: чтение, mutate(profile), запись
+
+        Returns:
+            Измененный профиль
+        """
+        with self._transaction():
+            profile = self.get(user_id)
+            mutate(profile)
+            overflow = len(profile['chat_history']) - self.chat_history_limit
+            if overflow > 0:
+                del profile['chat_history'][:overflow]
+            self._save(user_id, profile)
+        return profile
+
+
+class MemoryProfileStore(ProfileStore):
+    """Профили в памяти процесса (LRU); только для одного воркера"""
+
+    def __init__(self, chat_history_limit: int = 50, ttl_seconds: int = 30 * 24 * 3600, max_entries: int = 10000):
+        super().__init__(chat_history_limit, ttl_seconds)
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._profiles: "OrderedDict[str, str]" = OrderedDict()
+
+    def _transaction(self):
+        return self._lock
+
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._profiles.get(user_id)
+            if data is None:
+                return None
+            self._profiles.move_to_end(user_id)
+        # Копия через JSON: изменения вне update не попадают в хранилище
+        return profile_from_json(json.loads(data))
+
+    def _save(self, user_id: str, profile: Dict[str, Any]):
+        with self._lock:
+            self._profiles[user_id] = json.dumps(profile_to_json(profile), ensure_ascii=False)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+
+
+class SQLiteProfileStore(ProfileStore):
+    """Профили в SQLite файле, общем для воркеров шлюза"""
+
+    def __init__(self, path: str, chat_history_limit: int = 50, ttl_seconds: int = 30 * 24 * 3600,
+                 prune_every: int = 1000):
+        """
+        Args:
+            path: Файл базы (создается при первом запуске)
+            chat_history_limit: Сколько последних сообщений чата хранить в профиле
+            ttl_seconds: Профили без обращений дольше этого срока удаляются
+                при старте и каждые prune_every записей
+            prune_every: Период очистки в записях этого процесса (0 - только при старте)
+        """
+        super().__init__(chat_history_limit, ttl_seconds)
+        self.path = path
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        # WAL: читатели не ждут писателя из другого воркера
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        removed = self._prune()
+        logger.info(f"Хранилище профилей SQLite: {path} (удалено устаревших: {removed})")
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока (sqlite3 не разделяет соединения между потоками)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._conn())
+
+    def _prune(self) -> int:
+        """Удаление профилей без обращений дольше ttl_seconds; возвращает число удаленных"""
+        return self._conn().execute(
+            "DELETE FROM profiles WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+
+    def update(self, user_id: str, mutate: Callable[[Dict[str, Any]], Any]) -> Dict[str, Any]:
+        profile = super().update(user_id, mutate)
+        if self.prune_every > 0:
+            with self._writes_lock:
+                self._writes += 1
+                due = self._writes % self.prune_every == 0
+            # Отдельным запросом после COMMIT: очистка не удлиняет транзакцию профиля
+            if due:
+                removed = self._prune()
+                if removed:
+                    logger.info(f"Удалено устаревших профилей: {removed}")
+        return profile
+
+    def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return profile_from_json(json.loads(row[0])) if row else None
+
+    def _save(self, user_id: str, profile: Dict[str, Any]):
+        self._conn().execute(
+            "INSERT INTO profiles (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, json.dumps(profile_to_json(profile), ensure_ascii=False), time.time())
+        )
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT: параллельные update одного профиля из разных воркеров не теряются"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_profile_store_from_env() -> ProfileStore:
+    """Создание хранилища по переменным окружения (PROFILE_STORE=sqlite|memory)"""
+    backend = os.getenv("PROFILE_STORE", "sqlite").lower()
+    chat_history_limit = int(os.getenv("PROFILE_CHAT_HISTORY", "50"))
+    ttl_seconds = int(os.getenv("PROFILE_TTL", str(30 * 24 * 3600)))
+    if backend == "memory":
+        return MemoryProfileStore(
+            chat_history_limit=chat_history_limit,
+            ttl_seconds=ttl_seconds,
+            max_entries=int(os.getenv("PROFILE_STORE_MAX_ENTRIES", "10000"))
+        )
+    if backend != "sqlite":
+        logger.warning(f"Неизвестный PROFILE_STORE={backend}, используем sqlite")
+    return SQLiteProfileStore(
+        os.getenv("PROFILE_STORE_PATH", "data/profiles.sqlite3"),
+        chat_history_limit=chat_history_limit,
+        ttl_seconds=ttl_seconds,
+        prune_every=int(os.getenv("PROFILE_PRUNE_EVERY", "1000"))
+    )
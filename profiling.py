@@ -0,0 +1,206 @@
+"""
+Профилирование живых сервисов (включается явно)
+
+- GET /debug/profile?seconds=N - сэмплирующий профайлер всех потоков
+  процесса на N секунд, ответ в формате collapsed stacks
+  (flamegraph.pl, speedscope, inferno)
+- заголовок X-Profile: cprofile - cProfile одного запроса, отчет pstats
+  доступен по /debug/profile/requests/<request_id>
+
+Безопасность для прода: по умолчанию выключено (PROFILING_ENABLED),
+каждый запрос требует токен PROFILING_TOKEN в заголовке X-Profile-Token,
+длительность ограничена PROFILING_MAX_SECONDS, одновременно работает
+только одна сессия профилирования. Сэмплер не инструментирует код,
+а раз в PROFILING_SAMPLE_INTERVAL секунд читает стеки потоков.
+"""
+
+import io
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "30"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005"))
+MIN_SAMPLE_INTERVAL = 0.001
+REQUEST_PROFILES_KEPT = 20
+
+TOKEN_HEADER = "X-Profile-Token"
+PROFILE_HEADER = "X-Profile"
+
+# Модули, в которых поток ждет (сокет, очередь, sleep): такие сэмплы по
+# умолчанию отбрасываются, иначе в профиле доминируют простаивающие потоки
+IDLE_MODULES = ("threading.py", "selectors.py", "socketserver.py", "queue.py", "socket.py", "ssl.py")
+
+# Одна сессия профилирования на процесс: cProfile в Python 3.12+ не
+# допускает два активных профайлера, а два сэмплера исказили бы друг друга
+_profile_lock = threading.Lock()
+
+# Отчеты cProfile последних запросов: request_id -> текст pstats
+_request_profiles: "OrderedDict[str, str]" = OrderedDict()
+_request_profiles_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL, include_idle: bool = False) -> Counter:
+    """
+    Сэмплирование стеков всех потоков, кроме текущего
+
+    Returns:
+        Counter: "поток;внешний кадр;...;внутренний кадр" -> число сэмплов
+    """
+    interval = max(interval, MIN_SAMPLE_INTERVAL)
+    own_thread = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            if not include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.append(thread_names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+
+    return stacks
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """Формат collapsed stacks: одна строка "стек число" на уникальный стек"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _authorized(request) -> bool:
+    token = request.headers.get(TOKEN_HEADER, "")
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token.encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def _store_request_profile(request_id: str, report: str):
+    with _request_profiles_lock:
+        _request_profiles[request_id] = report
+        while len(_request_profiles) > REQUEST_PROFILES_KEPT:
+            _request_profiles.popitem(last=False)
+
+
+def get_request_profile(request_id: str) -> Optional[str]:
+    with _request_profiles_lock:
+        return _request_profiles.get(request_id)
+
+
+def init_profiling(app, service_name: str):
+    """
+    Подключение профилирования к Flask приложению
+
+    Без PROFILING_ENABLED=true и непустого PROFILING_TOKEN ничего не
+    регистрирует: эндпоинтов нет, запросы не замедляются.
+    """
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_TOKEN:
+        logger.warning(f"PROFILING_ENABLED=true, но PROFILING_TOKEN не задан: профилирование {service_name} отключено")
+        return
+
+    import uuid
+    from flask import Response, g, jsonify, request
+
+    from tracing import REQUEST_ID_HEADER, current_request_id
+
+    @app.before_request
+    def _profiling_before_request():
+        if request.headers.get(PROFILE_HEADER, "").lower() != "cprofile" or not _authorized(request):
+            return
+        if not _profile_lock.acquire(blocking=False):
+            g._profile_busy = True
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Профайлер уже активен (например, отладчик)
+            _profile_lock.release()
+            g._profile_busy = True
+            return
+        g._profiler = profiler
+
+    @app.after_request
+    def _profiling_after_request(response):
+        if g.pop("_profile_busy", False):
+            response.headers["X-Profile-Status"] = "busy"
+            return response
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        try:
+            profiler.disable()
+        finally:
+            _profile_lock.release()
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(60)
+        request_id = current_request_id() or request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        _store_request_profile(request_id, out.getvalue())
+        response.headers["X-Profile-Id"] = request_id
+        return response
+
+    @app.teardown_request
+    def _profiling_teardown(exc):
+        # Запрос упал до after_request: не оставляем профайлер включенным
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+
+    @app.route('/debug/profile')
+    def _debug_profile():
+        if not _authorized(request):
+            return jsonify({"success": False, "error": "Неверный токен профилирования"}), 403
+
+        seconds = min(request.args.get('seconds', 5.0, type=float), MAX_SECONDS)
+        interval = request.args.get('interval', SAMPLE_INTERVAL, type=float)
+        include_idle = request.args.get('idle', 'false').lower() == 'true'
+        if seconds <= 0:
+            return jsonify({"success": False, "error": "seconds должен быть положительным"}), 400
+
+        if not _profile_lock.acquire(blocking=False):
+            return jsonify({"success": False, "error": "Профилирование уже выполняется"}), 409
+        try:
+            logger.info(f"Сэмплирующий профайлер {service_name}: {seconds} с, интервал {interval} с")
+            stacks = sample_stacks(seconds, interval, include_idle)
+        finally:
+            _profile_lock.release()
+
+        return Response(collapsed_stacks(stacks), mimetype="text/plain; charset=utf-8")
+
+    @app.route('/debug/profile/requests/<request_id>')
+    def _debug_request_profile(request_id):
+        if not _authorized(request):
+            return jsonify({"success": False, "error": "Неверный токен профилирования"}), 403
+        report = get_request_profile(request_id)
+        if report is None:
+            return jsonify({"success": False, "error": "Профиль не найден"}), 404
+        return Response(report, mimetype="text/plain; charset=utf-8")
+
+    logger.info(f"Профилирование {service_name} включено (/debug/profile)")
@@ -0,0 +1,284 @@
+"""
+Кэш ранжирования Окконатора по дискретной сигнатуре профиля
+
+filter_and_rank зависит от theta только через пороги (см.
+theta_signature), поэтому топ-N для сигнатуры можно посчитать один раз:
+повторные запросы с тем же профилем становятся поиском в словаре.
+Кэш - LRU в памяти процесса, частые сигнатуры можно заранее рассчитать
+офлайн; записи привязаны к версии каталога и энкодеру.
+
+Предварительный расчет частых сигнатур (симуляция сессий анкеты):
+    python ranking_cache.py --sessions 2000 --limit 500
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from back.okkonator_okko import (
+    theta_signature, init_theta, update_theta, pick_next_question, build_item_features, targets_vector,
+    AXES, SIGNATURE_THRESHOLD
+)
+from catalog_version import current_catalog_version
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRECOMPUTED_FILE = "okko_ranking_cache.json"
+
+
+def signature_key(signature: Tuple[int, ...]) -> str:
+    """Сигнатура как строка (ключ JSON файла предрасчета)"""
+    return ",".join(str(level) for level in signature)
+
+
+def signature_theta(signature: Tuple[int, ...]) -> Dict[str, float]:
+    """Профиль с заданной сигнатурой (для предрасчета)"""
+    theta = {ax: 2 * SIGNATURE_THRESHOLD * level for ax, level in zip(AXES, signature)}
+    if signature[-1] and theta["violence_tol"] == 0:
+        theta["violence_tol"] = -SIGNATURE_THRESHOLD / 2
+    return theta
+
+
+class RankingCache:
+    """LRU топ-N ранжирования по сигнатуре профиля"""
+
+    def __init__(self, max_entries: int = 4096, top_n: int = 50):
+        """
+        Инициализация кэша
+
+        Args:
+            max_entries: Максимальное количество сигнатур в памяти
+            top_n: Сколько лидеров хранить на сигнатуру (запросы с большим top_k не кэшируются)
+        """
+        self.max_entries = max_entries
+        self.top_n = top_n
+        self.catalog_version: Optional[str] = None
+        self.df: Optional[pd.DataFrame] = None
+
+        self._lock = threading.Lock()
+        # {сигнатура: (индексы df, sim, score)}
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, df: pd.DataFrame, catalog_version: str):
+        """Привязка к загруженному каталогу; записи прошлого каталога удаляются"""
+        with self._lock:
+            self._entries.clear()
+            self.df = df
+            self.catalog_version = catalog_version
+        logger.info(f"Кэш ранжирования очищен, версия каталога: {catalog_version}")
+
+    def _put(self, signature: Tuple[int, ...], entry: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self._entries[signature] = entry
+        self._entries.move_to_end(signature)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _materialize(self, entry: Tuple[np.ndarray, np.ndarray, np.ndarray], top_k: int) -> pd.DataFrame:
+        """DataFrame в формате filter_and_rank из сохраненных индексов"""
+        index, sims, scores = entry
+        res = self.df.loc[index[:top_k]].copy()
+        res["sim"] = sims[:top_k]
+        res["score"] = scores[:top_k]
+        return res
+
+    def rank(self, theta: Dict[str, float], top_k: int, compute: Callable[[int], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Топ-k для профиля из кэша или через compute(top_n)
+
+        Args:
+            theta: Профиль пользователя
+            top_k: Сколько рекомендаций вернуть
+            compute: Ранжирование каталога, compute(n) -> DataFrame filter_and_rank
+        """
+        if self.df is None or self.max_entries <= 0 or top_k > self.top_n:
+            return compute(top_k)
+
+        signature = theta_signature(theta)
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is not None:
+                self._entries.move_to_end(signature)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            return self._materialize(entry, top_k)
+
+        ranked = compute(self.top_n)
+        entry = (
+            ranked.index.to_numpy(),
+            ranked["sim"].to_numpy(dtype=np.float32),
+            ranked["score"].to_numpy(dtype=np.float32)
+        )
+        with self._lock:
+            self._put(signature, entry)
+        return ranked.head(top_k)
+
+    def load_precomputed(self, path: str) -> int:
+        """Загрузка предрасчета; файл другой версии каталога игнорируется"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать предрасчет ранжирования {path}: {e}")
+            return 0
+
+        if data.get("catalog_version") != self.catalog_version or data.get("top_n", 0) < self.top_n:
+            logger.info(f"Предрасчет ранжирования {path} устарел, пропускаем")
+            return 0
+
+        with self._lock:
+            for key, item in data["entries"].items():
+                signature = tuple(int(level) for level in key.split(","))
+                self._put(signature, (
+                    np.asarray(item["index"])[:self.top_n],
+                    np.asarray(item["sim"], dtype=np.float32)[:self.top_n],
+                    np.asarray(item["score"], dtype=np.float32)[:self.top_n]
+                ))
+        logger.info(f"Загружен предрасчет ранжирования: {len(data['entries'])} сигнатур")
+        return len(data["entries"])
+
+    def save_precomputed(self, path: str):
+        """Сохранение текущих записей (для офлайн предрасчета)"""
+        with self._lock:
+            entries = {
+                signature_key(signature): {
+                    "index": index.tolist(),
+                    "sim": sims.tolist(),
+                    "score": scores.tolist()
+                }
+                for signature, (index, sims, scores) in self._entries.items()
+            }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "catalog_version": self.catalog_version,
+                "top_n": self.top_n,
+                "created_at": time.time(),
+                "entries": entries
+            }, f, ensure_ascii=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "top_n": self.top_n,
+                "catalog_version": self.catalog_version
+            }
+
+    def collect_metrics(self) -> List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]:
+        """Метрики кэша для /metrics (см. metrics.register_collector)"""
+        stats = self.stats()
+        return [
+            ("okko_ranking_cache_requests_total", "counter", "Обращения к кэшу ранжирования",
+             [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+            ("okko_ranking_cache_entries", "gauge", "Сигнатур в кэше ранжирования",
+             [({}, stats["entries"])]),
+        ]
+
+
+def ranking_catalog_version(data_dir: str, model_kind: str) -> str:
+    """Версия каталога с учетом энкодера: векторы запросов разных энкодеров различаются"""
+    return f"{current_catalog_version(data_dir)}:{model_kind}"
+
+
+def create_ranking_cache_from_env() -> RankingCache:
+    """Создание кэша по переменным окружения (OKKO_RANKING_CACHE_SIZE=0 - выключен)"""
+    return RankingCache(
+        max_entries=int(os.getenv("OKKO_RANKING_CACHE_SIZE", "4096")),
+        top_n=int(os.getenv("OKKO_RANKING_CACHE_TOP_N", "50"))
+    )
+
+
+def simulate_signatures(records_metadata: List[Dict[str, Any]], sessions: int, seed: int = 0) -> Counter:
+    """
+    Частоты сигнатур в конце анкеты по симуляции сессий
+
+    Пользователь загадывает случайный тайтл каталога и отвечает по
+    совпадению его признаков с целями вопроса.
+    """
+    item_features = build_item_features(records_metadata)
+    rng = np.random.default_rng(seed)
+    counts = Counter()
+    for _ in range(sessions):
+        target = item_features[rng.integers(len(item_features))]
+        theta = init_theta()
+        asked = []
+        while True:
+            question = pick_next_question(theta, asked, item_features)
+            if question is None:
+                break
+            agreement = float(target @ targets_vector(question["targets"]))
+            answer = int(np.sign(agreement)) * 2 if agreement else int(rng.choice([-1, 0, 1]))
+            if answer != 0:
+                update_theta(theta, answer, question["targets"])
+            asked.append(question["id"])
+            # Промежуточные подборки тоже запрашиваются (первая - при уверенности 70%)
+            counts[theta_signature(theta)] += 1
+    return counts
+
+
+def main():
+    from back.okkonator_okko import load_okko_vector_db, load_model, filter_and_rank, record_flags
+
+    parser = argparse.ArgumentParser(description="Предрасчет кэша ранжирования Окконатора")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--sessions", type=int, default=2000, help="Симулируемых сессий анкеты")
+    parser.add_argument("--limit", type=int, default=500, help="Сколько самых частых сигнатур рассчитать")
+    args = parser.parse_args()
+
+    df, embeddings, metadata, records_metadata = load_okko_vector_db(args.data_dir)
+    if df is None:
+        return 1
+    model_kind, model = load_model(args.data_dir)
+    if model is None:
+        return 1
+
+    cache = create_ranking_cache_from_env()
+    cache.max_entries = max(cache.max_entries, args.limit)
+    cache.reset(df, ranking_catalog_version(args.data_dir, model_kind))
+
+    flags = record_flags(records_metadata, len(df))
+    counts = simulate_signatures(records_metadata, args.sessions)
+    total = sum(counts.values())
+    common = counts.most_common(args.limit)
+    covered = sum(count for _, count in common)
+    print(f"Сигнатур: {len(counts)}, рассчитываем {len(common)} (покрытие запросов {covered / total:.1%})")
+
+    start = time.time()
+    for signature, _ in common:
+        theta = signature_theta(signature)
+        cache.rank(theta, cache.top_n, lambda n: filter_and_rank(
+            df, embeddings, records_metadata, theta, model_kind, model, n, flags
+        ))
+
+    path = os.path.join(args.data_dir, PRECOMPUTED_FILE)
+    cache.save_precomputed(path)
+    print(f"✅ {path}: {len(common)} сигнатур за {time.time() - start:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Фоновая загрузка тяжелых артефактов и проверка готовности сервиса
+
+HTTP сервер поднимается сразу, а модели и каталоги загружаются в
+отдельном потоке. Маршруты, которым нужны данные, помечаются
+@readiness.required и до окончания загрузки отвечают 503 с Retry-After,
+остальные (вопросы, /health, /metrics) работают сразу. Оркестратор и
+балансировщик смотрят на /ready.
+"""
+
+import time
+import logging
+import threading
+from functools import wraps
+from typing import Callable, Optional
+
+from metrics import Gauge
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SERVICE_READY = Gauge(
+    "okko_service_ready",
+    "1, если тяжелые артефакты сервиса загружены",
+    ("service",)
+)
+
+
+class Readiness:
+    """Состояние фоновой инициализации сервиса"""
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+        self.ready = False
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        SERVICE_READY.set(0, service=service_name)
+
+    def start(self, initializer: Callable[[], Optional[bool]]):
+        """
+        Запуск инициализации в фоновом потоке
+
+        Args:
+            initializer: Функция загрузки; False или исключение - загрузка не удалась
+        """
+        if self._thread is not None:
+            return
+        self.started_at = time.time()
+
+        def run():
+            try:
+                result = initializer()
+                if result is False:
+                    self.error = "Инициализация не удалась"
+                else:
+                    self.ready = True
+                    SERVICE_READY.set(1, service=self.service_name)
+            except Exception as e:
+                logger.exception(f"Ошибка инициализации {self.service_name}")
+                self.error = str(e)
+            finally:
+                self.load_seconds = round(time.time() - self.started_at, 3)
+                if self.ready:
+                    logger.info(f"{self.service_name} готов за {self.load_seconds} с")
+
+        self._thread = threading.Thread(target=run, name=f"{self.service_name}-init", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание окончания загрузки (для скриптов и тестов)"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    def status(self) -> dict:
+        return {
+            "service": self.service_name,
+            "ready": self.ready,
+            "loading": self._thread is not None and self._thread.is_alive(),
+            "error": self.error,
+            "load_seconds": self.load_seconds
+        }
+
+    def required(self, view):
+        """Декоратор маршрута: 503, пока данные не загружены"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.ready:
+                from flask import jsonify
+                response = jsonify({
+                    "success": False,
+                    "error": "Сервис загружается, повторите запрос позже" if self.error is None else self.error
+                })
+                response.status_code = 503
+                response.headers["Retry-After"] = "1"
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+
+    def init_app(self, app):
+        """Регистрация /ready (200 - готов, 503 - загрузка или ошибка)"""
+        from flask import jsonify
+
+        @app.route('/ready')
+        def _ready():
+            return jsonify(self.status()), 200 if self.ready else 503
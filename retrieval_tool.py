@@ -0,0 +1,297 @@
+"""
+Tool для структурированного векторного поиска по каталогу Okko
+Интеграция с OpenRouter Tool Calling: заменяет несколько итераций
+свободного SQL одним вызовом с фильтрами по жанру, году, типу и актерам
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from back.okkonator_okko import load_okko_vector_db, load_model, embed_text, cosine_sim
+from back.quantized_embeddings import QuantizedEmbeddings, rerank_candidates
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Максимальное количество кандидатов в одном ответе tool
+MAX_CANDIDATES = 30
+
+
+def _parse_year(release_date: Any) -> float:
+    """Извлечение года из release_date метаданных записи"""
+    if not release_date:
+        return np.nan
+    match = re.search(r"(\d{4})", str(release_date))
+    return float(match.group(1)) if match else np.nan
+
+
+class OkkoRetrievalTool:
+    """Tool для поиска кандидатов по эмбеддингам Okko с фильтрами"""
+
+    def __init__(self, data_dir: str = "data"):
+        """
+        Инициализация Retrieval Tool
+
+        Args:
+            data_dir: Директория с векторной БД Okko
+        """
+        df, embeddings, metadata, records_metadata = load_okko_vector_db(data_dir)
+        if df is None:
+            raise ValueError(f"Векторная БД Okko не найдена в {data_dir}")
+
+        model_kind, model = load_model(data_dir)
+        if model is None:
+            raise ValueError("Не удалось загрузить модель для эмбеддингов")
+
+        self.df = df
+        self.embeddings = embeddings
+        self.records_metadata = records_metadata
+        self.model_kind = model_kind
+        self.model = model
+
+        self._build_filter_index()
+        logger.info(f"Retrieval tool готов: {len(self.records_metadata)} записей")
+
+    def _build_filter_index(self):
+        """Предвычисление колонок и инвертированных индексов для фильтров"""
+        n = min(len(self.records_metadata), self.embeddings.shape[0])
+        records = self.records_metadata[:n]
+        self.size = n
+
+        self.years = np.array([_parse_year(r.get("release_date")) for r in records], dtype=np.float32)
+        self.content_types = np.array([(r.get("content_type") or "").lower() for r in records])
+
+        # title_id из каталога совпадает с ID в PostgreSQL, иначе используем номер записи
+        if "title_id" in self.df.columns:
+            self.ids = [int(v) if v == v else int(r.get("id", i)) for i, (v, r) in
+                        enumerate(zip(self.df["title_id"].tolist()[:n], records))]
+        else:
+            self.ids = [int(r.get("id", i)) for i, r in enumerate(records)]
+
+        # Инвертированные индексы: значение в нижнем регистре -> номера записей
+        self.genre_index: Dict[str, List[int]] = {}
+        self.actor_index: Dict[str, List[int]] = {}
+        for i, record in enumerate(records):
+            for genre in record.get("genres", []):
+                self.genre_index.setdefault(genre.lower(), []).append(i)
+            for actor in record.get("actors", []):
+                self.actor_index.setdefault(actor.lower(), []).append(i)
+
+    def _mask_from_index(self, index: Dict[str, List[int]], values: List[str]) -> np.ndarray:
+        """Маска записей, у которых есть хотя бы одно значение, содержащее искомую подстроку"""
+        mask = np.zeros(self.size, dtype=bool)
+        needles = [v.lower().strip() for v in values if v and v.strip()]
+        for key, rows in index.items():
+            if any(needle in key for needle in needles):
+                mask[rows] = True
+        return mask
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        genres: Optional[List[str]] = None,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        content_type: Optional[str] = None,
+        actors: Optional[List[str]] = None,
+        top_k: int = 10
+    ) -> Dict[str, Any]:
+        """
+        Поиск кандидатов: фильтрация по метаданным и ранжирование по сходству
+
+        Args:
+            query: Свободное описание желаемого (настроение, сюжет, тема)
+            genres: Жанры (достаточно совпадения любого)
+            year_from: Год выпуска от
+            year_to: Год выпуска до
+            content_type: Тип контента (Фильм, Сериал, Многосерийный фильм)
+            actors: Актеры (достаточно совпадения любого)
+            top_k: Количество кандидатов
+
+        Returns:
+            Результат поиска с компактным списком кандидатов
+        """
+        mask = np.ones(self.size, dtype=bool)
+
+        if genres:
+            mask &= self._mask_from_index(self.genre_index, genres)
+        if actors:
+            mask &= self._mask_from_index(self.actor_index, actors)
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= self.years <= year_to
+        if content_type:
+            mask &= self.content_types == content_type.lower()
+
+        total_matched = int(mask.sum())
+        if total_matched == 0:
+            return {
+                "success": True,
+                "candidates": [],
+                "total_matched": 0,
+                "message": "Нет записей, подходящих под фильтры. Ослабьте критерии."
+            }
+
+        # Без текстового запроса ранжируем по тексту из фильтров (в формате текстов эмбеддингов)
+        query_parts = [query] if query else []
+        if genres:
+            query_parts.append(f"Жанры: {', '.join(genres)}")
+        if actors:
+            query_parts.append(f"В ролях: {', '.join(actors)}")
+        query_text = " | ".join(query_parts) if query_parts else "интересный качественный популярный"
+
+        query_emb = embed_text(query_text, self.model_kind, self.model)
+        sims = np.asarray(cosine_sim(query_emb, self.embeddings), dtype=np.float32)[:self.size]
+        sims = np.where(mask, sims, -np.inf)
+
+        top_k = max(1, min(int(top_k), MAX_CANDIDATES, total_matched))
+
+        if isinstance(self.embeddings, QuantizedEmbeddings):
+            # Точный пересчет лидеров приближенного скана, остальные отбрасываются
+            candidates = rerank_candidates(sims, top_k)
+            candidates = candidates[np.isfinite(sims[candidates])]
+            sims = np.full_like(sims, -np.inf)
+            sims[candidates] = self.embeddings.exact_scores(query_emb, candidates)
+        top = np.argpartition(-sims, top_k - 1)[:top_k]
+        top = top[np.argsort(-sims[top])]
+
+        candidates = []
+        for i in top:
+            record = self.records_metadata[i]
+            year = self.years[i]
+            candidates.append({
+                "id": self.ids[i],
+                "title": record.get("title", ""),
+                "year": int(year) if not np.isnan(year) else None,
+                "content_type": record.get("content_type", ""),
+                "genres": record.get("genres", [])[:3],
+                "country": record.get("country", ""),
+                "score": round(float(sims[i]), 3)
+            })
+
+        return {
+            "success": True,
+            "candidates": candidates,
+            "total_matched": total_matched
+        }
+
+
+# Модель и каталог загружаются один раз на процесс
+_retrieval_tool = None
+_retrieval_tool_lock = threading.Lock()
+
+
+def get_retrieval_tool() -> OkkoRetrievalTool:
+    """Получение общего экземпляра Retrieval Tool (ленивая инициализация)"""
+    global _retrieval_tool
+    if _retrieval_tool is None:
+        with _retrieval_tool_lock:
+            if _retrieval_tool is None:
+                _retrieval_tool = OkkoRetrievalTool(os.getenv("OKKO_DATA_DIR", "data"))
+    return _retrieval_tool
+
+
+# Функция для использования в OpenRouter Tool Calling
+def search_movie_candidates(
+    query: Optional[str] = None,
+    genres: Optional[List[str]] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    content_type: Optional[str] = None,
+    actors: Optional[List[str]] = None,
+    top_k: int = 10
+) -> str:
+    """
+    Функция для вызова из OpenRouter Tool Calling
+
+    Returns:
+        JSON строка с кандидатами
+    """
+    try:
+        result = get_retrieval_tool().search(
+            query=query,
+            genres=genres,
+            year_from=year_from,
+            year_to=year_to,
+            content_type=content_type,
+            actors=actors,
+            top_k=top_k
+        )
+        return json.dumps(result, ensure_ascii=False)
+    except Exception as e:
+        logger.error(f"Ошибка поиска кандидатов: {str(e)}")
+        error_result = {
+            "success": False,
+            "error": f"Ошибка поиска кандидатов: {str(e)}",
+            "error_type": "RETRIEVAL_ERROR"
+        }
+        return json.dumps(error_result, ensure_ascii=False)
+
+
+# Определение tools для OpenRouter
+RETRIEVAL_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_movie_candidates",
+            "description": (
+                "Поиск фильмов и сериалов в каталоге Okko по смыслу запроса с фильтрами. "
+                "Возвращает компактный список кандидатов (id, название, год, тип, жанры, страна). "
+                "Используй вместо SQL для подбора: обычно одного вызова достаточно."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Описание желаемого своими словами: настроение, сюжет, тема"
+                    },
+                    "genres": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Жанры на русском, например [\"комедия\", \"драма\"]"
+                    },
+                    "year_from": {
+                        "type": "integer",
+                        "description": "Год выпуска от"
+                    },
+                    "year_to": {
+                        "type": "integer",
+                        "description": "Год выпуска до"
+                    },
+                    "content_type": {
+                        "type": "string",
+                        "enum": ["Фильм", "Сериал", "Многосерийный фильм"],
+                        "description": "Тип контента"
+                    },
+                    "actors": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Актеры, например [\"Леонардо ДиКаприо\"]"
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": f"Количество кандидатов (по умолчанию 10, максимум {MAX_CANDIDATES})"
+                    }
+                }
+            }
+        }
+    }
+]
+
+
+# Пример использования
+if __name__ == "__main__":
+    print(search_movie_candidates(query="легкая комедия на вечер", genres=["комедия"], top_k=5))
@@ -0,0 +1,269 @@
+"""
+Семантический кэш ответов системы подбора фильмов
+Перефразированные запросы ("хочу комедию", "посоветуй комедию") получают
+сохраненный структурированный ответ без повторного запуска LLM с tools
+
+Эмбеддинг MiniLM почти не различает отрицание и числа ("хочу комедию" и
+"не хочу комедию", "фильмы 80-х" и "фильмы 90-х"), поэтому смысловое
+совпадение засчитывается только при одинаковых словах-отрицаниях и числах,
+а короткие запросы попадают в кэш только точным совпадением.
+"""
+
+import os
+import sys
+import re
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from back.okkonator_okko import load_model, embed_text
+from catalog_version import current_catalog_version
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _normalize_message(message: str) -> str:
+    """Нормализация текста для точного совпадения"""
+    return " ".join(message.lower().split())
+
+
+NEGATIONS = frozenset({
+    "не", "нет", "без", "ни", "кроме", "никаких", "никакой", "никакие",
+    "not", "no", "without", "except", "dont", "don't",
+})
+_WORD_RE = re.compile(r"[\w']+")
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def _words(message: str) -> List[str]:
+    return _WORD_RE.findall(message.lower())
+
+
+def _guard_signature(message: str) -> Tuple[frozenset, Tuple[str, ...]]:
+    """Отрицания и числа запроса: смысловое совпадение возможно только при равных"""
+    words = _words(message)
+    negations = frozenset(w for w in words if w in NEGATIONS)
+    numbers = tuple(sorted(set(_NUMBER_RE.findall(message))))
+    return negations, numbers
+
+
+class SemanticCache:
+    """Кэш структурированных ответов по смысловой близости запросов"""
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: int = 3600,
+        max_entries: int = 1000,
+        catalog_version: Optional[str] = None,
+        min_semantic_words: int = 4
+    ):
+        """
+        Инициализация кэша
+
+        Args:
+            threshold: Минимальное косинусное сходство запросов для попадания
+            ttl_seconds: Время жизни записи в секундах
+            max_entries: Максимальное количество записей на модель
+            catalog_version: Версия каталога, с которой согласованы ответы
+            min_semantic_words: Запросы короче (в словах) попадают только точным совпадением
+        """
+        self.threshold = threshold
+        self.min_semantic_words = min_semantic_words
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.catalog_version = catalog_version or current_catalog_version()
+
+        self.model_kind = None
+        self.model = None
+        self.ready = False
+
+        self._lock = threading.Lock()
+        # Записи по LLM модели: {"model": {"entries": [...], "matrix": np.ndarray}}
+        self._buckets: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load_encoder(self) -> bool:
+        """Загрузка MiniLM модели для эмбеддингов запросов"""
+        model_kind, model = load_model()
+        if model is None:
+            logger.warning("Семантический кэш отключен: модель эмбеддингов недоступна")
+            return False
+
+        try:
+            # Непригодный для запросов энкодер (например, необученный TF-IDF) отключает кэш
+            embed_text("проверка", model_kind, model)
+        except Exception as e:
+            logger.warning(f"Семантический кэш отключен: энкодер не работает ({e})")
+            return False
+
+        self.model_kind, self.model = model_kind, model
+        self.ready = True
+        logger.info(f"Семантический кэш готов (энкодер: {model_kind})")
+        return True
+
+    def load_encoder_async(self) -> threading.Thread:
+        """Фоновая загрузка модели, чтобы не задерживать старт сервиса"""
+        thread = threading.Thread(target=self.load_encoder, daemon=True)
+        thread.start()
+        return thread
+
+    def _embed(self, message: str) -> np.ndarray:
+        return np.asarray(embed_text(message, self.model_kind, self.model), dtype=np.float32)
+
+    def _is_alive(self, entry: Dict[str, Any], now: float) -> bool:
+        return (
+            now - entry["created_at"] <= self.ttl_seconds
+            and entry["catalog_version"] == self.catalog_version
+        )
+
+    def _prune(self, bucket: Dict[str, Any], now: float):
+        """Удаление устаревших записей и пересборка матрицы эмбеддингов"""
+        entries = [e for e in bucket["entries"] if self._is_alive(e, now)]
+        entries = entries[-self.max_entries:]
+        bucket["entries"] = entries
+        bucket["exact"] = {e["key"]: e for e in entries}
+        bucket["matrix"] = np.stack([e["embedding"] for e in entries]) if entries else None
+
+    def lookup(self, message: str, model: str) -> Optional[Dict[str, Any]]:
+        """
+        Поиск сохраненного ответа для запроса
+
+        Args:
+            message: Сообщение пользователя
+            model: LLM модель, которой был бы обработан запрос
+
+        Returns:
+            {"data": ..., "similarity": ..., "matched_message": ...} или None
+        """
+        if not self.ready:
+            return None
+
+        now = time.time()
+        key = _normalize_message(message)
+
+        with self._lock:
+            bucket = self._buckets.get(model)
+            if bucket is None or not bucket["entries"]:
+                self.misses += 1
+                return None
+
+            # Точное совпадение не требует эмбеддинга
+            entry = bucket["exact"].get(key)
+            if entry is not None and self._is_alive(entry, now):
+                self.hits += 1
+                return {"data": entry["data"], "similarity": 1.0, "matched_message": entry["message"]}
+
+            # Короткий запрос: одно слово ("не", "80-х") меняет смысл целиком
+            if len(_words(message)) < self.min_semantic_words:
+                self.misses += 1
+                return None
+
+        guard = _guard_signature(message)
+        query = self._embed(message)
+
+        with self._lock:
+            bucket = self._buckets.get(model)
+            if bucket is None or bucket["matrix"] is None:
+                self.misses += 1
+                return None
+
+            sims = bucket["matrix"] @ query
+            comparable = np.array([e["guard"] == guard for e in bucket["entries"]])
+            if not comparable.any():
+                self.misses += 1
+                return None
+            sims = np.where(comparable, sims, -np.inf)
+            best = int(np.argmax(sims))
+            entry = bucket["entries"][best]
+
+            if sims[best] >= self.threshold and self._is_alive(entry, now):
+                self.hits += 1
+                logger.info(
+                    f"Семантический кэш: '{message}' ~ '{entry['message']}' (сходство {sims[best]:.3f})"
+                )
+                return {"data": entry["data"], "similarity": float(sims[best]), "matched_message": entry["message"]}
+
+            self.misses += 1
+            return None
+
+    def store(self, message: str, model: str, data: Dict[str, Any]):
+        """
+        Сохранение структурированного ответа
+
+        Кэшируются только найденные подборки: уточняющие вопросы зависят от контекста
+        """
+        if not self.ready or data.get("status") != "found" or not data.get("recommended_movie_ids"):
+            return
+
+        entry = {
+            "key": _normalize_message(message),
+            "message": message,
+            "embedding": self._embed(message),
+            "guard": _guard_signature(message),
+            "data": data,
+            "created_at": time.time(),
+            "catalog_version": self.catalog_version
+        }
+
+        with self._lock:
+            bucket = self._buckets.setdefault(model, {"entries": [], "exact": {}, "matrix": None})
+            bucket["entries"].append(entry)
+            self._prune(bucket, entry["created_at"])
+
+    def invalidate(self, catalog_version: Optional[str] = None):
+        """Очистка кэша, например после обновления каталога"""
+        with self._lock:
+            self._buckets.clear()
+            self.catalog_version = catalog_version or current_catalog_version()
+        logger.info(f"Семантический кэш очищен, версия каталога: {self.catalog_version}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "ready": self.ready,
+                "entries": sum(len(b["entries"]) for b in self._buckets.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "threshold": self.threshold,
+                "min_semantic_words": self.min_semantic_words,
+                "ttl_seconds": self.ttl_seconds,
+                "catalog_version": self.catalog_version
+            }
+
+    def collect_metrics(self) -> List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]:
+        """Метрики кэша для /metrics (см. metrics.register_collector)"""
+        stats = self.stats()
+        return [
+            ("okko_semantic_cache_requests_total", "counter", "Обращения к семантическому кэшу",
+             [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+            ("okko_semantic_cache_hit_ratio", "gauge", "Доля попаданий семантического кэша",
+             [({}, stats["hit_ratio"])]),
+            ("okko_semantic_cache_entries", "gauge", "Записей в семантическом кэше",
+             [({}, stats["entries"])]),
+        ]
+
+
+def create_semantic_cache_from_env() -> Optional[SemanticCache]:
+    """Создание кэша по переменным окружения (None, если кэш выключен)"""
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    return SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+        min_semantic_words=int(os.getenv("SEMANTIC_CACHE_MIN_WORDS", "4"))
+    )
@@ -10,6 +10,10 @@ import os
 from dotenv import load_dotenv
 import requests
 from celebrities_data import get_celebrity_by_id, get_all_celebrities, get_celebrity_system_prompt
+from openrouter_client import apply_prompt_caching, record_usage, post_chat_completion, get_usage_stats
+from tracing import init_tracing
+from metrics import init_metrics
+from profiling import init_profiling
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -20,10 +24,14 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+init_tracing(app, "simple_chat")
+init_metrics(app, "simple_chat", sessions=lambda: len(user_dialogs))
+init_profiling(app, "simple_chat")
 
 # Конфигурация OpenRouter
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_PROMPT_CACHING = os.getenv("OPENROUTER_PROMPT_CACHING", "true").lower() == "true"
 
 # Глобальное состояние диалогов пользователей
 user_dialogs = {}
@@ -101,22 +109,28 @@ def try_fallback_model(message, user_id, original_model, celebrity_id=None):
                 "Content-Type": "application/json"
             }
             
+            # Системный промпт и история - стабильный префикс для кэша провайдера
+            if OPENROUTER_PROMPT_CACHING:
+                messages = apply_prompt_caching(messages, fallback_model)
+            
             payload = {
                 "model": fallback_model,
                 "messages": messages,
                 "temperature": 0.7,
-                "max_tokens": 500
+                "max_tokens": 500,
+                "usage": {"include": True}
             }
             
-            response = requests.post(
+            response = post_chat_completion(
                 f"{OPENROUTER_BASE_URL}/chat/completions",
                 headers=headers,
-                json=payload,
+                payload=payload,
                 timeout=30
             )
             
             if response.status_code == 200:
                 response_data = response.json()
+                record_usage(fallback_model, response_data.get("usage"))
                 ai_response = response_data["choices"][0]["message"]["content"]
                 
                 # Сохраняем в историю диалога
@@ -291,22 +305,28 @@ def chat_message():
             "Content-Type": "application/json"
         }
         
+        # Системный промпт и история - стабильный префикс для кэша провайдера
+        if OPENROUTER_PROMPT_CACHING:
+            messages = apply_prompt_caching(messages, model)
+        
         payload = {
             "model": model,
             "messages": messages,
             "temperature": 0.7,
-            "max_tokens": 500
+            "max_tokens": 500,
+            "usage": {"include": True}
         }
         
-        response = requests.post(
+        response = post_chat_completion(
             f"{OPENROUTER_BASE_URL}/chat/completions",
             headers=headers,
-            json=payload,
+            payload=payload,
             timeout=30
         )
         
         if response.status_code == 200:
             response_data = response.json()
+            record_usage(model, response_data.get("usage"))
             ai_response = response_data["choices"][0]["message"]["content"]
             
             # Сохраняем в историю диалога
@@ -421,6 +441,15 @@ def get_available_models():
         }), 500
 
 
+@app.route('/api/chat/usage', methods=['GET'])
+def get_usage():
+    """Статистика токенов по моделям, включая токены из кэша промпта"""
+    return jsonify({
+        "success": True,
+        "usage": get_usage_stats()
+    })
+
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
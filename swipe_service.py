@@ -12,6 +12,8 @@ import json
 import numpy as np
 import pandas as pd
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Добавляем путь к модулям
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -19,13 +21,27 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Импортируем логику из okkonator.py
 from back.okkonator import (
     load_vector_db, load_movies_fallback, try_load_model, 
+    load_embeddings_snapshot, save_embeddings_snapshot,
     build_item_embeddings, embed_text, cosine_sim, profile_keywords,
     filter_and_rank, init_theta, update_theta, pick_next_question,
     QUESTIONS, LIKERT, AXES, QUESTIONS_MAX, explain
 )
+from back.sparse_embeddings import dense_row
+from tracing import init_tracing, span
+from metrics import init_metrics, Counter
+from profiling import init_profiling
+from readiness import Readiness
+from cards import CardCache, build_imdb_cards, fast_jsonify
 
 app = Flask(__name__)
 CORS(app)
+init_tracing(app, "swipe")
+init_metrics(app, "swipe", sessions=lambda: len(user_sessions))
+init_profiling(app, "swipe")
+
+# Каталог и эмбеддинги загружаются в фоне, готовность - /ready
+readiness = Readiness("swipe")
+readiness.init_app(app)
 
 # Глобальные переменные для кэширования
 df = None
@@ -34,9 +50,31 @@ model_kind = None
 model = None
 metadata = None
 
+card_cache = None  # статические поля карточек по строкам каталога
+
 # Хранилище сессий пользователей
 user_sessions = {}
 
+# Предзагрузка следующей партии: пересчет в фоне каждые N свайпов,
+# партия сбрасывается только при заметном сдвиге вектора пользователя
+PREFETCH_EVERY = int(os.getenv("SWIPE_PREFETCH_EVERY", "5"))
+PREFETCH_DRIFT = float(os.getenv("SWIPE_PREFETCH_DRIFT", "0.1"))  # 1 - косинус между векторами
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SWIPE_PREFETCH_WORKERS", "2")), thread_name_prefix="swipe-prefetch"
+)
+prefetch_lock = threading.Lock()
+
+# Исследование в партиях: доля случайных слотов (epsilon-greedy) и
+# температура softmax по сходству для остальных
+SWIPE_EPSILON = float(os.getenv("SWIPE_EPSILON", "0.2"))
+SWIPE_TEMPERATURE = float(os.getenv("SWIPE_TEMPERATURE", "0.01"))
+
+SWIPE_PREFETCH = Counter(
+    "okko_swipe_prefetch_total",
+    "Выдача партий свайпов: hit - из предзагрузки, stale - вектор сдвинулся, miss - предзагрузки не было",
+    ("result",)
+)
+
 def initialize_swipe_service():
     """Инициализация сервиса свайпов при запуске"""
     global df, ITEM_EMB, model_kind, model, metadata
@@ -46,17 +84,31 @@ def initialize_swipe_service():
     # Попытка загрузить векторную БД
     df, ITEM_EMB, metadata = load_vector_db("data")
     
+    if df is None:
+        # Снимок эмбеддингов, построенный из CSV при прошлом запуске
+        df, ITEM_EMB = load_embeddings_snapshot("data", "data/IMBD.csv", prefix="swipe")
+    
     if df is None:
         print("Загружаем данные напрямую из CSV...")
         df = load_movies_fallback("data/IMBD.csv")
         model_kind, model = try_load_model()
         ITEM_EMB = build_item_embeddings(df, model_kind, model)
+        save_embeddings_snapshot("data", df, ITEM_EMB, prefix="swipe")
     else:
-        print("Используем предварительно созданную векторную БД")
-        model_kind, model = try_load_model()
+        # Текстовая модель свайпам не нужна: вектор пользователя строится
+        # из эмбеддингов фильмов, поэтому трансформер не загружаем
+        print("Используем предварительно созданные эмбеддинги")
     
+    swipe_cards()
     print(f"Сервис свайпов готов! Загружено {len(df)} фильмов")
 
+def swipe_cards():
+    """Карточки текущего каталога (пересобираются, если каталог заменен)"""
+    global card_cache
+    if card_cache is None or card_cache.df is not df:
+        card_cache = CardCache(df, build_imdb_cards)
+    return card_cache
+
 def create_user_session():
     """Создать новую сессию пользователя"""
     session_id = f"session_{len(user_sessions)}_{random.randint(1000, 9999)}"
@@ -70,61 +122,188 @@ def create_user_session():
         'liked_movies': [],
         'disliked_movies': [],
         'current_batch': [],
-        'batch_index': 0
+        'batch_index': 0,
+        'prefetch': None,
+        # Битовая карта показанных и просвайпанных строк каталога (1 бит на фильм)
+        'seen': np.zeros((len(df) + 7) // 8 if df is not None else 0, dtype=np.uint8)
     }
     return session_id
 
+def movie_ids():
+    """Идентификаторы фильмов по строкам каталога (колонка id или индекс df)"""
+    return df.index if 'id' not in df.columns else pd.Index(df['id'])
+
+def movie_position(movie_id):
+    """Номер строки каталога по идентификатору фильма (None, если не найден)"""
+    try:
+        position = movie_ids().get_loc(movie_id)
+    except (KeyError, TypeError):
+        return None
+    # Неуникальный идентификатор: get_loc возвращает срез или маску
+    return int(position) if isinstance(position, (int, np.integer)) else None
+
+def mark_seen(session, positions):
+    """Отметить строки каталога в битовой карте сессии"""
+    positions = np.asarray([p for p in positions if p is not None], dtype=np.int64)
+    if len(positions):
+        np.bitwise_or.at(session['seen'], positions >> 3, (128 >> (positions & 7)).astype(np.uint8))
+
+def seen_mask(seen, n_rows):
+    """Битовая карта как булев массив по строкам каталога"""
+    if seen is None or len(seen) == 0:
+        return np.zeros(n_rows, dtype=bool)
+    return np.unpackbits(seen, count=n_rows).astype(bool)
+
+def sample_batch_positions(scores, available, batch_size, n_explore, rng):
+    """
+    Номера строк партии: softmax выборка по scores и равномерные слоты исследования
+    
+    Выборка без возвращения из softmax(scores) - Gumbel top-k: один
+    векторный проход по каталогу вместо сортировки и DataFrame.sample.
+    """
+    candidates = np.flatnonzero(available)
+    if len(candidates) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    
+    n_exploit = min(len(candidates), max(batch_size - n_explore, 0) * 2)
+    keys = scores[candidates] + rng.gumbel(size=len(candidates))
+    if n_exploit < len(candidates):
+        top = np.argpartition(-keys, n_exploit - 1)[:n_exploit] if n_exploit > 0 else np.array([], dtype=np.int64)
+    else:
+        top = np.arange(len(candidates))
+    exploit = candidates[top[np.argsort(-keys[top])]]
+    
+    explore = candidates[rng.choice(len(candidates), size=min(len(candidates), n_explore * 2), replace=False)]
+    return exploit, explore
+
+def build_movies_batch(user_vector, has_history, batch_size=20, seen=None):
+    """Партия фильмов для свайпов по снимку вектора пользователя (без изменения сессии)"""
+    rng = np.random.default_rng()
+    n_rows = len(df)
+    available = ~seen_mask(seen, n_rows)
+    if not available.any():
+        # Каталог просмотрен целиком - показываем заново
+        available[:] = True
+    
+    # Если у нас есть история свайпов, ранжируем по сходству с вектором пользователя,
+    # иначе (нулевые оценки) выборка равномерная
+    if has_history and np.linalg.norm(user_vector) > 0:
+        scores = np.asarray(cosine_sim(user_vector, ITEM_EMB), dtype=np.float64) / SWIPE_TEMPERATURE
+        n_explore = int(round(SWIPE_EPSILON * batch_size))
+    else:
+        scores = np.zeros(n_rows)
+        n_explore = 0
+    
+    with span("sample_batch", rows=n_rows):
+        exploit, explore = sample_batch_positions(scores, available, batch_size, n_explore, rng)
+    
+    # Без повторов названий; слоты исследования - на случайных местах партии
+    titles = df['title'].to_numpy()
+    selected, used_titles = [], set()
+    def take(positions, limit):
+        taken = []
+        for position in positions:
+            if len(taken) >= limit:
+                break
+            if position in selected or position in taken or titles[position] in used_titles:
+                continue
+            taken.append(position)
+            used_titles.add(titles[position])
+        return taken
+    
+    selected = take(exploit, batch_size - n_explore)
+    for position in take(explore, batch_size - len(selected)):
+        selected.insert(int(rng.integers(0, len(selected) + 1)), position)
+    selected += take(exploit, batch_size - len(selected))
+    
+    # Карточки для фронтенда из предрассчитанных
+    return swipe_cards().get(selected)
+
+def vector_drift(a, b):
+    """Сдвиг вектора пользователя: 1 - косинус"""
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    if norm == 0:
+        return 0.0 if np.linalg.norm(a) == np.linalg.norm(b) else 1.0
+    return float(1.0 - np.dot(a, b) / norm)
+
+def schedule_prefetch(session, batch_size=20, replace=False):
+    """
+    Запуск фонового расчета следующей партии по текущему вектору пользователя
+    
+    Идущий расчет не дублируется; replace=True заменяет его результатом по новому вектору.
+    """
+    with prefetch_lock:
+        current = session.get('prefetch')
+        if current is not None and not current['future'].done():
+            if not replace:
+                return
+            current['future'].cancel()
+        user_vector = np.array(session['user_vector'], copy=True)
+        has_history = len(session['swipe_history']) > 0
+        session['prefetch'] = {
+            'future': prefetch_executor.submit(
+                build_movies_batch, user_vector, has_history, batch_size, session['seen'].copy()
+            ),
+            'user_vector': user_vector,
+            'batch_size': batch_size,
+            'swipe_count': len(session['swipe_history'])
+        }
+
+def take_prefetched_batch(session, batch_size):
+    """Предзагруженная партия, если она посчитана для того же размера и близкого вектора"""
+    with prefetch_lock:
+        prefetch = session.get('prefetch')
+        session['prefetch'] = None
+    if prefetch is None or prefetch['batch_size'] != batch_size:
+        SWIPE_PREFETCH.inc(result="miss")
+        return None
+    if vector_drift(prefetch['user_vector'], session['user_vector']) > PREFETCH_DRIFT:
+        prefetch['future'].cancel()
+        SWIPE_PREFETCH.inc(result="stale")
+        return None
+    try:
+        # Расчет уже идет по свежему вектору: дождаться его быстрее, чем начать заново
+        movies = prefetch['future'].result()
+    except Exception as e:
+        print(f"Ошибка предзагрузки партии: {e}")
+        SWIPE_PREFETCH.inc(result="miss")
+        return None
+    SWIPE_PREFETCH.inc(result="hit")
+    return movies
+
 def get_next_movies_batch(session_id, batch_size=20):
     """Получить следующую партию фильмов для свайпов"""
     if session_id not in user_sessions:
         return None
     
     session = user_sessions[session_id]
-    user_vector = session['user_vector']
     
-    # Если у нас есть история свайпов, получаем рекомендации на основе вектора пользователя
-    if len(session['swipe_history']) > 0 and np.linalg.norm(user_vector) > 0:
-        # Вычисляем косинусное сходство с вектором пользователя
-        similarities = cosine_sim(user_vector, ITEM_EMB)
-        
-        # Сортируем фильмы по сходству
-        df_with_sim = df.copy()
-        df_with_sim['similarity'] = similarities
-        recommendations = df_with_sim.sort_values('similarity', ascending=False).head(batch_size * 2)
-    else:
-        # Если нет истории свайпов, берем случайные фильмы
-        recommendations = df.sample(n=min(batch_size * 2, len(df)))
-    
-    # Добавляем случайные фильмы для разнообразия
-    random_movies = df.sample(n=min(batch_size, len(df)))
-    
-    # Объединяем рекомендации и случайные фильмы
-    all_movies = pd.concat([recommendations, random_movies]).drop_duplicates(subset=['title'])
-    
-    # Выбираем batch_size фильмов
-    selected_movies = all_movies.head(batch_size)
-    
-    # Форматируем для фронтенда
-    movies_data = []
-    for i, (_, row) in enumerate(selected_movies.iterrows()):
-        movie_data = {
-            "id": int(row.get('id', i)),
-            "title": str(row['title']),
-            "year": int(row['year']),
-            "genre": str(row['genre']),
-            "rating": float(row['rating']),
-            "duration": int(row['duration']),
-            "votes": f"{int(row['votes']):,}" if 'votes' in row else "N/A",
-            "description": str(row.get('description', '')),
-            "poster": f"https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=400&h=600&fit=crop"  # Заглушка
-        }
-        movies_data.append(movie_data)
+    movies_data = take_prefetched_batch(session, batch_size)
+    if movies_data is None:
+        movies_data = build_movies_batch(
+            session['user_vector'], len(session['swipe_history']) > 0, batch_size, session['seen']
+        )
     
     session['current_batch'] = movies_data
     session['batch_index'] = 0
+    # Показанные карточки не попадут в следующие партии
+    mark_seen(session, [movie_position(movie['id']) for movie in movies_data])
+    
+    # Следующая партия считается, пока пользователь свайпает текущую
+    schedule_prefetch(session, batch_size)
     
     return movies_data
 
+def refresh_prefetch_after_swipe(session):
+    """Пересчет предзагрузки каждые PREFETCH_EVERY свайпов или при сдвиге вектора"""
+    prefetch = session.get('prefetch')
+    batch_size = prefetch['batch_size'] if prefetch is not None else len(session['current_batch']) or 20
+    if prefetch is not None:
+        swipes_since = len(session['swipe_history']) - prefetch['swipe_count']
+        if swipes_since < PREFETCH_EVERY and vector_drift(prefetch['user_vector'], session['user_vector']) <= PREFETCH_DRIFT:
+            return
+    schedule_prefetch(session, batch_size, replace=True)
+
 def update_profile_from_swipes(session):
     """Обновить вектор пользователя на основе истории свайпов"""
     user_vector = session['user_vector']
@@ -149,16 +328,14 @@ def get_movie_vector(movie_id):
     if ITEM_EMB is None or df is None:
         return None
     
-    # Находим индекс фильма в DataFrame
-    movie_indices = df[df.get('id', df.index) == movie_id].index
-    if len(movie_indices) == 0:
+    # Находим строку фильма в каталоге
+    movie_index = movie_position(movie_id)
+    if movie_index is None:
         return None
     
-    movie_index = movie_indices[0]
-    
-    # Получаем вектор фильма из эмбеддингов
-    if movie_index < len(ITEM_EMB):
-        return ITEM_EMB[movie_index]
+    # Получаем вектор фильма из эмбеддингов (строка CSR в TF-IDF режиме - плотной копией)
+    if movie_index < ITEM_EMB.shape[0]:
+        return dense_row(ITEM_EMB, movie_index)
     
     return None
 
@@ -186,26 +363,30 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "movies_loaded": len(df) if df is not None else 0,
-        "model_ready": model is not None,
+        "embeddings_ready": ITEM_EMB is not None,
+        "ready": readiness.ready,
         "active_sessions": len(user_sessions)
     })
 
 @app.route('/api/swipe/start', methods=['POST'])
+@readiness.required
 def start_swipe_session():
     """Начать новую сессию свайпов"""
     data = request.get_json()
     batch_size = data.get('batch_size', 20)
     
     session_id = create_user_session()
-    movies = get_next_movies_batch(session_id, batch_size)
+    with span("get_next_movies_batch", batch_size=batch_size):
+        movies = get_next_movies_batch(session_id, batch_size)
     
-    return jsonify({
+    return fast_jsonify({
         "session_id": session_id,
         "movies": movies,
         "total_movies": len(movies)
     })
 
 @app.route('/api/swipe/action', methods=['POST'])
+@readiness.required
 def handle_swipe_action():
     """Обработать действие свайпа"""
     data = request.get_json()
@@ -228,6 +409,8 @@ def handle_swipe_action():
         'timestamp': pd.Timestamp.now().isoformat()
     })
     
+    mark_seen(session, [movie_position(movie_id)])
+    
     # Добавляем в соответствующий список
     if action == 'like':
         session['liked_movies'].append(movie_id)
@@ -237,6 +420,7 @@ def handle_swipe_action():
     # Обновляем вектор пользователя
     weight = 0.1 if action == 'like' else -0.1
     session['user_vector'] = update_user_vector_from_movie(session['user_vector'], movie_id, weight)
+    refresh_prefetch_after_swipe(session)
     
     return jsonify({
         "success": True,
@@ -247,6 +431,7 @@ def handle_swipe_action():
     })
 
 @app.route('/api/swipe/next-batch', methods=['POST'])
+@readiness.required
 def get_next_batch():
     """Получить следующую партию фильмов"""
     data = request.get_json()
@@ -256,9 +441,10 @@ def get_next_batch():
     if session_id not in user_sessions:
         return jsonify({"error": "Сессия не найдена"}), 404
     
-    movies = get_next_movies_batch(session_id, batch_size)
+    with span("get_next_movies_batch", batch_size=batch_size):
+        movies = get_next_movies_batch(session_id, batch_size)
     
-    return jsonify({
+    return fast_jsonify({
         "movies": movies,
         "total_movies": len(movies)
     })
@@ -288,6 +474,7 @@ def get_user_profile():
     })
 
 @app.route('/api/swipe/recommendations', methods=['POST'])
+@readiness.required
 def get_swipe_recommendations():
     """Получить рекомендации на основе свайпов"""
     data = request.get_json()
@@ -304,32 +491,21 @@ def get_swipe_recommendations():
         # Вычисляем косинусное сходство с вектором пользователя
         similarities = cosine_sim(user_vector, ITEM_EMB)
         
-        # Сортируем фильмы по сходству
-        df_with_sim = df.copy()
-        df_with_sim['similarity'] = similarities
-        recommendations = df_with_sim.sort_values('similarity', ascending=False).head(top_k)
+        # Лидеры по сходству без сортировки всего каталога
+        with span("sort_top_k"):
+            top_k = min(int(top_k), len(similarities))
+            top = np.argpartition(-similarities, top_k - 1)[:top_k] if top_k < len(similarities) else np.arange(top_k)
+            top = top[np.argsort(-similarities[top], kind="stable")]
         
         # Форматируем результат
-        result = []
-        for i, (_, row) in enumerate(recommendations.iterrows()):
-            votes_str = f"{int(row['votes']):,}" if 'votes' in row else "N/A"
-            
-            movie_data = {
-                "id": int(row.get('id', i)),
-                "title": str(row['title']),
-                "year": int(row['year']),
-                "genre": str(row['genre']),
-                "rating": float(row['rating']),
-                "duration": int(row['duration']),
-                "votes": votes_str,
-                "description": str(row.get('description', '')),
-                "similarity": float(row['similarity']),
-                "reason": f"Сходство: {row['similarity']:.3f}",
-                "poster": f"https://images.unsplash.com/photo-1518709268805-4e9042af2176?w=400&h=600&fit=crop"
-            }
-            result.append(movie_data)
+        top_similarities = similarities[top].tolist()
+        result = swipe_cards().get(
+            top,
+            similarity=top_similarities,
+            reason=[f"Сходство: {sim:.3f}" for sim in top_similarities]
+        )
         
-        return jsonify({
+        return fast_jsonify({
             "recommendations": result,
             "user_vector_norm": float(np.linalg.norm(user_vector)),
             "total_found": len(result)
@@ -353,20 +529,22 @@ def get_session_info(session_id):
         "liked_count": len(session['liked_movies']),
         "disliked_count": len(session['disliked_movies']),
         "current_batch_size": len(session['current_batch']),
+        "next_batch_prefetched": session['prefetch'] is not None and session['prefetch']['future'].done(),
         "user_vector_norm": float(np.linalg.norm(session['user_vector']))
     })
 
 @app.route('/api/swipe/debug/movie/<int:movie_id>')
+@readiness.required
 def debug_movie_features(movie_id):
     """Отладочный эндпоинт для просмотра вектора фильма"""
     if df is None or ITEM_EMB is None:
         return jsonify({"error": "База данных не загружена"}), 500
     
-    movie = df[df.get('id', df.index) == movie_id]
-    if movie.empty:
+    position = movie_position(movie_id)
+    if position is None:
         return jsonify({"error": "Фильм не найден"}), 404
     
-    row = movie.iloc[0]
+    row = df.iloc[position]
     movie_vector = get_movie_vector(movie_id)
     
     return jsonify({
@@ -383,6 +561,9 @@ def debug_movie_features(movie_id):
 
 if __name__ == '__main__':
     print("Запуск микросервиса свайпов...")
-    initialize_swipe_service()
+    # Сервер отвечает сразу, свайпы доступны после загрузки каталога (/ready)
+    readiness.start(initialize_swipe_service)
     print("Микросервис свайпов запущен на порту 5002")
-    app.run(debug=True, host='0.0.0.0', port=5002)
+    # Без перезагрузчика: он запускает процесс дважды и грузит каталог повторно
+    debug = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+    app.run(debug=debug, use_reloader=False, host='0.0.0.0', port=5002)
@@ -0,0 +1,363 @@
+"""
+Легковесная трассировка запросов между сервисами
+
+- X-Request-ID принимается из входящего запроса (или генерируется) и
+  передается дальше через outgoing_headers() в прокси app.py
+- span("name") замеряет этап запроса (embed_text, cosine_sim, БД, OpenRouter)
+- завершенные трассы хранятся в кольцевом буфере и доступны через
+  /debug/traces, а при заданном TRACING_OTLP_ENDPOINT фоново отправляются
+  в локальный OTLP/HTTP JSON коллектор (например, http://localhost:4318/v1/traces)
+
+По умолчанию выключено (TRACING_ENABLED): spans содержат тексты SQL и
+тайминги запросов. /debug/traces регистрируется только при непустом
+TRACING_TOKEN и требует его в заголовке X-Trace-Token.
+
+Вне запроса (скрипты, тесты) span() ничего не делает.
+"""
+
+import os
+import hmac
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+
+import requests
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+PARENT_SPAN_HEADER = "X-Parent-Span-ID"
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACING_TOKEN = os.getenv("TRACING_TOKEN", "")
+TOKEN_HEADER = "X-Trace-Token"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACING_BUFFER_SIZE", "200"))
+OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT") or None
+EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "2"))
+
+# Активная трасса и текущий span в контексте запроса
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span_id: contextvars.ContextVar = contextvars.ContextVar("current_span_id", default=None)
+
+# Последние трассы: request_id -> trace
+_recent_traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+_export_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+_exporter_thread = None
+_service_name = "unknown"
+
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _trace_id_for(request_id: str) -> str:
+    """OTLP trace id (32 hex) из произвольного request id"""
+    if len(request_id) == 32 and all(c in "0123456789abcdef" for c in request_id):
+        return request_id
+    return hashlib.md5(request_id.encode("utf-8")).hexdigest()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace["request_id"] if trace else None
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """Заголовки для запросов к другим сервисам (продолжение трассы)"""
+    request_id = current_request_id()
+    if not request_id:
+        return {}
+    headers = {REQUEST_ID_HEADER: request_id}
+    parent_span_id = _current_span_id.get()
+    if parent_span_id:
+        headers[PARENT_SPAN_HEADER] = parent_span_id
+    return headers
+
+
+def start_trace(
+    request_id: Optional[str] = None,
+    service: Optional[str] = None,
+    parent_span_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Начало трассы для текущего контекста (parent_span_id - span вызывающего сервиса)"""
+    request_id = request_id or uuid.uuid4().hex
+    trace = {
+        "request_id": request_id,
+        "trace_id": _trace_id_for(request_id),
+        "service": service or _service_name,
+        "started_at": time.time(),
+        "spans": [],
+    }
+    _current_trace.set(trace)
+    _current_span_id.set(parent_span_id)
+    return trace
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Замер этапа запроса
+
+    Пример:
+        with span("cosine_sim", rows=len(embeddings)):
+            sims = embeddings @ query
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    span_id = _new_span_id()
+    parent_id = _current_span_id.get()
+    token = _current_span_id.set(span_id)
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    record = {
+        "name": name,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "start_ns": start_ns,
+        "attributes": attributes,
+        "status": "ok",
+    }
+    try:
+        yield record
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        raise
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        record["end_ns"] = start_ns + int(record["duration_ms"] * 1e6)
+        _current_span_id.reset(token)
+        trace["spans"].append(record)
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: вызов функции как отдельный span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+def stage_timings(trace: Dict[str, Any]) -> Dict[str, float]:
+    """Суммарное время по этапам (имя span -> мс)"""
+    timings: Dict[str, float] = {}
+    for record in trace["spans"]:
+        timings[record["name"]] = timings.get(record["name"], 0.0) + record["duration_ms"]
+    return {name: round(ms, 3) for name, ms in timings.items()}
+
+
+def finish_trace(trace: Dict[str, Any]):
+    """Сохранение завершенной трассы в буфер и очередь экспорта"""
+    _current_trace.set(None)
+    _current_span_id.set(None)
+
+    with _recent_lock:
+        _recent_traces[trace["request_id"] + ":" + trace["service"]] = trace
+        while len(_recent_traces) > TRACE_BUFFER_SIZE:
+            _recent_traces.popitem(last=False)
+
+    if OTLP_ENDPOINT:
+        try:
+            _export_queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning("Очередь экспорта трасс переполнена, трасса отброшена")
+
+
+def get_trace(request_id: str) -> List[Dict[str, Any]]:
+    """Трассы запроса во всех сервисах этого процесса"""
+    with _recent_lock:
+        return [t for key, t in _recent_traces.items() if key.rsplit(":", 1)[0] == request_id]
+
+
+def recent_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    """Краткая сводка последних трасс"""
+    with _recent_lock:
+        traces = list(_recent_traces.values())[-limit:]
+    return [
+        {
+            "request_id": t["request_id"],
+            "service": t["service"],
+            "route": t.get("route"),
+            "duration_ms": t.get("duration_ms"),
+            "stages": stage_timings(t),
+        }
+        for t in reversed(traces)
+    ]
+
+
+def _to_otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(traces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Трассы в формате OTLP/JSON (ExportTraceServiceRequest)"""
+    by_service: Dict[str, List[Dict[str, Any]]] = {}
+    for trace in traces:
+        for record in trace["spans"]:
+            otlp_span = {
+                "traceId": trace["trace_id"],
+                "spanId": record["span_id"],
+                "name": record["name"],
+                "kind": 2 if record["span_id"] == trace.get("root_span_id") else 1,
+                "startTimeUnixNano": str(record["start_ns"]),
+                "endTimeUnixNano": str(record["end_ns"]),
+                "attributes": [
+                    {"key": key, "value": _to_otlp_value(value)}
+                    for key, value in dict(record["attributes"], **{"request.id": trace["request_id"]}).items()
+                ],
+                "status": {"code": 2 if record["status"] == "error" else 1},
+            }
+            if record["parent_id"]:
+                otlp_span["parentSpanId"] = record["parent_id"]
+            by_service.setdefault(trace["service"], []).append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                "scopeSpans": [{"scope": {"name": "okko-tracing"}, "spans": spans}],
+            }
+            for service, spans in by_service.items()
+        ]
+    }
+
+
+def _export_loop():
+    """Фоновая пакетная отправка трасс в коллектор"""
+    session = requests.Session()
+    while True:
+        batch = [_export_queue.get()]
+        deadline = time.time() + EXPORT_INTERVAL
+        while time.time() < deadline and len(batch) < 500:
+            try:
+                batch.append(_export_queue.get(timeout=max(0.01, deadline - time.time())))
+            except queue.Empty:
+                break
+        try:
+            session.post(OTLP_ENDPOINT, json=_to_otlp(batch), timeout=5)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить {len(batch)} трасс в {OTLP_ENDPOINT}: {e}")
+
+
+def _start_exporter():
+    global _exporter_thread
+    if OTLP_ENDPOINT and _exporter_thread is None:
+        _exporter_thread = threading.Thread(target=_export_loop, daemon=True)
+        _exporter_thread.start()
+        logger.info(f"Экспорт трасс в {OTLP_ENDPOINT}")
+
+
+def init_tracing(app, service_name: str):
+    """
+    Подключение трассировки к Flask приложению
+
+    Каждый запрос получает X-Request-ID (входящий или новый) и корневой span,
+    заголовок возвращается в ответе. При заданном TRACING_TOKEN добавляет
+    /debug/traces и /debug/traces/<request_id> (токен в X-Trace-Token).
+    """
+    global _service_name
+    _service_name = service_name
+
+    if not TRACING_ENABLED:
+        return
+
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _tracing_before_request():
+        trace = start_trace(
+            request.headers.get(REQUEST_ID_HEADER), service_name, request.headers.get(PARENT_SPAN_HEADER)
+        )
+        trace["route"] = f"{request.method} {request.path}"
+        g._trace_start = time.perf_counter()
+        g._trace_root = span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        g._trace_root_record = g._trace_root.__enter__()
+        trace["root_span_id"] = g._trace_root_record["span_id"]
+
+    @app.after_request
+    def _tracing_after_request(response):
+        trace = _current_trace.get()
+        if trace is not None:
+            response.headers[REQUEST_ID_HEADER] = trace["request_id"]
+            trace["status_code"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _tracing_teardown(exc):
+        trace = _current_trace.get()
+        root = g.pop("_trace_root", None)
+        if trace is None or root is None:
+            return
+        g.pop("_trace_root_record")["attributes"]["http.status_code"] = trace.get("status_code", 500)
+        root.__exit__(None, None, None)
+        trace["duration_ms"] = round((time.perf_counter() - g.pop("_trace_start")) * 1000, 3)
+        finish_trace(trace)
+
+    _start_exporter()
+
+    if not TRACING_TOKEN:
+        logger.info(f"TRACING_TOKEN не задан: /debug/traces для {service_name} не регистрируется")
+        return
+
+    def _authorized() -> bool:
+        token = request.headers.get(TOKEN_HEADER, "")
+        return hmac.compare_digest(token.encode("utf-8"), TRACING_TOKEN.encode("utf-8"))
+
+    @app.route('/debug/traces')
+    def _debug_traces():
+        if not _authorized():
+            return jsonify({"success": False, "error": "Неверный токен трассировки"}), 403
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({"service": service_name, "traces": recent_traces(limit)})
+
+    @app.route('/debug/traces/<request_id>')
+    def _debug_trace(request_id):
+        if not _authorized():
+            return jsonify({"success": False, "error": "Неверный токен трассировки"}), 403
+        traces = get_trace(request_id)
+        if not traces:
+            return jsonify({"success": False, "error": "Трасса не найдена"}), 404
+        return jsonify({
+            "success": True,
+            "request_id": request_id,
+            "traces": [
+                {
+                    "service": t["service"],
+                    "route": t.get("route"),
+                    "duration_ms": t.get("duration_ms"),
+                    "stages": stage_timings(t),
+                    "spans": [
+                        {k: v for k, v in s.items() if k not in ("start_ns", "end_ns")}
+                        for s in sorted(t["spans"], key=lambda s: s["start_ns"])
+                    ],
+                }
+                for t in traces
+            ],
+        })